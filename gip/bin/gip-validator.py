@@ -178,38 +178,31 @@ class LdapData:
                 return False
         return True
 
-def read_ldap(fp, multi=False):
-    entry_started = False
-    mybuffer = ''
-    entries = []
-    counter = 0
-    lines = fp.readlines()
-
-    for line in lines[1:]:
-        counter += 1
-        if line.startswith('dn:'):
-            if lines[counter-1].strip():
-                lines.insert(counter-1, '\n')
-
-    for origline in lines:
+def iter_ldap(fp, multi=False):
+    lines = []
+    for origline in fp:
         line = origline.strip()
-        if len(line) == 0 and entry_started == True:
-            entries.append(LdapData(mybuffer[1:], multi=multi))
-            entry_started = False
-            mybuffer = ''
-        elif len(line) == 0 and entry_started == False:
-            pass
-        else: # len(line) > 0
-            if not entry_started:
-                entry_started = True
-            if origline.startswith(' '):
-                mybuffer += origline[1:-1]
-            else:
-                mybuffer += '\n' + line
+        if not line:
+            if lines:
+                yield _ldap_from_lines(lines, multi)
+                lines = []
+        elif origline[0] == ' ' and lines:
+            lines[-1].append(origline[1:].rstrip('\r\n'))
+        else:
+            if lines and line.startswith('dn:'):
+                yield _ldap_from_lines(lines, multi)
+                lines = []
+            lines.append([line])
 
-    if entry_started == True:
-        entries.append(LdapData(mybuffer[1:], multi=multi))
-    return entries
+    if lines:
+        yield _ldap_from_lines(lines, multi)
+
+def _ldap_from_lines(lines, multi):
+    return LdapData('\n'.join([''.join(parts) for parts in lines]),
+        multi=multi)
+
+def read_ldap(fp, multi=False):
+    return list(iter_ldap(fp, multi=multi))
 
 def query_bdii(endpoint, query="(objectClass=GlueCE)", base="o=grid", ldap_filter=""):
     r = re.compile('ldap://(.*):([0-9]*)')
@@ -12,25 +12,38 @@ easier.
 
 import sys
 import os
+import copy
 import gip_sets as sets
 import time
 import types
-import cStringIO
 import xml
 from xml.sax import make_parser, SAXParseException
 from xml.sax.handler import ContentHandler, feature_external_ges
 
 from gip_common import voList, cp_getBoolean, getLogger, cp_get, voList, \
     VoMapper, cp_getInt, cp_getList
-from gip_testing import runCommand
+from gip_testing import runCommand, runCommands
+from gip_batch import BatchQueries
 
 condor_version = "condor_version"
 condor_group = "condor_config_val %(daemon)s GROUP_NAMES"
 condor_quota = "condor_config_val %(daemon)s GROUP_QUOTA_%(group)s"
 condor_prio = "condor_config_val %(daemon)s GROUP_PRIO_FACTOR_%(group)s"
+condor_group_dump = "condor_config_val %(daemon)s -dump GROUP_"
 condor_status = "condor_status -xml -constraint '%(constraint)s'"
 condor_status_submitter = "condor_status -submitter -xml -constraint '%(constraint)s'"
 condor_job_status = "condor_q -xml -constraint '%(constraint)s'"
+condor_job_autoformat = "condor_q -constraint '%(constraint)s' -autoformat " \
+    "JobStatus Owner 'FlockFrom =!= UNDEFINED' AccountingGroup"
+condor_schedds = "condor_status -schedd -xml -constraint '%(constraint)s'"
+condor_schedd_job_status = "condor_q -name '%(schedd)s' -xml " \
+    "-constraint '%(constraint)s'"
+condor_schedd_job_autoformat = "condor_q -name '%(schedd)s' -constraint " \
+    "'%(constraint)s' -autoformat JobStatus Owner 'FlockFrom =!= UNDEFINED' " \
+    "AccountingGroup"
+
+# The first Condor version whose condor_q understands -autoformat.
+autoformat_version = (7, 6, 0)
 
 log = getLogger("GIP.Condor")
 
@@ -46,6 +59,9 @@ class ClassAdParser(ContentHandler):
     Condor attribute passed in as 'idx' to the constructor; the value is another
     dictionary of key-value pairs from the condor JDL, where the keys is in
     the attribute list passed to the constructor.
+
+    Only the text of the attributes in the attribute list is collected; the
+    rest of each classad is skipped over.
     """
 
     def __init__(self, idx, attrlist=None): #pylint: disable-msg=W0231
@@ -62,11 +78,14 @@ class ClassAdParser(ContentHandler):
             for name in idx:
                 if name not in self.attrlist:
                     self.attrlist.append(name)
-        if self.attrlist and idx not in self.attrlist:
+        elif self.attrlist and idx and idx not in self.attrlist:
             self.attrlist.append(idx)
+        self.attrset = dict([(name, True) for name in self.attrlist])
         self.idxAttr = idx
         self.caInfo = {}
-        self.attrInfo = ''
+        self.caCount = 0
+        self.attrInfo = []
+        self.recording = False
         # Initialize some used class variables.
         self._starttime = time.time()
         self._endtime = time.time()
@@ -78,8 +97,9 @@ class ClassAdParser(ContentHandler):
         """
         Start up a parsing sequence; initialize myself.
         """
-        self.attrInfo = ''
-        self.caInfo = {}
+        self.attrInfo = []
+        self.recording = False
+        self.caCount = 0
         self._starttime = time.time()
    
     def endDocument(self):
@@ -88,7 +108,7 @@ class ClassAdParser(ContentHandler):
         """
         self._endtime = time.time()
         self._elapsed = self._endtime - self._starttime
-        myLen = len(self.caInfo)
+        myLen = self.caCount
         log.info("Processed %i classads in %.2f seconds; %.2f classads/" \
                  "second" % (myLen,
                              self._elapsed, myLen/(self._elapsed+1e-10)))
@@ -102,7 +122,9 @@ class ClassAdParser(ContentHandler):
             self.curCaInfo = {}
         elif name == 'a':
             self.attrName = str(attrs.get('n', 'Unknown'))
-            self.attrInfo = ''
+            self.recording = not self.attrset or self.attrName in self.attrset
+            if self.recording:
+                self.attrInfo = []
         else:
             pass
 
@@ -111,21 +133,12 @@ class ClassAdParser(ContentHandler):
         End of an XML element - save everything we learned
         """
         if name == 'c':
-            if isinstance(self.idxAttr, types.TupleType):
-                full_idx = ()
-                for idx in self.idxAttr:
-                    idx = self.curCaInfo.get(idx, None)
-                    if idx:
-                        full_idx += (idx,)
-                if len(full_idx) == len(self.idxAttr):
-                    self.caInfo[full_idx] = self.curCaInfo
-            else:
-                idx = self.curCaInfo.get(self.idxAttr, None)
-                if idx:
-                    self.caInfo[idx] = self.curCaInfo
+            self.caCount += 1
+            self.addClassAd(self.curCaInfo)
         elif name == 'a':
-            if self.attrName in self.attrlist or len(self.attrlist) == 0:
-                self.curCaInfo[self.attrName] = self.attrInfo
+            if self.recording:
+                self.curCaInfo[self.attrName] = str(''.join(self.attrInfo))
+                self.recording = False
         else:
             pass
 
@@ -133,7 +146,26 @@ class ClassAdParser(ContentHandler):
         """
         Save up the XML characters found in the attribute.
         """
-        self.attrInfo += str(ch)
+        if self.recording:
+            self.attrInfo.append(ch)
+
+    def addClassAd(self, caInfo):
+        """
+        Save a completed classad under its index; subclasses may override
+        this to process the classad some other way.
+        """
+        if isinstance(self.idxAttr, types.TupleType):
+            full_idx = ()
+            for idx in self.idxAttr:
+                idx = caInfo.get(idx, None)
+                if idx:
+                    full_idx += (idx,)
+            if len(full_idx) == len(self.idxAttr):
+                self.caInfo[full_idx] = caInfo
+        else:
+            idx = caInfo.get(self.idxAttr, None)
+            if idx:
+                self.caInfo[idx] = caInfo
 
     def getClassAds(self):
         """
@@ -142,6 +174,126 @@ class ClassAdParser(ContentHandler):
         """
         return self.caInfo
 
+class JobAggregator(ClassAdParser):
+    """
+    Streaming SAX handler for the output of condor_q -xml which folds each
+    job straight into per-owner counters instead of keeping its classad, so
+    memory use grows with the number of owners rather than with the number
+    of jobs.
+
+    getClassAds returns a dictionary keyed on the owner (the accounting group
+    and user, if there is one); the values are dictionaries with the
+    B{IdleJobs}, B{RunningJobs}, B{FlockedJobs}, and B{HeldJobs} counts.
+    """
+
+    def __init__(self, ownerInfo=None):
+        """
+        @keyword ownerInfo: A dictionary of per-owner information to add the
+            job counts to.
+        """
+        ClassAdParser.__init__(self, None, ['JobStatus', 'Owner',
+            'AccountingGroup', 'FlockFrom'])
+        if ownerInfo is not None:
+            self.caInfo = ownerInfo
+
+    def addClassAd(self, values):
+        self.addJob(values.get('JobStatus', -1), values.get('Owner', None),
+            values.get('AccountingGroup', None), 'FlockFrom' in values)
+
+    def addJob(self, status, owner, group, flocked):
+        """
+        Count a single job.
+
+        @param status: The JobStatus of the job.
+        @param owner: The Owner of the job, or None.
+        @param group: The AccountingGroup of the job, or None.
+        @param flocked: True if the job was flocked in from another schedd.
+        """
+        if group is not None and owner is not None and group.find('.') < 0:
+            owner = '%s.%s' % (group, owner)
+        elif group is not None:
+            owner = group
+        if not owner:
+            return
+        owner_info = self.caInfo.setdefault(owner, {})
+        try:
+            status = int(status)
+        except:
+            return
+        # We ignore states Unexpanded (U, 0), Removed (R, 2), Completed (C, 4),
+        # Held (H, 5), and Submission_err (E, 6)
+        if status == 1: # Idle
+            key = 'IdleJobs'
+        elif status == 2: # Running
+            if flocked:
+                key = 'FlockedJobs'
+            else:
+                key = 'RunningJobs'
+        elif status == 5: # Held
+            key = 'HeldJobs'
+        else:
+            return
+        owner_info[key] = owner_info.get(key, 0) + 1
+
+class CondorXmlFile:
+    """
+    File-like wrapper around condor output which skips any junk lines before
+    the XML declaration (printed by Condor < 7.3.2), without reading the rest
+    of the output into memory.
+    """
+
+    def __init__(self, fp):
+        self.fp = fp
+        self.head = ''
+        while True:
+            line = fp.readline()
+            if not line or line.find('<?xml') >= 0:
+                self.head = line
+                break
+
+    def read(self, size=-1):
+        if self.head:
+            data, self.head = self.head, ''
+            return data
+        return self.fp.read(size)
+
+    def close(self):
+        return self.fp.close()
+
+def parseCondorAutoformat(fp, handler): #pylint: disable-msg=C0103
+    """
+    Count the jobs in the output of condor_job_autoformat.
+
+    Each line holds a job's JobStatus, Owner, whether FlockFrom is defined,
+    and AccountingGroup, separated by spaces; undefined values are printed as
+    "undefined".
+
+    @param fp: A file-like object containing the condor_q output.
+    @param handler: The JobAggregator to count the jobs into.
+    """
+    starttime = time.time()
+    addJob = handler.addJob
+    count = 0
+    for line in fp:
+        fields = line.split()
+        if len(fields) == 4:
+            status, owner, flocked, group = fields
+            if group == 'undefined':
+                group = None
+        elif len(fields) == 3: # An empty AccountingGroup prints nothing.
+            status, owner, flocked = fields
+            group = None
+        else:
+            continue
+        if owner == 'undefined':
+            owner = None
+        addJob(status, owner, group, flocked == 'true')
+        count += 1
+    handler.caCount = count
+    elapsed = time.time() - starttime
+    log.info("Processed %i jobs in %.2f seconds; %.2f jobs/second" % (count,
+        elapsed, count/(elapsed+1e-10)))
+
 def parseCondorXml(fp, handler): #pylint: disable-msg=C0103
     """
     Parse XML from Condor.
@@ -230,6 +382,42 @@ def getLrmsInfo(cp): #pylint: disable-msg=C0103
     log.exception(ve)
     raise ve
 
+def parseVersion(version):
+    """
+    Turn the version returned by getLrmsInfo into a tuple of integers, so
+    versions can be compared.
+
+    @param version: The condor version, such as "7.4.0 Oct 19 2009 ...".
+    @returns: A tuple such as (7, 4, 0), or None if the version is not
+        understood.
+    """
+    try:
+        return tuple([int(i) for i in version.split()[0].split('.')])
+    except (AttributeError, IndexError, ValueError):
+        return None
+
+def useAutoformat(cp, version):
+    """
+    Decide whether to count jobs with condor_q -autoformat, which prints only
+    the attributes we need, instead of condor_q -xml.
+
+    This is controlled by [condor] jobs_format: "xml" or "autoformat" force
+    the choice, while the default, "auto", uses -autoformat if the Condor
+    version supports it.
+
+    @param cp: The GIP configuration object
+    @param version: The condor version from getLrmsInfo, or None.
+    """
+    jobs_format = cp_get(cp, "condor", "jobs_format", "auto").lower()
+    if jobs_format == "xml":
+        return False
+    if jobs_format == "autoformat":
+        return True
+    if jobs_format != "auto":
+        log.warning("Unknown jobs_format %s; using auto." % jobs_format)
+    version = parseVersion(version)
+    return version is not None and version >= autoformat_version
+
 def getGroupInfo(vo_map, cp): #pylint: disable-msg=C0103,W0613
     """
     Get the group info from condor
@@ -281,12 +469,15 @@ def getGroupInfo(vo_map, cp): #pylint: disable-msg=C0103,W0613
     retval = {}
     if (not (grouplist[0].startswith('Not defined'))) and \
             (len(grouplist[0]) > 0):
+        if vo_map is None:
+            vo_map = VoMapper(cp)
+        groupConfig = getGroupConfig(cp, configDaemon)
         for group in grouplist:
-            quota = condorCommand(condor_quota, cp, \
-                {'group': group, 'daemon': configDaemon}).read().strip()
-            prio = condorCommand(condor_prio, cp, \
-                {'group': group, 'daemon': configDaemon}).read().strip()
-            vos = guessVO(cp, group)
+            quota = groupConfigValue(groupConfig, condor_quota, "GROUP_QUOTA_%s",
+                group, cp, configDaemon)
+            prio = groupConfigValue(groupConfig, condor_prio,
+                "GROUP_PRIO_FACTOR_%s", group, cp, configDaemon)
+            vos = guessVO(cp, group, vo_map)
             if not vos:
                 continue
             curInfo = {'quota': 0, 'prio': 0, 'vos': vos}
@@ -302,17 +493,71 @@ def getGroupInfo(vo_map, cp): #pylint: disable-msg=C0103,W0613
     log.debug("The condor groups are %s." % ', '.join(retval.keys()))
     return retval
 
-def getQueueList(cp): #pylint: disable-msg=C0103
+def getGroupConfig(cp, configDaemon):
+    """
+    Fetch the configuration of all the condor groups with a single
+    condor_config_val -dump call.
+
+    @param cp: A ConfigParse object with the GIP config information
+    @param configDaemon: The daemon argument to condor_config_val, such as
+        "-negotiator"; may be empty.
+    @returns: A dictionary mapping the upper-cased names of the GROUP_*
+        settings to their values, or None if the dump is not available.
+    """
+    groupConfig = {}
+    fp = condorCommand(condor_group_dump, cp, {'daemon': configDaemon})
+    for line in fp:
+        line = line.strip()
+        if not line or line.startswith('#') or line.find('=') < 0:
+            continue
+        key, val = line.split('=', 1)
+        groupConfig[key.strip().upper()] = val.strip()
+    if not groupConfig:
+        log.info("Unable to dump the condor group configuration; querying " \
+            "each group separately.")
+        return None
+    return groupConfig
+
+def groupConfigValue(groupConfig, command, name, group, cp, configDaemon):
+    """
+    Look up a per-group setting, such as the group quota.
+
+    The value comes from the bulk dump (see L{getGroupConfig}) when possible.
+    If the dump is unavailable, or holds an expression rather than a number,
+    condor_config_val is asked for that one setting.
+
+    @param groupConfig: The dictionary returned by L{getGroupConfig}.
+    @param command: The condor_config_val command for this one setting.
+    @param name: The name of the setting, with a %s for the group name.
+    @returns: The value of the setting, as a string; empty if it is not
+        defined.
+    """
+    if groupConfig is not None:
+        val = groupConfig.get((name % group).upper(), '')
+        try:
+            float(val)
+            return val
+        except ValueError:
+            if not val:
+                return val
+    return condorCommand(command, cp, {'group': group, \
+        'daemon': configDaemon}).read().strip()
+
+def getQueueList(cp, queries=None): #pylint: disable-msg=C0103
     """
     Returns a list of all the queue names that are supported.
 
     @param cp: Site configuration
+    @keyword queries: The BatchQueries object for this run, if any.
     @returns: List of strings containing the queue names.
     """
-    vo_map = VoMapper(cp)
+    if queries is None:
+        queries = BatchQueries(cp)
+    vo_map = queries.getVoMapper()
     # Determine the group information, if there are any Condor groups
     try:
-        groupInfo = getGroupInfo(vo_map, cp)
+        groupInfo = copy.deepcopy(queries.run('groups', getGroupInfo,
+            vo_map, cp))
     except Exception, e:
         log.exception(e)
         # Default to no groups.
@@ -387,11 +632,15 @@ def determineGroupVOsFromConfig(cp, group, voMap):
         results.add(vo)
     return list(results)
 
-def guessVO(cp, group):
+def guessVO(cp, group, mapper=None):
     """
     From the group name, guess my VO name
+
+    @keyword mapper: The VoMapper to use; if not given, the user-VO map is
+        parsed again.
     """
-    mapper = VoMapper(cp)
+    if mapper is None:
+        mapper = VoMapper(cp)
     bycp = determineGroupVOsFromConfig(cp, group, mapper)
     vos = voList(cp, vo_map=mapper)
     byname = sets.Set()
@@ -415,78 +664,148 @@ def guessVO(cp, group):
     else:
         return [altname]
 
-_results_cache = {}
-def _getJobsInfoInternal(cp):
+def _getJobsInfoInternal(cp, version=None):
     """
     The "alternate" way of building the jobs info; this allows for sites to
     filter jobs based upon an arbitrary condor_q constraint.
 
     This is not the default as large sites can have particularly bad performance
     for condor_q.
+
+    @keyword version: The condor version, used to pick the condor_q format.
     """
-    global _results_cache
-    if _results_cache:
-        return dict(_results_cache)
     constraint = cp_get(cp, "condor", "jobs_constraint", "TRUE")
-    fp = condorCommand(condor_job_status, cp, {'constraint': constraint})
-    handler = ClassAdParser('GlobalJobId', ['JobStatus', 'Owner',
-        'AccountingGroup', 'FlockFrom']);
+    if cp_getBoolean(cp, "condor", "query_all_schedds", False):
+        return _getScheddJobsInfo(cp, constraint, useAutoformat(cp, version))
 
     submitConstraint = _createSubmitterConstraint(cp)
     fp2 = condorCommand(condor_status_submitter, cp, {'constraint': submitConstraint})
     handler2 = ClassAdParser('Name', ['MaxJobsRunning'])
     try:
-        xmlLine = ''
-        while xmlLine.find('<?xml') == -1: # Throw away junk lines from Condor < 7.3.2
-            xmlLine = fp.readline()
-        condorXml = cStringIO.StringIO(xmlLine+fp.read())
-        parseCondorXml(condorXml, handler)
+        parseCondorXml(fp2, handler2)
+    except Exception, e:
+        log.error("Unable to parse condor output!")
+        log.exception(e)
+        return {}
+
+    # The jobs are counted straight into the submitter information.
+    handler = JobAggregator(handler2.getClassAds())
+    try:
+        if useAutoformat(cp, version):
+            fp = condorCommand(condor_job_autoformat, cp,
+                {'constraint': constraint})
+            parseCondorAutoformat(fp, handler)
+        else:
+            fp = condorCommand(condor_job_status, cp,
+                {'constraint': constraint})
+            parseCondorXml(CondorXmlFile(fp), handler)
     except Exception, e:
         log.error("Unable to parse condor output!")
         log.exception(e)
 
-        if 'GIP_TESTING' in os.environ: raise RuntimeError('Could not parse condor_q -xml output!')
+        if 'GIP_TESTING' in os.environ: raise RuntimeError('Could not parse condor_q output!')
         return {}
+    return handler.getClassAds()
+
+def getScheddList(cp):
+    """
+    Ask the collector for the schedds in the pool, leaving out any listed in
+    [condor] exclude_schedds.
+
+    @param cp: The GIP configuration object
+    @returns: A sorted list of schedd names.
+    """
+    fp = condorCommand(condor_schedds, cp,
+        {'constraint': _createSubmitterConstraint(cp)})
+    handler = ClassAdParser('Name', ['Name'])
     try:
-        parseCondorXml(fp2, handler2)
+        parseCondorXml(fp, handler)
+    except Exception, e:
+        log.error("Unable to parse condor output!")
+        log.exception(e)
+        return []
+    schedds = handler.getClassAds().keys()
+    schedds.sort()
+    return schedds
+
+def _getScheddJobsInfo(cp, constraint, autoformat):
+    """
+    Build the jobs info like _getJobsInfoInternal, but query every schedd in
+    the pool, at the same time as the submitters; used when [condor]
+    query_all_schedds is set.
+
+    At most [condor] max_parallel_schedds (default 4) queries run at once,
+    and each is killed after [condor] schedd_timeout seconds (default 60).
+    A schedd which is down or slow only loses its own jobs.
+
+    @param constraint: The condor_q constraint.
+    @param autoformat: True to use condor_q -autoformat instead of -xml.
+    """
+    if autoformat:
+        command = condor_schedd_job_autoformat
+    else:
+        command = condor_schedd_job_status
+    schedds = getScheddList(cp)
+    cmds = [condor_status_submitter % {'constraint':
+        _createSubmitterConstraint(cp)}]
+    cmds += [command % {'schedd': schedd, 'constraint': constraint} \
+        for schedd in schedds]
+    for cmd in cmds:
+        log.debug("Running command %s." % cmd)
+    outputs = runCommands(cmds, cp_getInt(cp, "condor", "schedd_timeout", 60),
+        cp_getInt(cp, "condor", "max_parallel_schedds", 4))
+
+    if outputs[0] is None:
+        log.error("condor_status -submitter did not finish in time!")
+        return {}
+    handler2 = ClassAdParser('Name', ['MaxJobsRunning'])
+    try:
+        parseCondorXml(outputs[0], handler2)
     except Exception, e:
         log.error("Unable to parse condor output!")
         log.exception(e)
         return {}
     info = handler2.getClassAds()
-    for item, values in handler.getClassAds().items():
-        if 'AccountingGroup' in values and 'Owner' in values and values['AccountingGroup'].find('.') < 0:
-            owner = '%s.%s' % (values['AccountingGroup'], values['Owner'])
-        else:
-            owner = values.get('AccountingGroup', values.get('Owner', None))
-        if not owner:
+
+    for schedd, fp in zip(schedds, outputs[1:]):
+        if fp is None:
+            log.warning("Schedd %s did not answer in time; not counting its " \
+                "jobs." % schedd)
             continue
-        owner_info = info.setdefault(owner, {})
-        status = values.get('JobStatus', -1)
+        handler = JobAggregator()
         try:
-            status = int(status)
-        except:
-            continue
-        is_flocked = values.get('FlockFrom', False) != False
-        # We ignore states Unexpanded (U, 0), Removed (R, 2), Completed (C, 4),
-        # Held (H, 5), and Submission_err (E, 6)
-        if status == 1: # Idle
-            owner_info.setdefault('IdleJobs', 0)
-            owner_info['IdleJobs'] += 1
-        elif status == 2: # Running
-            if is_flocked:
-                owner_info.setdefault('FlockedJobs', 0)
-                owner_info['FlockedJobs'] += 1
+            if autoformat:
+                parseCondorAutoformat(fp, handler)
             else:
-                owner_info.setdefault('RunningJobs', 0)
-                owner_info['RunningJobs'] += 1
-        elif status == 5: # Held
-            owner_info.setdefault('HeldJobs', 0)
-            owner_info['HeldJobs'] += 1
-    _results_cache = dict(info)
+                parseCondorXml(CondorXmlFile(fp), handler)
+        except Exception, e:
+            log.error("Unable to parse condor_q output from schedd %s!" % \
+                schedd)
+            log.exception(e)
+            continue
+        for owner, counts in handler.getClassAds().items():
+            owner_info = info.setdefault(owner, {})
+            for key, value in counts.items():
+                owner_info[key] = owner_info.get(key, 0) + value
     return info
 
-def getJobsInfo(vo_map, cp):
+def _getSubmitterInfo(cp):
+    """
+    The default way of building the jobs info: the per-submitter totals from
+    condor_status -submitter.
+    """
+    submitConstraint = _createSubmitterConstraint(cp)
+    fp = condorCommand(condor_status_submitter, cp, {'constraint': submitConstraint})
+    handler = ClassAdParser(('Name', 'ScheddName'), ['RunningJobs',
+        'IdleJobs', 'HeldJobs', 'MaxJobsRunning', 'FlockedJobs'])
+    try:
+        parseCondorXml(fp, handler)
+    except Exception, e:
+        log.error("Unable to parse condor output!")
+        log.exception(e)
+    return handler.getClassAds()
+
+def getJobsInfo(vo_map, cp, queries=None):
     """
     Retrieve information about the jobs in the Condor system.
 
@@ -498,23 +817,21 @@ def getJobsInfo(vo_map, cp):
 
     @param vo_map: A vo_map object mapping users to VOs
     @param cp: A ConfigParser object with the GIP config information.
+    @keyword queries: The BatchQueries object for this run, if any.
     @returns: A dictionary containing job information.
     """
+    if queries is None:
+        queries = BatchQueries(cp)
     group_jobs = {}
     queue_constraint = cp_get(cp, "condor", "jobs_constraint", "TRUE")
     if queue_constraint.upper() == 'TRUE':
-        submitConstraint = _createSubmitterConstraint(cp)
-        fp = condorCommand(condor_status_submitter, cp, {'constraint': submitConstraint})
-        handler = ClassAdParser(('Name', 'ScheddName'), ['RunningJobs',
-            'IdleJobs', 'HeldJobs', 'MaxJobsRunning', 'FlockedJobs'])
-        try:
-            parseCondorXml(fp, handler)
-        except Exception, e:
-            log.error("Unable to parse condor output!")
-            log.exception(e)
-        results = handler.getClassAds()
+        results = queries.run('submitters', _getSubmitterInfo, cp)
     else:
-        results = _getJobsInfoInternal(cp)
+        try:
+            version = queries.run('version', getLrmsInfo, cp)
+        except ValueError:
+            version = None
+        results = queries.run('condor_q', _getJobsInfoInternal, cp, version)
     def addIntInfo(my_info_dict, classad_dict, my_key, classad_key):
         """
         Add some integer info contained in classad_dict[classad_key] to 
@@ -530,7 +847,7 @@ def getJobsInfo(vo_map, cp):
             new_info = 0
         my_info_dict[my_key] += new_info
 
-    all_group_info = getGroupInfo(vo_map, cp)
+    all_group_info = queries.run('groups', getGroupInfo, vo_map, cp)
 
     unknown_users = sets.Set()
     for user, info in results.items():
@@ -581,7 +898,6 @@ def getJobsInfo(vo_map, cp):
 
     return group_jobs
 
-_nodes_cache = []
 def parseNodes(cp):
     """
     Parse the condor nodes.
@@ -589,9 +905,6 @@ def parseNodes(cp):
     @param cp: ConfigParser object for the GIP
     @returns: A tuple consisting of the total, claimed, and unclaimed nodes.
     """
-    global _nodes_cache #pylint: disable-msg=W0603
-    if _nodes_cache:
-        return _nodes_cache
     subtract = cp_getBoolean(cp, "condor", "subtract_owner", True)
     log.debug("Parsing condor nodes.")
     constraint = cp_get(cp, "condor", "status_constraint", "TRUE")
@@ -613,7 +926,6 @@ def parseNodes(cp):
             total -= 1
     log.info("There are %i total; %i claimed and %i unclaimed." % \
              (total, claimed, unclaimed))
-    _nodes_cache = total, claimed, unclaimed
     return total, claimed, unclaimed
 
 def defaultGroupIsExcluded(cp):
@@ -11,7 +11,8 @@ import sys
 import os
 import re
 import pty
-import time
+import errno
+import select
 import resource
 import ConfigParser
 
@@ -59,6 +60,7 @@ def connect_admin(cp):
     return Admin(info, timeout)
 
 
+ssh_command = '/usr/bin/ssh'
 ssh_extra_args = []
 
 err_msg = """
@@ -77,6 +79,11 @@ class Admin:
   Only one thread should access this at a time.  If you want to have multi-
   threaded access to the admin interface, the recommendation is to create one
   connection per thread.
+
+  The ssh output is read in large chunks into a buffer; lines and prompts are
+  split off the buffer as they complete.  L{execute_many} pipelines several
+  commands, sending the next ones before the replies to the earlier ones
+  have arrived.
   """
 
   def __init__(self, info, timeout=5):
@@ -88,6 +95,9 @@ class Admin:
         L{gip_storage.connect_admin}, not through the constructor directly.
     @param timeout: Timeout (in seconds) before the class will give up on the
         connection and raise an error.
+
+    @ivar read_timeout: If set, how many seconds to wait for more output
+        before giving up on the connection and raising an error.
     """
     if isinstance(info, ConfigParser.ConfigParser):
         config_file = info.get("dCacheAdmin","config_file")
@@ -101,8 +111,11 @@ class Admin:
       raise Exception("Must give a dCache interface!")
     if 'AdminHost' not in info:
       raise Exception("Must give an AdminHost to connect to Admin Interface.")
-    self.delay = .001
     self.info = info
+    self.timeout = timeout
+    self.read_timeout = None
+    self.buffer = ''
+    self.eof = False
     signal.signal(signal.SIGALRM, handler)
     signal.alarm(timeout)
     self.make_connection( info )
@@ -122,35 +135,83 @@ class Admin:
           pass
       try:
         args.append('-x')
-        os.execvp( '/usr/bin/ssh', ['ssh'] + args )
+        os.execvp( ssh_command, ['ssh'] + args )
       except Exception, e:
         print e
         print "Unable to execute ssh"
+      os._exit(1)
+
+  def fill( self ):
+    """
+    Read the next chunk of ssh output into the buffer.
+
+    @returns: False once the ssh output has ended.
+    """
+    if self.eof:
+      return False
+    if self.read_timeout:
+      try:
+        ready = select.select( [self.child], [], [], self.read_timeout )[0]
+      except select.error, e:
+        if e[0] == errno.EINTR:
+          return True
+        raise
+      if not ready:
+        raise Exception( "No answer from the admin interface within %s " \
+          "seconds." % self.read_timeout )
+    try:
+      chunk = os.read( self.child, 65536 )
+    except OSError, oe:
+      if oe.errno == errno.EINTR:
+        return True
+      # Linux reports EIO on the pty once ssh has exited.
+      chunk = ''
+    if not chunk:
+      self.eof = True
+      return False
+    self.buffer += chunk
+    return True
 
   def read (self, max_read):
-    time.sleep(self.delay)
-    return os.read(self.child, max_read)
+    if not self.buffer:
+      self.fill()
+    result, self.buffer = self.buffer[:max_read], self.buffer[max_read:]
+    return result
 
   def readlines( self, matches=[] ):
-    time.sleep( self.delay )
-    read_line = None
+    """
+    Yield the ssh output line by line.  A partial line is yielded as soon as
+    it contains a match for one of the regular expressions in matches (for
+    example, a prompt); it is cut right after the match.  The regular
+    expressions are only searched again when more output has arrived.
+
+    The last line yielded, at the end of the output, is the empty string.
+    """
     re_matches = [re.compile(i) for i in matches]
-    while read_line != '':
-      read_line = ''; read_char = None
-      stop_flag = False 
-      while read_char != '' and read_char != '\n' and (not stop_flag):
-        #print read_line, matches
-        for regexp in re_matches:
-            if regexp.search( read_line ):
-                stop_flag = True
-        read_char = os.read( self.child, 1 )
-        read_line += read_char
-      #print str(read_line), "done"
-      yield str(read_line)
-    return
+    searched = 0
+    while True:
+      end = self.buffer.find('\n', searched) + 1
+      if end:
+        line = self.buffer[:end]
+      else:
+        line = self.buffer
+      for regexp in re_matches:
+        m = regexp.search( line )
+        if m and m.end() and (not end or m.end() < end):
+          end = m.end()
+      if end:
+        line, self.buffer = self.buffer[:end], self.buffer[end:]
+        searched = 0
+        yield line
+      elif self.fill():
+        searched = len(line)
+      else:
+        line, self.buffer = self.buffer, ''
+        yield line
+        if not line:
+          return
 
   def write (self, text):
-    time.sleep(self.delay)
     len_text = len(text) 
     assert os.write(self.child, text)  == len_text
 
@@ -195,54 +256,56 @@ class Admin:
     self.cd( None )
     self.write( 'logoff\n' )
 
-  def cd( self, cell ):
+  def close( self ):
     """
-    Change to a different cell.  This will be called automatically by L{execute}
-    when it is necessary.
+    Drop the connection without logging off, for when the admin interface
+    stopped answering.
+    """
+    try:
+      os.kill( self.pid, signal.SIGKILL )
+    except OSError:
+      pass
+    try:
+      os.close( self.child )
+      os.waitpid( self.pid, 0 )
+    except OSError:
+      pass
+
+  def cd_commands( self, cell ):
+    """
+    The lines to send to move from the current cell to a different one.
     """
-    #print self.location, str(cell)
     if self.location == str(cell):
-      return
-    #print "Changing directory"
-    self.write('..\n')
-    for line in self.readlines(matches=['>']):
-      #print "#", line.strip()
-      if re.search( '>', line ):
-        break
+      return []
+    lines = ['..']
     self.location = None
     if cell != None:
-      cmd = 'cd ' + str(cell) + '\n'
-      #print cmd
-      self.write(cmd)
-      for line in self.readlines(matches=['\\(%s\\) [\\w]* >' % cell,'\\([\\w]*\\) /*%s >' % cell]):
-        if re.search( '>', line ):
-          #print "cd:**", line
-          break
-      #print "cd.....", line
+      lines.append('cd ' + str(cell))
       self.location = str(cell)
+    return lines
 
-  def execute( self, cell, command, args=[] ):
+  def read_reply( self, line ):
     """
-    Execute a command in the admin interface
+    Read the reply to one line sent by L{cd_commands} or L{command_line}, up
+    to and including the prompt which follows it.
 
-    @param cell: Cell name to send the command to.
-    @param command: Command name
-    @param args: Any additional arguments to pass to dCache
-    @type args: List
-    @returns: String containing command output.
+    @returns: The output of the line, and an error message (None if the
+        line succeeded).
     """
-    self.cd( cell )
+    if line == '..':
+      for line in self.readlines(matches=['>']):
+        if re.search( '>', line ):
+          break
+      return '', None
+    if line.startswith('cd '):
+      cell = line[3:]
+      for line in self.readlines(matches=['\\(%s\\) [\\w]* >' % cell,'\\([\\w]*\\) /*%s >' % cell]):
+        if re.search( '>', line ):
+          break
+      return '', None
+    cell = self.location
     if cell == None:
       cell = 'local'
-    arglist = ''
-    assert type(args) == type([])
-    for arg in args:
-      arg = str(arg)
-      if arg.find('\n') >=0: raise Exception( "Newline not allowed in arguments!" )
-      if not re.match('^[\-_\w]+$[\-_\w]*','-a_rg\n'): raise Exception( "Malformed argument %s" % arg )
-      arglist += ' ' + str(arg)
-    dc_command = str(command) + arglist
-    self.write( dc_command + '\n' )
     ret_str = ''
     count = 0
     should_raise_exception = False
@@ -262,10 +325,105 @@ class Admin:
       if count > 1:
         ret_str += line.strip() + '\n' 
     if no_cell_exception:
-        raise Exception( "No route to cell %s." % cell )
+        return ret_str, "No route to cell %s." % cell
     if should_raise_exception:
-        raise Exception( "Timeout or other exception from cell %s." % str(self.location) )
-    return ret_str
+        return ret_str, "Timeout or other exception from cell %s." % str(self.location)
+    return ret_str, None
+
+  def cd( self, cell ):
+    """
+    Change to a different cell.  This will be called automatically by L{execute}
+    when it is necessary.
+    """
+    for line in self.cd_commands( cell ):
+      self.write(line + '\n')
+      self.read_reply(line)
+
+  def command_line( self, command, args=[] ):
+    """
+    Build the line sending command with args to the admin interface.
+    """
+    arglist = ''
+    assert type(args) == type([])
+    for arg in args:
+      arg = str(arg)
+      if arg.find('\n') >=0: raise Exception( "Newline not allowed in arguments!" )
+      if not re.match('^[\-_\w]+$', arg): raise Exception( "Malformed argument %s" % arg )
+      arglist += ' ' + str(arg)
+    return str(command) + arglist
+
+  def execute( self, cell, command, args=[] ):
+    """
+    Execute a command in the admin interface
+
+    @param cell: Cell name to send the command to.
+    @param command: Command name
+    @param args: Any additional arguments to pass to dCache
+    @type args: List
+    @returns: String containing command output.
+    """
+    output, error = self.pipeline([(cell, command, args)])[0]
+    if error:
+      raise Exception( error )
+    return output
+
+  def execute_many( self, requests, window=16 ):
+    """
+    Execute several commands in the admin interface, pipelining them: up to
+    window lines are sent ahead of the replies, so the commands do not each
+    wait for a full round-trip.
+
+    A command which fails does not stop the others.
+
+    @param requests: A list of (cell, command, args) tuples, as passed to
+        L{execute}.
+    @keyword window: The most lines sent but not yet answered.
+    @returns: A list holding the output of each command, or None for the
+        commands which failed.
+    """
+    results = []
+    for output, error in self.pipeline(requests, window):
+      if error:
+        log.warning(error)
+        output = None
+      results.append(output)
+    return results
+
+  def pipeline( self, requests, window=1 ):
+    """
+    Send the lines for the requests, keeping up to window of them in flight,
+    and read the replies in order.
+
+    @returns: A list with the output and error message of each request.
+    """
+    start = self.location
+    lines = []
+    for cell, command, args in requests:
+      lines += [(line, False) for line in self.cd_commands(cell)]
+      lines.append((self.command_line(command, args), True))
+    end = self.location
+
+    # Follow the cell changes while reading the replies, so each reply is
+    # read up to the prompt of the cell it comes from.
+    self.location = start
+    results = []
+    sent = 0
+    try:
+      for idx in range(len(lines)):
+        while sent < len(lines) and sent < idx + max(window, 1):
+          self.write(lines[sent][0] + '\n')
+          sent += 1
+        line, is_command = lines[idx]
+        if line == '..':
+          self.location = None
+        elif line.startswith('cd '):
+          self.location = line[3:]
+        reply = self.read_reply(line)
+        if is_command:
+          results.append(reply)
+    finally:
+      self.location = end
+    return results
 
 def parseOpts( args ):
   # Stupid python 2.2 on SLC3 doesn't have optparser...
@@ -1,9 +1,19 @@
 
 import re
+import os
 import sys
+import time
+import errno
+import select
+import signal
 import string
+import marshal
+import tempfile
 import traceback
 
+from gip_common import cp_get, cp_getInt, gipDir
+from admin import Admin
+
 # The next three definitions are taken from the Gratia storage probe
         
 def convertToKB( valueString ) : 
@@ -68,46 +78,295 @@ class Pool :
                ', type = ' + self.type + \
                ', pnfs root = ' + self.pnfsRoot
 
+def poolCacheFile(cp):
+    """
+    The file caching the pool information between runs; [dcache_admin]
+    pool_cache, by default dcache-pools.cache in the GIP temp directory.
+    """
+    temp_dir = cp_get(cp, "gip", "temp_dir", gipDir("$GIP_LOCATION/var/tmp",
+        '/var/cache/gip'))
+    return os.path.expandvars(cp_get(cp, "dcache_admin", "pool_cache",
+        os.path.join(temp_dir, "dcache-pools.cache")))
+
+def loadPoolCache(filename):
+    """
+    Load the pool information saved by savePoolCache.
+
+    @returns: A dictionary mapping pool names to a (summary, timestamp, info)
+        tuple; the summary is the pool's line in "cm ls" when its "info -l"
+        output, info, was fetched at timestamp.
+    """
+    try:
+        fp = open(filename, 'rb')
+        try:
+            cached = marshal.load(fp)
+        finally:
+            fp.close()
+    except (IOError, EOFError, ValueError, TypeError):
+        return {}
+    if not isinstance(cached, dict):
+        return {}
+    return cached
+
+def savePoolCache(filename, cached, log):
+    """
+    Atomically write the pool information for later use by loadPoolCache.
+    Failures are logged, not raised.
+    """
+    try:
+        contents = marshal.dumps(cached)
+        dirname = os.path.dirname(os.path.abspath(filename))
+        fd, tmp_filename = tempfile.mkstemp(prefix='.dcache-pools.',
+            dir=dirname)
+        try:
+            os.write(fd, contents)
+            os.close(fd)
+            os.rename(tmp_filename, filename)
+        except:
+            os.unlink(tmp_filename)
+            raise
+    except Exception, e:
+        log.info("Unable to write the pool cache %s: %s" % (filename, str(e)))
+
+def _fetchPools(connection, poolNames, timeout, window=16):
+    """
+    Run "info -l" on each pool over a new admin connection, pipelining the
+    commands in batches of window pools.
+
+    If the admin interface stops answering during a batch, the connection is
+    replaced and the pools of that batch are retried one at a time, so that
+    only the pools which do not answer within the timeout are lost; the
+    results of the earlier batches are kept.  If no connection can be made,
+    all the remaining pools fail.
+
+    @param connection: The admin connection whose login information to use;
+        it is left alone.
+    @returns: A dictionary mapping each pool name to its "info -l" output and
+        an error message; one of the two is None.
+    """
+    info, login_timeout = connection.info, connection.timeout
+    results = {}
+    connection = None
+    pending = list(poolNames)
+    single = 0
+    while pending:
+        if connection is None:
+            try:
+                connection = Admin(info, login_timeout)
+            except Exception, e:
+                for poolName in pending:
+                    results[poolName] = (None, str(e))
+                break
+            connection.read_timeout = timeout
+        if single:
+            count = 1
+        else:
+            count = window
+        requests = [(poolName, 'info -l', []) for poolName in pending[:count]]
+        try:
+            for (poolName, command, args), result in zip(requests,
+                    connection.pipeline(requests, window)):
+                results[poolName] = result
+        except Exception, e:
+            connection.close()
+            connection = None
+            if count > 1:
+                single = len(requests)
+                continue
+            results[requests[0][0]] = (None, str(e))
+        pending = pending[len(requests):]
+        if single:
+            single -= 1
+    if connection is not None:
+        connection.logoff()
+    return results
+
+def _poolWorker(connection, poolNames, timeout):
+    """
+    Fetch the information for poolNames over a new admin connection, in a
+    child process.
+
+    @returns: The pid of the child and the read end of a pipe on which it
+        writes the marshalled results of L{_fetchPools}.
+    """
+    r, w = os.pipe()
+    pid = os.fork()
+    if pid:
+        os.close(w)
+        return pid, r
+    try:
+        os.close(r)
+        results = _fetchPools(connection, poolNames, timeout)
+        data = marshal.dumps(results)
+        while data:
+            data = data[os.write(w, data):]
+        os.close(w)
+    finally:
+        os._exit(0)
+
+def fetchPoolInfo(connection, poolNames, connections=4, timeout=60):
+    """
+    Run "info -l" on each of the pools, spread over up to connections admin
+    connections working in parallel.
+
+    The connections are opened with the login information of connection (see
+    L{_fetchPools}), in child processes; with a single connection, or a
+    single pool, in this process.  Either way connection itself is left
+    alone, so a pool which hangs cannot break it.
+
+    @param connection: Connection to the admin interface.
+    @param poolNames: The names of the pools.
+    @keyword connections: The most admin connections to use at once.
+    @keyword timeout: How many seconds to wait for each pool to answer.
+    @returns: A dictionary mapping each pool name to its "info -l" output and
+        an error message; one of the two is None.
+    """
+    if not poolNames:
+        return {}
+    if connections <= 1 or len(poolNames) == 1:
+        return _fetchPools(connection, poolNames, timeout)
+
+    connections = min(connections, len(poolNames))
+    workers = {}
+    for idx in range(connections):
+        pid, fd = _poolWorker(connection, poolNames[idx::connections], timeout)
+        workers[fd] = (pid, poolNames[idx::connections], [])
+    # Each worker gives up on a pool after the timeout; leave it time for one
+    # failed batch and to log in again after every pool before giving up on
+    # the worker itself.
+    deadline = time.time() + (timeout + connection.timeout) * \
+        (len(poolNames) / connections + 2)
+    results = {}
+    while workers:
+        wait = max(deadline - time.time(), 0)
+        try:
+            ready = select.select(workers.keys(), [], [], wait)[0]
+        except select.error, e:
+            if e[0] != errno.EINTR:
+                raise
+            continue
+        if not ready:
+            break
+        for fd in ready:
+            chunk = os.read(fd, 65536)
+            if chunk:
+                workers[fd][2].append(chunk)
+                continue
+            pid, names, data = workers.pop(fd)
+            os.close(fd)
+            os.waitpid(pid, 0)
+            try:
+                results.update(marshal.loads(''.join(data)))
+            except (EOFError, ValueError, TypeError):
+                pass
+    for fd, (pid, names, data) in workers.items():
+        try:
+            os.kill(pid, signal.SIGKILL)
+        except OSError:
+            pass
+        os.close(fd)
+        os.waitpid(pid, 0)
+    for poolName in poolNames:
+        results.setdefault(poolName, (None, "No answer from the pool."))
+    return results
+
 _pools_cache = []
-def lookupPoolStorageInfo( connection, log ) :
+def lookupPoolStorageInfo( connection, log, cp=None ) :
     """
     Get pool storage info for all pools from the admin interface
 
+    The pools are queried in parallel over up to [dcache_admin]
+    pool_connections connections (default 4); a pool which does not answer
+    within [dcache_admin] pool_timeout seconds (default 60) is skipped.
+
+    With a configuration, the pool information is also kept between runs in
+    the pool cache (see L{poolCacheFile}); a pool is only queried again if
+    its line in "cm ls" changed, or its cached information is older than
+    [dcache_admin] pool_cache_ttl seconds (default 3600; 0 disables the
+    cache).
+
     @param connection: Connection to the admin interface.
     @type connection: dCacheAdmin
     @param log: Log to use for this function.
     @type log: Logger
+    @keyword cp: The GIP configuration.
     """
     global _pools_cache
     if _pools_cache:
         return _pools_cache
 
-    listOfPools = []
+    connections, timeout, ttl = 1, 60, 0
+    if cp is not None:
+        connections = cp_getInt(cp, "dcache_admin", "pool_connections", 4)
+        timeout = cp_getInt(cp, "dcache_admin", "pool_timeout", 60)
+        ttl = cp_getInt(cp, "dcache_admin", "pool_cache_ttl", 3600)
+
     # get a list of pools
     # If this raises an exception, it will be caught in main.
     # It is a fatal error...
     pooldata = connection.execute( 'PoolManager', 'cm ls' )
                     
-    # for each pool get the vital statistics about capacity and usage
+    summaries = {}
+    poolNames = []
     defPoolList = pooldata.splitlines()
     for poolStr in defPoolList :
         poolName = poolStr.split( '={', 1 )[0]
         if string.strip( poolName ) == '' :
             continue # Skip empty lines.
         log.debug( 'found pool:' + str( poolName ) )
+        poolNames.append( poolName )
+        summaries[ poolName ] = poolStr.strip()
+
+    cached = {}
+    if ttl > 0:
+        filename = poolCacheFile(cp)
+        cached = loadPoolCache(filename)
+    now = time.time()
+    fetch = []
+    for poolName in poolNames:
+        summary, timestamp, info = cached.get(poolName, (None, 0, None))
+        if summary != summaries[poolName] or not (0 <= now-timestamp < ttl):
+            fetch.append(poolName)
+    if fetch:
+        log.debug('Querying %i of %i pools' % (len(fetch), len(poolNames)))
+
+    # for each pool get the vital statistics about capacity and usage
+    results = fetchPoolInfo(connection, fetch, connections, timeout)
+    failed = []
+    for poolName, (poolinfo, error) in results.items():
+        if error:
+            failed.append(poolName)
+            log.debug('Error doing info -l on pool %s: %s' % (poolName, error))
+            cached.pop(poolName, None)
+        else:
+            cached[poolName] = (summaries[poolName], now, poolinfo)
+
+    listOfPools = []
+    for poolName in poolNames:
+        if poolName not in cached:
+            continue
         try :
-            poolinfo = connection.execute( poolName, 'info -l' )
-            if poolinfo != None :
-                listOfPools.append( Pool( poolName, poolinfo ) )
-            else :
-                log.error( 'Error doing info -l on pool ' + str( poolName ) )
+            listOfPools.append( Pool( poolName, cached[poolName][2] ) )
         except :
             tblist = traceback.format_exception( sys.exc_type,
                                                  sys.exc_value,
                                                  sys.exc_traceback )
             log.warning( 'Got exception:\n\n' + "".join( tblist ) + \
-                         '\nwhile doing "info -l" for pool ' + \
+                         '\nwhile parsing "info -l" for pool ' + \
                          str( poolName ) + '.\nIgnoring this pool.' )
+            failed.append( poolName )
+            del cached[ poolName ]
+    if failed:
+        failed.sort()
+        log.warning('Unable to get the information of %i of %i pools; ' \
+            'ignoring pools %s.' % (len(failed), len(poolNames),
+            ', '.join(failed)))
+
+    if ttl > 0:
+        for poolName in cached.keys():
+            if poolName not in summaries:
+                del cached[poolName]
+        savePoolCache(filename, cached, log)
     _pools_cache = list(listOfPools)
     return listOfPools
 
@@ -55,7 +55,7 @@ def calculate_spaces(cp, admin, section='se'):
     pgroups, lgroups, links, link_settings, pools = \
         parsers.parse_pool_manager(psu_output)
     listOfPools = pools_module.lookupPoolStorageInfo(admin, \
-        getLogger("GIP.dCache.Pools"))
+        getLogger("GIP.dCache.Pools"), cp)
     pm_info = admin.execute(PoolManager, 'info')
     can_stage = pm_info.find('Allow staging : on') >= 0
     can_p2p = pm_info.find('Allow p2p : on') >= 0
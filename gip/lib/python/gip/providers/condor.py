@@ -9,6 +9,7 @@ https://twiki.grid.iu.edu/twiki/bin/view/InformationServices/GipCeInfo
 	
 import gip_sets as sets
 import sys
+import copy
 import os
 
 py23 = sys.version_info[0] == 2 and sys.version_info[1] >= 3
@@ -25,13 +26,13 @@ from condor_common import parseNodes, getJobsInfo, getLrmsInfo, getGroupInfo
 from condor_common import defaultGroupIsExcluded
 from gip_storage import getDefaultSE
 from gip_batch import buildCEUniqueID, getGramVersion, getCEImpl, getPort, \
-     buildContactString, getHTPCInfo
+     buildContactString, getHTPCInfo, BatchQueries
 
 from gip_sections import ce, se
 
 log = getLogger("GIP.Condor")
 
-def print_CE(cp):
+def print_CE(cp, queries=None):
     """
     Print out the CE(s) for Condor
 
@@ -53,7 +54,10 @@ def print_CE(cp):
 
     @param cp: The GIP configuration
     @type cp: ConfigParser.ConfigParser
+    @keyword queries: The BatchQueries object for this run, if any.
     """
+    if queries is None:
+        queries = BatchQueries(cp)
     ce_template = getTemplate("GlueCE", "GlueCEUniqueID")
     ce_name = cp_get(cp, "ce", "name", "UNKNOWN_CE")
 
@@ -61,22 +65,22 @@ def print_CE(cp):
     
     # Get condor version
     try:
-        condorVersion = getLrmsInfo(cp)
+        condorVersion = queries.run('version', getLrmsInfo, cp)
     except:
         condorVersion = "Unknown"
 
     # Get the node information for condor
     try:
-        total_nodes, claimed, unclaimed = parseNodes(cp)
+        total_nodes, claimed, unclaimed = queries.run('nodes', parseNodes, cp)
     except Exception, e:
         log.exception(e)
         total_nodes, claimed, unclaimed = 0, 0, 0
 
-    vo_map = VoMapper(cp)
+    vo_map = queries.getVoMapper()
 
     # Determine the information about the current jobs in queue
     try:
-        jobs_info = getJobsInfo(vo_map, cp)
+        jobs_info = queries.run('jobs', getJobsInfo, vo_map, cp, queries)
     except Exception, e:
         log.exception(e)
         jobs_info = {'default': dict([(vo, {'running': 0, 'idle': 0,
@@ -84,7 +88,8 @@ def print_CE(cp):
 
     # Determine the group information, if there are any Condor groups
     try:
-        groupInfo = getGroupInfo(vo_map, cp)
+        groupInfo = copy.deepcopy(queries.run('groups', getGroupInfo,
+            vo_map, cp))
     except Exception, e:
         log.exception(e)
         # Default to no groups.
@@ -259,7 +264,7 @@ def print_CE(cp):
         printTemplate(ce_template, info)
     return total_nodes, claimed, unclaimed
 
-def print_VOViewLocal(cp):
+def print_VOViewLocal(cp, queries=None):
     """
     Print the GLUE VOView entity; shows the VO's view of the condor batch
     system.
@@ -273,17 +278,21 @@ def print_VOViewLocal(cp):
 
     @param cp:  The GIP configuration object
     @type cp: ConfigParser.ConfigParser
+    @keyword queries: The BatchQueries object for this run, if any.
     """
+    if queries is None:
+        queries = BatchQueries(cp)
     VOView = getTemplate("GlueCE", "GlueVOViewLocalID")
     ce_name = cp_get(cp, "ce", "name", "")
     
     #status = cp_get(cp, "condor", "status", "Production")
     #condorVersion = getLrmsInfo(cp) 
-    total_nodes, _, unclaimed = parseNodes(cp)
+    total_nodes, _, unclaimed = queries.run('nodes', parseNodes, cp)
     
-    vo_map = VoMapper(cp)
-    jobs_info = getJobsInfo(vo_map, cp)
-    groupInfo = getGroupInfo(vo_map, cp)
+    vo_map = queries.getVoMapper()
+    jobs_info = queries.run('jobs', getJobsInfo, vo_map, cp, queries)
+    groupInfo = copy.deepcopy(queries.run('groups', getGroupInfo, vo_map,
+        cp))
 
     # Add in the default group
     all_group_vos = []    
@@ -391,10 +400,11 @@ def main():
 	if condor_config:
 		os.environ['CONDOR_CONFIG'] = condor_config
 
-        #vo_map = VoMapper(cp)
-        getLrmsInfo(cp) 
-        print_CE(cp)
-        print_VOViewLocal(cp)
+        queries = BatchQueries(cp)
+        queries.run('version', getLrmsInfo, cp)
+        print_CE(cp, queries)
+        print_VOViewLocal(cp, queries)
+        queries.logTimings(log)
     except Exception, e:
         log.exception(e)
         raise
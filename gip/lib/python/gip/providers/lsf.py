@@ -6,6 +6,7 @@ Print out GLUE describing the local LSF batch system.
 
 import sys
 import os
+import copy
 
 if 'GIP_LOCATION' in os.environ:
     sys.path.append(os.path.expandvars("$GIP_LOCATION/lib/python"))
@@ -20,23 +21,28 @@ from lsf_common import parseNodes, getQueueInfo, getJobsInfo, getLrmsInfo, \
 from gip_sections import ce
 from gip_storage import getDefaultSE
 from gip_batch import buildCEUniqueID, getGramVersion, getCEImpl, getPort, \
-     buildContactString, getHTPCInfo
+     buildContactString, getHTPCInfo, BatchQueries
 
 log = getLogger("GIP.LSF")
 
-def print_CE(cp):
+def print_CE(cp, queries=None):
     """
     Print out the GlueCE objects for LSF; one GlueCE per grid queue.
     """
+    if queries is None:
+        queries = BatchQueries(cp)
     try:
-        lsfVersion = getLrmsInfo(cp)
+        lsfVersion = queries.run('version', getLrmsInfo, cp, queries)
     except:
         lsfVersion = 'Unknown'
 
     log.debug('Using LSF version %s' % lsfVersion)    
-    queueInfo = getQueueInfo(cp)
+    # The queue entries are filled in below; keep the shared result intact.
+    queueInfo = copy.deepcopy(queries.run('queues', getQueueInfo, cp,
+        queries))
     try:
-        totalCpu, freeCpu, queueCpus = parseNodes(queueInfo, cp)
+        totalCpu, freeCpu, queueCpus = queries.run('nodes', parseNodes,
+            queueInfo, cp, queries)
     except:
         #raise
         totalCpu, freeCpu, queueCpus = 0, 0, {}
@@ -48,7 +54,7 @@ def print_CE(cp):
             "queue_exclude").split(',')]
     except:
         excludeQueues = []
-    vo_queues = getVoQueues(queueInfo, cp)
+    vo_queues = getVoQueues(queueInfo, cp, queries)
     for queue, info in queueInfo.items():
         if queue in excludeQueues:
             continue
@@ -147,18 +153,20 @@ def print_CE(cp):
         printTemplate(CE, info)
     return queueInfo, totalCpu, freeCpu, queueCpus
 
-def print_VOViewLocal(queue_info, cp):
+def print_VOViewLocal(queue_info, cp, queries=None):
     """
     Print out the VOView objects for the LSF batch system.
     
     One VOView per VO per queue, for each VO which has access
     to the queue.
     """
+    if queries is None:
+        queries = BatchQueries(cp)
     ce_name = cp.get(ce, "name")
-    vo_map = VoMapper(cp)
-    queue_jobs = getJobsInfo(vo_map, cp)
+    vo_map = queries.getVoMapper()
+    queue_jobs = queries.run('jobs', getJobsInfo, vo_map, cp, queries)
     VOView = getTemplate("GlueCE", "GlueVOViewLocalID")
-    vo_queues = getVoQueues(queue_info, cp)
+    vo_queues = getVoQueues(queue_info, cp, queries)
     for vo, queue in vo_queues:
         vo = vo.lower()
         vo_info = queue_jobs.get(queue, {})
@@ -232,9 +240,10 @@ def main():
         if lsf_path:
             addToPath(lsf_path)
         bootstrapLSF(cp)
-        #vo_map = VoMapper(cp)
-        queueInfo, _, _, _ = print_CE(cp)
-        print_VOViewLocal(queueInfo, cp)
+        queries = BatchQueries(cp)
+        queueInfo, _, _, _ = print_CE(cp, queries)
+        print_VOViewLocal(queueInfo, cp, queries)
+        queries.logTimings(log)
     except Exception, e:
         sys.stdout = sys.stderr
         log.exception(e)
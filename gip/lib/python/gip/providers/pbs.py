@@ -2,6 +2,7 @@
 
 import re
 import sys
+import copy
 import os
 
 if 'GIP_LOCATION' in os.environ:
@@ -16,14 +17,18 @@ from pbs_common import parseNodes, getQueueInfo, getJobsInfo, getLrmsInfo, \
 from gip_sections import ce
 from gip_storage import getDefaultSE
 from gip_batch import buildCEUniqueID, getGramVersion, getCEImpl, getPort, \
-     buildContactString, getHTPCInfo
+     buildContactString, getHTPCInfo, BatchQueries
 
 log = getLogger("GIP.PBS")
 
-def print_CE(cp):
-    pbsVersion = getLrmsInfo(cp)
-    queueInfo = getQueueInfo(cp)
-    totalCpu, freeCpu, queueCpus = parseNodes(cp, pbsVersion)
+def print_CE(cp, queries=None):
+    if queries is None:
+        queries = BatchQueries(cp)
+    pbsVersion = queries.run('version', getLrmsInfo, cp)
+    # The queue entries are filled in below; keep the shared result intact.
+    queueInfo = copy.deepcopy(queries.run('queues', getQueueInfo, cp))
+    totalCpu, freeCpu, queueCpus = queries.run('nodes', parseNodes, cp,
+        pbsVersion, queueInfo)
     log.debug("totalCpu, freeCpu, queueCPus: %s %s %s" % (totalCpu, freeCpu, queueCpus))
     ce_name = cp_get(cp, ce, "name", "UNKNOWN_CE")
     CE = getTemplate("GlueCE", "GlueCEUniqueID")
@@ -32,7 +37,7 @@ def print_CE(cp):
             "queue_exclude", "").split(',')]
     except:
         excludeQueues = []
-    vo_queues = getVoQueues(cp)
+    vo_queues = queries.run('vo_queues', getVoQueues, cp, queries)
     for queue, info in queueInfo.items():
         if queue in excludeQueues:
             continue
@@ -143,12 +148,14 @@ def print_CE(cp):
         print CE % info
     return queueInfo, totalCpu, freeCpu, queueCpus
 
-def print_VOViewLocal(queue_info, cp):
+def print_VOViewLocal(queue_info, cp, queries=None):
+    if queries is None:
+        queries = BatchQueries(cp)
     ce_name = cp_get(cp, ce, "name", "UNKNOWN_CE")
-    vo_map = VoMapper(cp)
-    queue_jobs = getJobsInfo(vo_map, cp)
+    vo_map = queries.getVoMapper()
+    queue_jobs = queries.run('jobs', getJobsInfo, vo_map, cp)
     VOView = getTemplate("GlueCE", "GlueVOViewLocalID")
-    vo_queues = getVoQueues(cp)
+    vo_queues = queries.run('vo_queues', getVoQueues, cp, queries)
     for vo, queue in vo_queues:
         vo_info = queue_jobs.get(queue, {})
         info2 = vo_info.get(vo, {})
@@ -197,10 +204,11 @@ def main():
         # adding pbs_path/bin to the path as well, since pbs/torque home
         # points to /usr/local and the binaries exist in /usr/local/bin
         addToPath(pbs_path + "/bin")
-        vo_map = VoMapper(cp)
-        pbsVersion = getLrmsInfo(cp)
-        queueInfo, totalCpu, freeCpu, queueCpus = print_CE(cp)
-        print_VOViewLocal(queueInfo, cp)
+        queries = BatchQueries(cp)
+        queries.run('version', getLrmsInfo, cp)
+        queueInfo, totalCpu, freeCpu, queueCpus = print_CE(cp, queries)
+        print_VOViewLocal(queueInfo, cp, queries)
+        queries.logTimings(log)
     except Exception, e:
         sys.stdout = sys.stderr
         log.exception(e)
@@ -13,20 +13,22 @@ from gip_cluster import getClusterID
 from gip_sections import ce
 from gip_storage import getDefaultSE
 from gip_batch import buildCEUniqueID, getGramVersion, getCEImpl, getPort, \
-     buildContactString, getHTPCInfo
+     buildContactString, getHTPCInfo, BatchQueries
 from sge_common import getQueueInfo, getJobsInfo, getLrmsInfo, getVoQueues, \
     getQueueList
 
 log = getLogger("GIP.SGE")
 
-def print_CE(cp):
-    SGEVersion = getLrmsInfo(cp)
-    queueInfo, _ = getQueueInfo(cp)
+def print_CE(cp, queries=None):
+    if queries is None:
+        queries = BatchQueries(cp)
+    SGEVersion = queries.run('version', getLrmsInfo, cp)
+    queueInfo, _ = queries.run('queues', getQueueInfo, cp)
     ce_name = cp_get(cp, ce, "name", "UNKNOWN_CE")
     ce_template = getTemplate("GlueCE", "GlueCEUniqueID")
-    queueList = getQueueList(cp)
+    queueList = getQueueList(cp, queries)
 
-    vo_queues = getVoQueues(cp)
+    vo_queues = queries.run('vo_queues', getVoQueues, cp, queries)
 
     default_max_waiting = 999999
     for queue in queueInfo.values():
@@ -100,11 +102,13 @@ def print_CE(cp):
         printTemplate(ce_template, info)
     return queueInfo
 
-def print_VOViewLocal(cp):
+def print_VOViewLocal(cp, queries=None):
+    if queries is None:
+        queries = BatchQueries(cp)
     ce_name = cp_get(cp, ce, "name", "UNKNOWN_CE")
-    vo_map = VoMapper(cp)
-    queue_jobs = getJobsInfo(vo_map, cp)
-    vo_queues = getVoQueues(cp)
+    vo_map = queries.getVoMapper()
+    queue_jobs = queries.run('jobs', getJobsInfo, vo_map, cp)
+    vo_queues = queries.run('vo_queues', getVoQueues, cp, queries)
     VOView = getTemplate("GlueCE", "GlueVOViewLocalID")
     for vo, queue in vo_queues:
         ce_unique_id = buildCEUniqueID(cp, ce_name, 'sge', queue)
@@ -165,10 +169,11 @@ def main():
         cp = config()
         bootstrapSGE(cp)
         addToPath(cp_get(cp, "sge", "sge_path", "."))
-        vo_map = VoMapper(cp)
-        pbsVersion = getLrmsInfo(cp)
-        print_CE(cp)
-        print_VOViewLocal(cp)
+        queries = BatchQueries(cp)
+        queries.run('version', getLrmsInfo, cp)
+        print_CE(cp, queries)
+        print_VOViewLocal(cp, queries)
+        queries.logTimings(log)
     except Exception, e:
         sys.stdout = sys.stderr
         log.error(e)
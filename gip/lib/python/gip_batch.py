@@ -2,12 +2,70 @@
 Common functions for GIP batch system providers and plugins.
 """
 
-from gip_common import cp_getBoolean, cp_get, cp_getList, cp_getInt
+import time
+
+from gip_common import cp_getBoolean, cp_get, cp_getList, cp_getInt, VoMapper
 from gip_cluster import getOSGVersion
 from gip_sections import ce
 
 __author__ = "Burt Holzman"
 
+class BatchQueries:
+    """
+    Run each expensive batch system query at most once per provider run.
+
+    A provider creates one of these and hands it to everything which queries
+    the batch system.  Queries are identified by name; the first call to
+    L{run} for a name runs the query and remembers the result, later calls
+    return the same object.  Callers must not modify what they are given;
+    one which needs to should copy it first.  Queries which raise an
+    exception are not remembered.
+
+    The time taken by each query (including any queries it makes itself) is
+    recorded, and can be logged with L{logTimings}.
+    """
+
+    def __init__(self, cp):
+        self.cp = cp
+        self.results = {}
+        self.timings = []
+        self._vo_map = None
+
+    def getVoMapper(self):
+        """
+        Return a VoMapper shared by the whole run; the user-VO map is only
+        parsed once.
+        """
+        if self._vo_map is None:
+            self._vo_map = VoMapper(self.cp)
+        return self._vo_map
+
+    def run(self, name, function, *args):
+        """
+        Return the result of function(*args), running it only if no query
+        with this name has completed yet.
+
+        @param name: The name of the query; include anything in it which
+            distinguishes otherwise identical queries.
+        @param function: The function performing the query.
+        @returns: The query's result, shared with every other caller; do not
+            modify it.
+        """
+        if name not in self.results:
+            start = time.time()
+            result = function(*args)
+            self.timings.append((name, time.time() - start))
+            self.results[name] = result
+        return self.results[name]
+
+    def logTimings(self, log):
+        """
+        Log how long each query took, in the order they ran.
+        """
+        for name, elapsed in self.timings:
+            log.info("Batch system query %s took %.2f seconds." % (name,
+                elapsed))
+
 def buildCEUniqueID(cp, ce_name, batch, queue):
     ce_prefix = 'jobmanager'
     if cp_getBoolean(cp, 'cream', 'enabled', False):
@@ -14,6 +14,9 @@ import os
 import re
 import sys
 import pwd
+import copy
+import mmap
+import marshal
 import types
 import socket
 import traceback
@@ -168,6 +171,114 @@ def parseOpts( args ):
         optNum += 1
     return keywordOpts, passedOpts, givenOpts
 
+# Configurations already built by config(), keyed on configKey; the values
+# are the signature of the source files and the config object.
+_configs = {}
+
+def configKey(files):
+    """
+    Everything besides the contents of the source files which config()'s
+    result depends on.
+
+    @param files: The GIP config files read.
+    """
+    env = [os.environ.get(i, None) for i in ['GIP_LOCATION', 'VDT_LOCATION',
+        'GIP_TESTING']]
+    return tuple(files) + tuple(env)
+
+def fileSignature(filenames):
+    """
+    Summarize the state of some files (or directories) so that changes to
+    them can be detected.
+
+    @param filenames: The names of the files.
+    @return: A list of (filename, inode, size, mtime) tuples; all but the
+        filename are None if the file does not exist.
+    """
+    signature = []
+    for filename in filenames:
+        try:
+            st = os.stat(filename)
+            signature.append((filename, st.st_ino, st.st_size, st.st_mtime))
+        except OSError:
+            signature.append((filename, None, None, None))
+    return signature
+
+def copyConfig(cp):
+    """
+    Copy a config object, so that changes to the copy do not affect the
+    original.
+    """
+    new_cp = ConfigParser.ConfigParser()
+    new_cp._defaults = copy.copy(cp._defaults)
+    for section in cp._sections:
+        new_cp._sections[section] = copy.copy(cp._sections[section])
+    return new_cp
+
+def loadConfigCache(filename, key, signature):
+    """
+    Load a config object written by saveConfigCache.
+
+    @param filename: The cache file.
+    @param key: The configKey the cached config must have been built for.
+    @param signature: The fileSignature of the current source files.
+    @return: The cached config object, or None if the cache is missing or
+        out of date.
+    """
+    try:
+        fp = open(filename, 'rb')
+        try:
+            cached = marshal.load(fp)
+        finally:
+            fp.close()
+    except (IOError, EOFError, ValueError, TypeError):
+        return None
+    try:
+        cached_key, cached_signature, defaults, sections = cached
+    except (TypeError, ValueError):
+        return None
+    if cached_key != key or cached_signature != signature:
+        return None
+    cp = ConfigParser.ConfigParser()
+    for option, value in defaults:
+        cp._defaults[option] = value
+    for section, items in sections:
+        cp._sections[section] = cp._dict()
+        for option, value in items:
+            cp._sections[section][option] = value
+    return cp
+
+def saveConfigCache(filename, key, signature, cp):
+    """
+    Atomically write a config object for later use by loadConfigCache.
+
+    The cache is written with marshal, which, unlike pickle, cannot run code
+    when it is loaded.  Failures are logged, not raised.
+
+    @param filename: The cache file.
+    @param key: The configKey the config was built for.
+    @param signature: The fileSignature of the source files.
+    @param cp: The config object.
+    """
+    sections = [(section, cp._sections[section].items()) for section in \
+        cp._sections]
+    try:
+        contents = marshal.dumps((key, signature, cp._defaults.items(),
+            sections))
+        dirname = os.path.dirname(os.path.abspath(filename))
+        fd, tmp_filename = tempfile.mkstemp(prefix='.gip_config.',
+            dir=dirname)
+        try:
+            os.write(fd, contents)
+            os.close(fd)
+            os.rename(tmp_filename, filename)
+        except:
+            os.unlink(tmp_filename)
+            raise
+    except Exception, e:
+        log.warning("Unable to write config cache %s: %s" % (filename,
+            str(e)))
+
 def config(*args):
     """
     Load up the config file.  It's taken from the command line, option -c
@@ -178,10 +289,15 @@ def config(*args):
     If any arguments are supplied to this function, they will be interpreted
     as filenames for additional config files to read.  If the filename
     considers environmental variables, they will be expanded.
+
+    The config is only built once per process, unless one of the files it
+    was built from changes; each caller gets its own copy.  If [gip]
+    config_cache is set in the GIP config files, the result of the OSG config
+    translation is also kept in that file, so other processes can skip it
+    while none of the source files change.
     """
     check_gip_location()
     check_testing_environment()
-    cp = ConfigParser.ConfigParser()
     files = list(args)
 
     p = optparse.OptionParser()
@@ -198,6 +314,13 @@ def config(*args):
     if 'GIP_CONFIG' in os.environ:
         files += [os.path.expandvars("$GIP_CONFIG")]
 
+    key = configKey(files)
+    if key in _configs:
+        signature, cp = _configs[key]
+        if fileSignature([i[0] for i in signature]) == signature:
+            return copyConfig(cp)
+
+    cp = ConfigParser.ConfigParser()
     log.info("Using GIP SVN revision $Revision$")
 
     # Try to read all the files; toss a warning if a config file can't be
@@ -217,13 +340,27 @@ def config(*args):
     # file.
     readOsg = cp_getBoolean(cp, "gip", "read_osg", "True")
     if readOsg:
-        from gip_osg import configOsg
-        configOsg(cp)
+        from gip_osg import configOsg, osgSourceFiles
+        signature = fileSignature(files + osgSourceFiles(cp))
+        cache_file = os.path.expandvars(cp_get(cp, "gip", "config_cache", ""))
+        cached_cp = None
+        if cache_file:
+            cached_cp = loadConfigCache(cache_file, key, signature)
+        if cached_cp:
+            log.info("Using cached config %s" % cache_file)
+            cp = cached_cp
+        else:
+            configOsg(cp)
+            if cache_file:
+                saveConfigCache(cache_file, key, signature, cp)
+    else:
+        signature = fileSignature(files)
+    _configs[key] = signature, cp
 
     if 'GIP_DUMP_CONFIG' in os.environ:
         configContents(cp)
 
-    return cp
+    return copyConfig(cp)
 
 def __write_config(cp, override, dict_object, key, section, option): \
         #pylint: disable-msg=C0103
@@ -241,6 +378,135 @@ def __write_config(cp, override, dict_object, key, section, option): \
     elif (not override):
         cp.set(section, option, new_val)
 
+# Compiled user-to-VO maps already opened by this process, keyed on the
+# index file name; see VoMapper.
+_vo_map_indexes = {}
+
+def voMapIndexHeader(filename):
+    """
+    The first line of the index of a user-to-VO map; it identifies the
+    version of the map the index was built from.
+
+    @param filename: The user-to-VO map.
+    @raise e: OSError if the map does not exist.
+    """
+    st = os.stat(filename)
+    return "#gip user-vo-map index 1\t%s\t%i\t%i\t%r\n" % \
+        (os.path.abspath(filename), st.st_ino, st.st_size, st.st_mtime)
+
+class VoMapIndex:
+    """
+    A compiled, read-only user-to-VO map: a file of sorted "user<TAB>vo"
+    lines, after a few header lines, which is memory-mapped and binary
+    searched so that looking up a user does not require reading the map.
+
+    @ivar header: The voMapIndexHeader of the map the index was built from.
+    @ivar voi: The #voi list from the map.
+    @ivar voc: The #VOc list from the map.
+    @ivar vos: The distinct VOs in the map.
+    @ivar count: The number of users in the map.
+    """
+
+    def __init__(self, fp, header):
+        """
+        @param fp: The open index file, positioned after the header line.
+        @param header: The header line read from the index.
+        """
+        self.header = header
+        self.voi = fp.readline()[:-1].split('\t')[1:]
+        self.voc = fp.readline()[:-1].split('\t')[1:]
+        self.vos = fp.readline()[:-1].split('\t')[1:]
+        self.count = int(fp.readline().split('\t')[1])
+        self.data_start = fp.tell()
+        self.mm = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+        # Providers look up the same few users over and over.
+        self.found = {}
+
+    def lookup(self, user):
+        """
+        Find the VO of user.
+
+        @returns: The VO, or None if the user is not in the map.
+        """
+        if user in self.found:
+            return self.found[user]
+        mm = self.mm
+        lo, hi = self.data_start, len(mm)
+        # lo and hi are always at the start of a line.
+        while lo < hi:
+            start = mm.rfind('\n', lo, (lo + hi) / 2) + 1
+            if start == 0:
+                start = lo
+            end = mm.find('\n', start)
+            key, vo = mm[start:end].split('\t', 1)
+            if key == user:
+                break
+            elif key < user:
+                lo = end + 1
+            else:
+                hi = start
+        else:
+            vo = None
+        self.found[user] = vo
+        return vo
+
+def openVoMapIndex(filename, header):
+    """
+    Open the index of a user-to-VO map.
+
+    @param filename: The index file.
+    @param header: The voMapIndexHeader of the current map.
+    @returns: A VoMapIndex, or None if the index is missing or out of date.
+    """
+    try:
+        fp = open(filename, 'rb')
+    except IOError:
+        return None
+    try:
+        try:
+            if fp.readline() != header:
+                return None
+            return VoMapIndex(fp, header)
+        except (IndexError, ValueError, EnvironmentError):
+            return None
+    finally:
+        fp.close()
+
+def writeVoMapIndex(filename, header, userMap, voi, voc, vos):
+    """
+    Atomically write the index of a user-to-VO map, so that other processes
+    never see a partially written index.
+
+    @returns: A VoMapIndex for the new index, or None if it could not be
+        written.
+    """
+    users = userMap.keys()
+    users.sort()
+    lines = [header, '\t'.join(['#voi'] + voi) + '\n',
+        '\t'.join(['#VOc'] + voc) + '\n', '\t'.join(['#vos'] + vos) + '\n',
+        '#count\t%i\n' % len(users)]
+    lines += ['%s\t%s\n' % (user, userMap[user]) for user in users]
+    try:
+        dirname, basename = os.path.split(os.path.abspath(filename))
+        fd, tmp_filename = tempfile.mkstemp(prefix='.%s.' % basename,
+            dir=dirname)
+        try:
+            fp = os.fdopen(fd, 'w')
+            try:
+                fp.write(''.join(lines))
+            finally:
+                fp.close()
+            os.chmod(tmp_filename, 0644)
+            os.rename(tmp_filename, filename)
+        except:
+            os.unlink(tmp_filename)
+            raise
+    except EnvironmentError, e:
+        log.info("Unable to write user-to-VO map index %s: %s" % (filename,
+            str(e)))
+        return None
+    return openVoMapIndex(filename, header)
+
 class VoMapper:
     """
     This class maps a username to VO.
@@ -250,6 +516,12 @@ class VoMapper:
     The map_location variable holds the location of the user-to-vo map; this
     defaults to vo.user_vo_map in the config file.  The `parse` method
     re-parses the file.
+
+    The parsed map is kept in a sorted index file, vo.user_vo_map_index
+    (default: user-vo-map.idx in the GIP temp directory), which is rebuilt
+    only when the map changes and is shared by every provider.  Lookups
+    binary search the memory-mapped index instead of parsing the map.  If the
+    index cannot be written, the map is parsed into memory instead.
     """
 
     def __init__(self, cp):
@@ -257,41 +529,99 @@ class VoMapper:
         self.map_location = cp_get(cp, "vo", "user_vo_map",
                                    vdtDir('$VDT_LOCATION/monitoring/osg-user-vo-map.txt',
                                           '/var/lib/osg/user-vo-map'))
+        temp_dir = cp_get(cp, "gip", "temp_dir",
+            gipDir("$GIP_LOCATION/var/tmp", '/var/cache/gip'))
+        self.index_location = os.path.expandvars(cp_get(cp, "vo",
+            "user_vo_map_index", os.path.join(temp_dir, "user-vo-map.idx")))
 
         log.info("Using user-to-VO map location %s." % self.map_location)
         self.voi = []
         self.voc = []
-        self.userMap = {}
+        self.vos = []
+        self.index = None
+        self.count = 0
         #self.voMap = {}
         self.parse()
 
-        if not self.userMap:
+        if not self.count:
             raise ValueError("No users mapped -- is %s empty?" %
                              os.path.expandvars(self.map_location))
 
-    def parse(self):
+    def __getattr__(self, name):
+        # With an index, the full dictionary is only built if asked for.
+        if name == 'userMap':
+            self.userMap = self.readMap()[0]
+            return self.userMap
+        raise AttributeError(name)
+
+    def readMap(self):
         """
-        Parse the user-to-vo map specified at `self.map_location`
+        Read the user-to-vo map specified at `self.map_location`
+
+        @returns: The dictionary of users to VOs, the #voi and #VOc lists,
+            and the list of distinct VOs.
         """
+        userMap = {}
+        voi = []
+        voc = []
         fp = open(os.path.expandvars(self.map_location), 'r')
         for line in fp:
             try:
                 line = line.strip()
                 if line.startswith("#voi"):
-                    self.voi = line.split()[1:]
+                    voi = line.split()[1:]
                 elif line.startswith("#VOc"):
-                    self.voc = line.split()[1:]
+                    voc = line.split()[1:]
                 elif line.startswith("#"):
                     continue
                 else:
                     user, vo = line.split()
                     if (vo.startswith('uscms') or vo.startswith('usatlas')):
                         vo = vo[2:]
-                    self.userMap[user] = vo
+                    userMap[user] = vo
             except (KeyboardInterrupt, SystemExit):
                 raise
             except:
                 pass
+        fp.close()
+        vos = []
+        seen = {}
+        for vo in userMap.values():
+            if vo not in seen:
+                seen[vo] = True
+                vos.append(vo)
+        return userMap, voi, voc, vos
+
+    def parse(self):
+        """
+        Parse the user-to-vo map specified at `self.map_location`, using
+        its index if it is up to date.
+        """
+        self.__dict__.pop('userMap', None)
+        try:
+            header = voMapIndexHeader(os.path.expandvars(self.map_location))
+        except OSError:
+            header = None
+        index = None
+        if header:
+            index = _vo_map_indexes.get(self.index_location, None)
+            if index is None or index.header != header:
+                index = openVoMapIndex(self.index_location, header)
+        if index is None:
+            userMap, voi, voc, vos = self.readMap()
+            if header:
+                index = writeVoMapIndex(self.index_location, header, userMap,
+                    voi, voc, vos)
+            if index is None:
+                self.index = None
+                self.userMap = userMap
+                self.voi, self.voc, self.vos = voi, voc, vos
+                self.count = len(userMap)
+                return
+        _vo_map_indexes[self.index_location] = index
+        self.index = index
+        self.voi, self.voc, self.vos = index.voi, index.voc, index.vos
+        self.count = index.count
         #for i in range(len(self.voi)):
         #    try:
         #         self.voMap[self.voi[i]] = self.voc[i]
@@ -301,10 +631,13 @@ class VoMapper:
         #        pass
 
     def __getitem__(self, username):
-        try:
-            return self.userMap[username]
-        except KeyError:
+        if self.index is None:
+            vo = self.userMap.get(username, None)
+        else:
+            vo = self.index.lookup(username)
+        if vo is None:
             raise ValueError("Unable to map user: %s" % username)
+        return vo
 
 class FakeLogger:
     """
@@ -426,20 +759,50 @@ def HMSToMin(hms): #pylint: disable-msg=C0103
     h, m, s = hms.split(':')
     return int(h)*60 + int(m) + int(round(int(s)/60.0))
 
-def getTemplate(template, name):
+# Template files already read, keyed on (file name, template directories);
+# see loadTemplateFile.
+_template_files = {}
+# Templates already found by getTemplate, keyed on (file name, entry name,
+# template directories).
+_templates = {}
+# The template directories of the default configuration; see templateDirs.
+_default_template_dirs = None
+
+def templateDirs(cp=None):
+    """
+    Return the directories searched for template files, in order.
+
+    @keyword cp: The GIP configuration object; if not given, the directories
+        of the default configuration are used.  These are only looked up once
+        per process, so that getTemplate does not need to call config().
+    @return: A tuple of directory names.
+    """
+    global _default_template_dirs
+    if cp is None:
+        if _default_template_dirs is None:
+            _default_template_dirs = templateDirs(config())
+        return _default_template_dirs
+    template_dirs = cp_getList(cp, 'gip', 'local_template_dirs', [])
+    template_dirs.append(gipDir(os.path.expandvars('$GIP_LOCATION/templates'), '/usr/share/gip/templates'))
+    return tuple(template_dirs)
+
+def loadTemplateFile(template, cp=None):
     """
-    Return a template from a file.
+    Read a template file, once per process and set of template directories,
+    and index its entries.
 
     @param template: Name of the template file in $GIP_LOCATION/templates.
-    @param name: Entry in the template file; for now, this is the first
-        entry of the DN.
-    @return: Template string
-    @raise e: ValueError if it is unable to find the template in the file.
+    @keyword cp: The GIP configuration object; if not given, the default
+        configuration is used to find the local template directories.
+    @return: A tuple of the lines of the file and a dictionary mapping the
+        attribute of the first RDN of each entry's DN to the index of its
+        first line.
+    @raise e: ValueError if it is unable to find the template file.
     """
+    template_dirs = templateDirs(cp)
+    if (template, template_dirs) in _template_files:
+        return _template_files[template, template_dirs]
 
-    cp = config()
-    template_dirs = cp_getList(cp, 'gip', 'local_template_dirs', [])
-    template_dirs.append(gipDir(os.path.expandvars('$GIP_LOCATION/templates'), '/usr/share/gip/templates'))
     tried = []
     fp = ''
     
@@ -454,21 +817,59 @@ def getTemplate(template, name):
     if not fp:
         raise ValueError("Couldn't find template.  Searched %s" % tried)
 
+    lines = fp.readlines()
+    fp.close()
+    index = {}
+    for idx, line in enumerate(lines):
+        if line.startswith("dn: "):
+            index.setdefault(line[4:].split('=', 1)[0], idx)
+    # Looking up a name finds the first DN starting with it, which may belong
+    # to a longer attribute.
+    for attr in index.keys():
+        for other, idx in index.items():
+            if idx < index[attr] and other.startswith(attr):
+                index[attr] = idx
+    _template_files[template, template_dirs] = lines, index
+    return lines, index
+
+def getTemplate(template, name, cp=None):
+    """
+    Return a template from a file.
+
+    Template files are only read once per process and set of template
+    directories; see loadTemplateFile.
+
+    @param template: Name of the template file in $GIP_LOCATION/templates.
+    @param name: Entry in the template file; for now, this is the first
+        entry of the DN.
+    @keyword cp: The GIP configuration object, if the caller has one.
+    @return: Template string
+    @raise e: ValueError if it is unable to find the template in the file.
+    """
+    template_dirs = templateDirs(cp)
+    if (template, name, template_dirs) in _templates:
+        return _templates[template, name, template_dirs]
+
+    lines, index = loadTemplateFile(template, cp)
     start_str = "dn: %s" % name
-    mybuffer = ''
-    recording = False
-    for line in fp:
-        if line.startswith(start_str):
-            recording = True
-        if recording:
-            mybuffer += line
-            if line == '\n':
+    start = index.get(name, None)
+    if start is None:
+        for idx, line in enumerate(lines):
+            if line.startswith(start_str):
+                start = idx
                 break
+        else:
+            raise ValueError("Unable to find %s in template %s" % (name,
+                template))
+    end = start
+    while end < len(lines):
+        end += 1
+        if lines[end-1] == '\n':
+            break
 
-    fp.close()
-    if not recording:
-        raise ValueError("Unable to find %s in template %s" % (name, template))
-    return mybuffer[:-1]
+    mybuffer = ''.join(lines[start:end])[:-1]
+    _templates[template, name, template_dirs] = mybuffer
+    return mybuffer
 
 def printTemplate(template, info):
     """
@@ -476,7 +877,8 @@ def printTemplate(template, info):
     dictionary `info`.
 
     The different entries of the template are matched up to keys in the `info`
-    dictionary; the entries' values are the dictionary values.
+    dictionary; the entries' values are the dictionary values.  Lines which
+    end up containing __GIP_DELETEME are left out.
 
     To see what keys `info` needs for your template, read the template as
     found in::
@@ -488,11 +890,11 @@ def printTemplate(template, info):
     @type info: Dictionary
     @param template: Template string returned from getTemplate.
     """
-    populatedTemplate = (template % info).split('\n')
-    test = re.compile('.*__GIP_DELETEME.*')
-    for line in populatedTemplate:
-        deletable = test.match(line)
-        if not deletable: print line
+    populatedTemplate = template % info
+    if populatedTemplate.find('__GIP_DELETEME') >= 0:
+        populatedTemplate = '\n'.join([line for line in \
+            populatedTemplate.split('\n') if line.find('__GIP_DELETEME') < 0])
+    sys.stdout.write(populatedTemplate + '\n')
 
 def voList(cp, vo_map=None):
     """
@@ -506,7 +908,7 @@ def voList(cp, vo_map=None):
     if vo_map == None:
         vo_map = VoMapper(cp)
     vos = []
-    for vo in vo_map.userMap.values():
+    for vo in vo_map.vos:
         #vo = vo.lower()
         if vo not in vos:
             vos.append(vo)
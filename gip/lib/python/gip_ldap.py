@@ -14,51 +14,49 @@ class _hdict(dict): #pylint: disable-msg=C0103
     """
     Hashable dictionary; used to make LdapData objects hashable.
     """
+    __slots__ = ()
+
     def __hash__(self):
         items = self.items()
         items.sort()
         return hash(tuple(items))
 
 
-class LdapData:
+class LdapData(object):
 
     """
     Class representing the logical information in the GLUE entry.
     Given the LDIF GLUE, represent it as an object.
 
+    Entries are kept compact, as a full BDII dump contains hundreds of
+    thousands of them: the class uses __slots__, the attribute names and
+    objectClasses are interned, and the raw LDIF is only retained if
+    C{keep_ldif=True} is passed to the constructor.
+
+    @ivar glue: Dictionary representing the GLUE attributes.  The keys are the
+        GLUE entries, minus the "Glue" prefix.  The values are the entries
+        loaded from the LDIF.  If C{multi=True} was passed to the constructor,
+        then these are all tuples.  Otherwise, it is just a single string.
+    @ivar nonglue: Dictionary representing arbitrary non-GLUE attributes.
+        Handled similarly to the GLUE attributes.
+    @ivar objectClass: A tuple of the GLUE objectClasses this entry implements.
+    @ivar dn: A tuple containing the components of the DN.
+    @ivar ldif: The LDIF this entry was built from, or None if it was not
+        kept.
     """
 
-    #pylint: disable-msg=W0105
-    glue = {}
-    """
-    Dictionary representing the GLUE attributes.  The keys are the GLUE entries,
-    minus the "Glue" prefix.  The values are the entries loaded from the LDIF.
-    If C{multi=True} was passed to the constructor, then these are all tuples.
-    Otherwise, it is just a single string.
-    """
-
-    nonglue = {}
-    """
-    Dictionary representing arbitrary non-GLUE attributes.  Handled similarly
-    to the GLUE attributes.
-    """
+    __slots__ = ('glue', 'nonglue', 'objectClass', 'dn', 'multi', 'ldif',
+        '_hash')
 
-    objectClass = []
-    """
-    A list of the GLUE objectClasses this entry implements.
-    """
-
-    dn = []
-    """
-    A list containing the components of the DN.
-    """
-
-    def __init__(self, data, multi=False):
-        self.ldif = data
+    def __init__(self, data, multi=False, keep_ldif=False):
+        if keep_ldif:
+            self.ldif = data
+        else:
+            self.ldif = None
         glue = {}
         nonglue = {}
         objectClass = []
-        for line in self.ldif.split('\n'):
+        for line in data.split('\n'):
             if line.startswith('dn: '):
                 dn = line[4:].split(',')
                 dn = [i.strip() for i in dn]
@@ -79,17 +77,19 @@ class LdapData:
             if attr.startswith('Glue'):
                 if attr == 'GlueSiteLocation':
                     val = tuple([i.strip() for i in val.split(',')])
-                if multi and attr[4:] in glue:
-                    glue[attr[4:]].append(val)
+                attr = intern(attr[4:])
+                if multi and attr in glue:
+                    glue[attr].append(val)
                 elif multi:
-                    glue[attr[4:]] = [val]
+                    glue[attr] = [val]
                 else:
-                    glue[attr[4:]] = val
+                    glue[attr] = val
             elif attr == 'objectClass':
-                objectClass.append(val)
+                objectClass.append(intern(val))
             elif attr.lower() == 'mds-vo-name':
                 continue
             else:
+                attr = intern(attr)
                 if multi and attr in nonglue:
                     nonglue[attr].append(val)
                 elif multi:
@@ -114,38 +114,47 @@ class LdapData:
         self.nonglue = _hdict(nonglue)
         self.glue = _hdict(glue)
         self.multi = multi
+        # Only the DN goes into the hash; plugins alter the attributes in
+        # place, which would make a cached hash of them stale.
+        self._hash = hash(dnKey(self))
 
     def to_ldif(self):
         """
         Convert the LdapData back into LDIF.
+
+        If the original LDIF was kept (see C{keep_ldif}), it is returned
+        unchanged.  Code which alters the attributes of such an entry must set
+        C{ldif} to None so the entry is serialized again.
         """
-        ldif = 'dn: ' + ','.join(self.dn) + '\n'
+        if self.ldif is not None:
+            return self.ldif + '\n'
+        ldif = ['dn: ' + ','.join(self.dn) + '\n']
         for obj in self.objectClass:
-            ldif += 'objectClass: %s\n' % obj
+            ldif.append('objectClass: %s\n' % obj)
         for entry, values in self.glue.items():
             if entry == 'SiteLocation':
                 if self.multi:
                     for value in values:
-                        ldif += 'GlueSiteLocation: %s\n' % \
-                            ', '.join(list(value))
+                        ldif.append('GlueSiteLocation: %s\n' % \
+                            ', '.join(list(value)))
                 else:
-                    ldif += 'GlueSiteLocation: %s\n' % \
-                        ', '.join(list(values))
+                    ldif.append('GlueSiteLocation: %s\n' % \
+                        ', '.join(list(values)))
             elif not self.multi:
-                ldif += 'Glue%s: %s\n' % (entry, values)
+                ldif.append('Glue%s: %s\n' % (entry, values))
             else:
                 for value in values:
-                    ldif += 'Glue%s: %s\n' % (entry, value)
+                    ldif.append('Glue%s: %s\n' % (entry, value))
         for entry, values in self.nonglue.items():
             if not self.multi:
-                ldif += '%s: %s\n' % (entry, values)
+                ldif.append('%s: %s\n' % (entry, values))
             else:
                 for value in values:
-                    ldif += '%s: %s\n' % (entry, value)
-        return ldif
+                    ldif.append('%s: %s\n' % (entry, value))
+        return ''.join(ldif)
 
     def __hash__(self):
-        return hash(tuple([normalizeDN(self.dn), self.objectClass, self.glue, self.nonglue]))
+        return self._hash
 
     def __str__(self):
         output = 'Entry: %s\n' % str(self.dn)
@@ -179,50 +188,74 @@ class LdapData:
                 return False
         return True
 
-def read_ldap(fp, multi=False):
+def iter_ldap(fp, multi=False, keep_ldif=False):
     """
-    Convert a file stream into LDAP entries.
+    Incrementally convert a file stream into LDAP entries.
+
+    The stream is read one line at a time and each entry is yielded as soon
+    as it is complete, so arbitrarily large LDIF dumps can be processed
+    without holding them in memory.  Entries may be separated by blank
+    lines; a "dn:" line also starts a new entry if the separator is missing.
+    Lines starting with a single space are continuations of the previous
+    line.
 
     @param fp: Input stream containing LDIF data.
     @type fp: File-like object
     @keyword multi: If True, then the resulting LdapData objects can have
         multiple values per GLUE attribute.
-    @returns: List containing one LdapData object per LDIF entry.
+    @keyword keep_ldif: If True, the LdapData objects retain their LDIF.
+    @returns: Generator of LdapData objects, one per LDIF entry.
     """
-    entry_started = False
-    mybuffer = ''
-    entries = []
-    counter = 0
-    lines = fp.readlines()
-
-    # Put in newlines before dn: stanzas if they don't exist already
-    for line in lines[1:]:
-        counter += 1
-        if line.startswith('dn:'):
-            if lines[counter-1].strip():
-                lines.insert(counter-1, '\n')
-
-    # Now parse the LDIF into separate entries split on newlines
-    for origline in lines:
+    # Each logical line is kept as a list of its folded fragments so that
+    # continuation lines are joined once, not by repeated concatenation.
+    lines = []
+    for origline in fp:
         line = origline.strip()
-        if len(line) == 0 and entry_started == True:
-            entries.append(LdapData(mybuffer[1:], multi=multi))
-            entry_started = False
-            mybuffer = ''
-        elif len(line) == 0 and entry_started == False:
-            pass
-        else: # len(line) > 0
-            if not entry_started:
-                entry_started = True
-            if origline.startswith(' '):
-                mybuffer += origline[1:-1]
-            else:
-                mybuffer += '\n' + line
+        if not line:
+            if lines:
+                yield _ldap_from_lines(lines, multi, keep_ldif)
+                lines = []
+        elif origline[0] == ' ' and lines:
+            lines[-1].append(origline[1:].rstrip('\r\n'))
+        else:
+            if lines and line.startswith('dn:'):
+                yield _ldap_from_lines(lines, multi, keep_ldif)
+                lines = []
+            lines.append([line])
     #Catch the case where we started the entry and got to the end of the file
     #stream
-    if entry_started == True:
-        entries.append(LdapData(mybuffer[1:], multi=multi))
-    return entries
+    if lines:
+        yield _ldap_from_lines(lines, multi, keep_ldif)
+
+def _ldap_from_lines(lines, multi, keep_ldif):
+    return LdapData('\n'.join([''.join(parts) for parts in lines]),
+        multi=multi, keep_ldif=keep_ldif)
+
+def read_ldap(fp, multi=False, keep_ldif=False):
+    """
+    Convert a file stream into LDAP entries.
+
+    @param fp: Input stream containing LDIF data.
+    @type fp: File-like object
+    @keyword multi: If True, then the resulting LdapData objects can have
+        multiple values per GLUE attribute.
+    @keyword keep_ldif: If True, the LdapData objects retain their LDIF.
+    @returns: List containing one LdapData object per LDIF entry.
+    """
+    return list(iter_ldap(fp, multi=multi, keep_ldif=keep_ldif))
+
+def write_ldap(entries, fp):
+    """
+    Write LDAP entries to a file stream as LDIF, one blank line after each.
+
+    @param entries: Iterable of LdapData objects.
+    @param fp: Output stream.
+    @type fp: File-like object
+    """
+    write = fp.write
+    for entry in entries:
+        write(entry.to_ldif())
+        write('\n')
 
 def query_bdii(cp, query="(objectClass=GlueCE)", base="o=grid", filter=""):
     """
@@ -287,6 +320,95 @@ def _starts_with_suffix(ldif):
     else:
         return False
 
+def _is_suffix(rdn):
+    rdn = rdn.lower()
+    return rdn.find("mds-vo-name") >= 0 or rdn.find("o=grid") >= 0
+
+def dnKey(ldif):
+    """
+    Calculate a hashable key for the DN of an LdapData object.
+
+    Two entries which L{compareDN} considers equal will have the same key, so
+    the key can be used to index entries in a dictionary instead of comparing
+    every pair of entries.  The rules follow L{normalizeDN} and
+    L{_starts_with_suffix}:
+
+       - If the DN starts with the mds-vo-name / o=grid suffix, the full DN is
+         significant.
+       - Otherwise, the DN is truncated at the first suffix component, so
+         differing mds-vo-name values do not prevent a match.
+
+    @param ldif: LdapData object
+    @returns: Tuple usable as a dictionary key.
+    """
+    dn = ldif.dn
+    if _starts_with_suffix(ldif):
+        return (True, ) + tuple(dn)
+    key = [False]
+    for rdn in dn:
+        if _is_suffix(rdn):
+            break
+        key.append(rdn)
+    return tuple(key)
+
+class DNIndex:
+
+    """
+    An ordered collection of LdapData objects, indexed by L{dnKey}.
+
+    Lookups and removals by DN are dictionary operations, so merging provider,
+    plugin, and remove-attributes output into a large set of entries is linear
+    in the number of entries.  Removed entries leave a hole in the ordered list
+    which is skipped by L{entries}; this keeps the output order stable.
+    """
+
+    def __init__(self, entries=None):
+        self._entries = []
+        self._index = {}
+        if entries:
+            for entry in entries:
+                self.append(entry)
+
+    def append(self, entry):
+        """
+        Add an entry to the end of the collection.
+        """
+        self._index.setdefault(dnKey(entry), []).append(len(self._entries))
+        self._entries.append(entry)
+
+    def find(self, ldif):
+        """
+        Return a list of all the entries with the same DN as C{ldif}.
+        """
+        entries = []
+        for pos in self._index.get(dnKey(ldif), []):
+            entries.append(self._entries[pos])
+        return entries
+
+    def remove(self, ldif):
+        """
+        Remove all the entries with the same DN as C{ldif}.
+
+        @returns: The list of removed entries.
+        """
+        entries = []
+        for pos in self._index.pop(dnKey(ldif), []):
+            entries.append(self._entries[pos])
+            self._entries[pos] = None
+        return entries
+
+    def entries(self):
+        """
+        Return a list of the entries in the collection, in insertion order.
+        """
+        return [entry for entry in self._entries if entry is not None]
+
+    def __len__(self):
+        length = 0
+        for positions in self._index.values():
+            length += len(positions)
+        return length
+
 def compareDN(ldif1, ldif2):
     """
     Compare two DNs of LdapData objects.
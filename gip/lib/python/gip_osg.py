@@ -93,6 +93,48 @@ def cp_get(cp, section, option, default):
     except (ConfigParser.NoSectionError, ConfigParser.NoOptionError):
         return default
 
+def userVoMapFile(cp):
+    """
+    The location of the OSG user-to-VO map file.
+    """
+    etcDir = vdtDir(os.path.expandvars("$VDT_LOCATION/monitoring/"), '/etc/osg/')
+    defaultLoc = vdtDir(os.path.join(etcDir, "osg-user-vo-map.txt"), "/var/lib/osg/user-vo-map")
+    return cp_get(cp, "vo", "user_vo_map", defaultLoc)
+
+def osgConfigLocation(cp):
+    """
+    The OSG config.ini file, or the directory of .ini files, to read.
+    """
+    ini_dir = vdtDir(os.path.expandvars("$VDT_LOCATION/monitoring/config.ini"), '/etc/osg/config.d')
+    return cp_get(cp, "gip", "osg_config", ini_dir)
+
+def stateInfoFile():
+    """
+    The location of the grid-site-state-info file, which says whether the
+    site is closed.
+    """
+    state_info_file = '$VDT_LOCATION/MIS-CI/etc/grid-site-state-info'
+    state_info_file = os.path.expandvars(state_info_file)
+    return vdtDir(state_info_file, '/etc/osg/grid-site-state-info')
+
+def osgSourceFiles(cp):
+    """
+    List the files configOsg reads, so that callers can tell when its results
+    are out of date.  Directories are listed too, so that adding or removing
+    files in them is noticed.
+
+    @param cp: Site config object, before configOsg is applied.
+    @return: A list of file and directory names.
+    """
+    loc = osgConfigLocation(cp)
+    if os.path.isdir(loc):
+        files = [loc] + get_file_list(loc)
+    else:
+        files = [loc]
+    files.append(stateInfoFile())
+    files.append(userVoMapFile(cp))
+    return files
+
 def checkOsgConfigured(cp):
     """
     Make sure that the OSG has been configured when this is run.
@@ -106,11 +148,8 @@ def checkOsgConfigured(cp):
     @raise ValueError: If the specified file does not exist.
     """
 
-    etcDir = vdtDir(os.path.expandvars("$VDT_LOCATION/monitoring/"), '/etc/osg/')
-
     # Check to see if the osg-user-vo-map.txt exists and that its size is > 0
-    defaultLoc = vdtDir(os.path.join(etcDir, "osg-user-vo-map.txt"), "/var/lib/osg/user-vo-map")
-    osg_user_vo_map = cp_get(cp, "vo", "user_vo_map", defaultLoc)
+    osg_user_vo_map = userVoMapFile(cp)
 
     if not os.path.exists(osg_user_vo_map):
         raise ValueError("%s does not exist; we may be "
@@ -148,8 +187,7 @@ def configOsg(cp):
     # Load config.ini values
     cp2 = ConfigParser.ConfigParser()
 
-    ini_dir = vdtDir(os.path.expandvars("$VDT_LOCATION/monitoring/config.ini"), '/etc/osg/config.d')
-    loc = cp_get(cp, "gip", "osg_config", ini_dir)
+    loc = osgConfigLocation(cp)
     log.info("Using OSG config.ini %s." % loc)
 
     # if a directory is specified, then either we are an RPM install or a directory was
@@ -186,9 +224,7 @@ def configOsg(cp):
 
     # Set the site status:
     try:
-        state_info_file = '$VDT_LOCATION/MIS-CI/etc/grid-site-state-info'
-        state_info_file = os.path.expandvars(state_info_file)
-        state_info_file = vdtDir(state_info_file, '/etc/osg/grid-site-state-info')
+        state_info_file = stateInfoFile()
         if os.path.exists(state_info_file):
             results = int(os.popen("/bin/sh -c 'source %s; echo " \
                 "$grid_site_state_bit'" % state_info_file)
@@ -273,7 +273,7 @@ def getdCacheSESpace(cp, admin=None, gb=False, total=False):
     if admin == None:
         admin = connect_admin(cp)
     if not dCacheSpace_cache:
-        pools = lookupPoolStorageInfo(admin, log)
+        pools = lookupPoolStorageInfo(admin, log, cp)
         used = 0L # In KB
         free = 0L # In KB
         tot  = 0L # In KB
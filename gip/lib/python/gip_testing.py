@@ -10,7 +10,9 @@ import os
 import re
 import sys
 import types
+import errno
 import fcntl
+import signal
 import unittest
 import time
 import urlparse
@@ -112,6 +114,138 @@ def runCommand(cmd, force_command=False):
 
         return outdata
 
+def runCommands(cmds, timeout=None, max_parallel=0, force_command=False):
+    """
+    Run several commands concurrently, collecting their output like
+    runCommand.
+
+    A command which has not finished within the timeout is killed; it costs
+    only its own timeout, as the other commands keep running meanwhile.
+
+    @param cmds: A list of commands to execute.
+    @keyword timeout: Seconds each command is allowed to run (default: no
+        limit).
+    @keyword max_parallel: The most commands to run at once; 0 means no
+        limit.
+    @returns: A list holding, for each command, a file-like object with its
+        stdout, or None if the command timed out.
+    """
+    if replace_command and not force_command:
+        return [runCommand(cmd) for cmd in cmds]
+
+    log = getLogger("GIP.common")
+    results = [None] * len(cmds)
+    queue = list(enumerate(cmds))
+    running = []
+    streams = {}
+    while queue or running:
+        while queue and (max_parallel <= 0 or len(running) < max_parallel):
+            idx, cmd = queue.pop(0)
+            pid, outfd, errfd = _spawnCommand(cmd)
+            job = {'idx': idx, 'cmd': cmd, 'pid': pid, 'fds': [outfd, errfd],
+                'out': cStringIO.StringIO(), 'err': cStringIO.StringIO()}
+            if timeout:
+                job['deadline'] = time.time() + timeout
+            streams[outfd] = (job, job['out'])
+            streams[errfd] = (job, job['err'])
+            running.append(job)
+
+        wait = None
+        deadlines = [job['deadline'] for job in running if 'deadline' in job]
+        if deadlines:
+            wait = max(min(deadlines) - time.time(), 0)
+        # A command which closed its output but has not exited yet is polled,
+        # as there is nothing left to select on for it.
+        if [job for job in running if not job['fds']] and \
+                (wait is None or wait > 0.1):
+            wait = 0.1
+        try:
+            ready = select.select(streams.keys(), [], [], wait)[0]
+        except select.error, e:
+            if e[0] != errno.EINTR:
+                raise
+            ready = []
+        for fd in ready:
+            job, data = streams[fd]
+            try:
+                chunk = os.read(fd, 65536)
+            except OSError, oe:
+                if oe.errno in [errno.EAGAIN, errno.EINTR]:
+                    continue
+                raise
+            if chunk:
+                data.write(chunk)
+            else:
+                del streams[fd]
+                job['fds'].remove(fd)
+                os.close(fd)
+
+        now = time.time()
+        for job in list(running):
+            if not job['fds'] and 'status' not in job:
+                pid, status = os.waitpid(job['pid'], os.WNOHANG)
+                if pid:
+                    job['status'] = status
+            finished = 'status' in job
+            if not finished and job.get('deadline', now + 1) > now:
+                continue
+            running.remove(job)
+            if not finished:
+                log.warning("Command %s did not finish within %s seconds; " \
+                    "killing it." % (job['cmd'], timeout))
+                for fd in job['fds']:
+                    del streams[fd]
+                    os.close(fd)
+                # The command itself is killed too, in case it left its
+                # process group.
+                for kill, pid in [(os.killpg, job['pid']),
+                        (os.kill, job['pid'])]:
+                    try:
+                        kill(pid, signal.SIGKILL)
+                    except OSError:
+                        pass
+                os.waitpid(job['pid'], 0)
+            else:
+                exitStatus = job['status']
+                if exitStatus:
+                    job['err'].seek(0)
+                    log.info('Command %s exited with %d, stderr: %s' % \
+                        (job['cmd'], os.WEXITSTATUS(exitStatus),
+                        job['err'].readlines()))
+                job['out'].seek(0)
+                results[job['idx']] = job['out']
+    return results
+
+def _spawnCommand(cmd):
+    """
+    Start cmd in the shell, in its own process group so that everything it
+    starts can be killed together.
+
+    @returns: The pid of the child and non-blocking file descriptors for its
+        stdout and stderr.
+    """
+    outr, outw = os.pipe()
+    errr, errw = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        try:
+            os.setpgid(0, 0)
+            devnull = os.open('/dev/null', os.O_RDONLY)
+            os.dup2(devnull, 0)
+            os.dup2(outw, 1)
+            os.dup2(errw, 2)
+            for fd in [devnull, outr, outw, errr, errw]:
+                os.close(fd)
+            os.execv('/bin/sh', ['/bin/sh', '-c', cmd])
+        finally:
+            os._exit(127)
+    os.close(outw)
+    os.close(errw)
+    for fd in [outr, errr]:
+        fl = fcntl.fcntl(fd, fcntl.F_GETFL)
+        fcntl.fcntl(fd, fcntl.F_SETFL, fl | os.O_NONBLOCK)
+    return pid, outr, errr
+
 def generateTests(cp, cls, args=[]):
     """
     Given a class and args, generate a test case for every site in the BDII.
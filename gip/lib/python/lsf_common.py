@@ -8,9 +8,15 @@ Originally developed using CERN as a test case.
 import re
 import os
 import sys
+import time
+import marshal
+import tempfile
+import cStringIO
 import gip_sets as sets
-from gip_common import HMSToMin, getLogger, VoMapper, voList, cp_get, parseRvf
-from gip_testing import runCommand
+from gip_common import HMSToMin, getLogger, VoMapper, voList, cp_get, \
+    cp_getInt, parseRvf, gipDir
+from gip_testing import runCommand, runCommands
+from gip_batch import BatchQueries
 
 log = getLogger("GIP.LSF")
 
@@ -22,6 +28,11 @@ bmgroup_r_cmd = 'bmgroup -r -w'
 bugroup_r_cmd = 'bugroup -r -w'
 lshosts_cmd = 'lshosts -w %s'
 
+# The commands run together for the inventory snapshot; the group membership
+# commands may be answered from the group cache instead.
+inventory_cmds = [lsid_cmd, queue_info_cmd, lsfnodes_cmd, jobs_cmd]
+group_cmds = [bmgroup_r_cmd, bugroup_r_cmd]
+
 def lsfCommand(command, cp):
     """
     Run a command for the LSF batch system
@@ -39,30 +50,158 @@ def lsfCommand(command, cp):
     fp = runCommand(cmd)
     return fp
 
-def getLrmsInfo(cp):
+def groupCacheFile(cp):
+    """
+    The file caching the LSF host and user group membership; [lsf]
+    group_cache, by default lsf-groups.cache in the GIP temp directory.
+    """
+    temp_dir = cp_get(cp, "gip", "temp_dir", gipDir("$GIP_LOCATION/var/tmp",
+        '/var/cache/gip'))
+    return os.path.expandvars(cp_get(cp, "lsf", "group_cache",
+        os.path.join(temp_dir, "lsf-groups.cache")))
+
+def loadGroupCache(filename, key, ttl):
+    """
+    Load the group command outputs saved by saveGroupCache.
+
+    @param filename: The cache file.
+    @param key: The LSF host and commands the outputs must be for.
+    @param ttl: How old, in seconds, the cached outputs may be.
+    @returns: A dictionary mapping the group commands to their output, or
+        None if the cache is missing, for other commands, or too old.
+    """
+    try:
+        fp = open(filename, 'rb')
+        try:
+            cached = marshal.load(fp)
+        finally:
+            fp.close()
+    except (IOError, EOFError, ValueError, TypeError):
+        return None
+    try:
+        cached_key, timestamp, outputs = cached
+    except (TypeError, ValueError):
+        return None
+    age = time.time() - timestamp
+    if cached_key != key or age < 0 or age > ttl:
+        return None
+    return outputs
+
+def saveGroupCache(filename, key, outputs):
+    """
+    Atomically write the group command outputs for later use by
+    loadGroupCache.  Failures are logged, not raised.
+    """
+    try:
+        contents = marshal.dumps((key, time.time(), outputs))
+        dirname = os.path.dirname(os.path.abspath(filename))
+        fd, tmp_filename = tempfile.mkstemp(prefix='.lsf-groups.',
+            dir=dirname)
+        try:
+            os.write(fd, contents)
+            os.close(fd)
+            os.rename(tmp_filename, filename)
+        except:
+            os.unlink(tmp_filename)
+            raise
+    except Exception, e:
+        log.info("Unable to write LSF group cache %s: %s" % (filename,
+            str(e)))
+
+def getInventory(cp):
+    """
+    Take a snapshot of the LSF batch system: run the version, queue, host and
+    job commands, plus the host and user group commands, all at the same
+    time.
+
+    Group membership changes slowly, so the output of the group commands is
+    kept in the group cache for [lsf] group_cache_ttl seconds (default 3600;
+    0 disables the cache).
+
+    @param cp: The GIP configuration object
+    @returns: A dictionary mapping each command to its output, or to None if
+        it did not finish within [lsf] command_timeout seconds (default 300).
+    """
+    lsfHost = cp_get(cp, "lsf", "host", "localhost")
+    ttl = cp_getInt(cp, "lsf", "group_cache_ttl", 3600)
+    filename = groupCacheFile(cp)
+    key = [lsfHost] + group_cmds
+    groups = None
+    if ttl > 0:
+        groups = loadGroupCache(filename, key, ttl)
+    cmds = list(inventory_cmds)
+    if groups is None:
+        cmds += group_cmds
+    else:
+        log.debug("Using the LSF group membership cached in %s" % filename)
+
+    for cmd in cmds:
+        log.debug('Executing LSF command %s' % cmd)
+    outputs = runCommands(cmds, cp_getInt(cp, "lsf", "command_timeout", 300))
+    inventory = {}
+    for cmd, fp in zip(cmds, outputs):
+        if fp is None:
+            log.warning("LSF command %s did not finish in time." % cmd)
+            inventory[cmd] = None
+        else:
+            inventory[cmd] = fp.read()
+
+    if groups is None:
+        groups = dict([(cmd, inventory[cmd]) for cmd in group_cmds])
+        if ttl > 0 and None not in groups.values():
+            saveGroupCache(filename, key, groups)
+    inventory.update(groups)
+    return inventory
+
+def lsfOutput(command, cp, queries=None):
+    """
+    Return the output of one of the inventory commands.
+
+    @param command: The command; one of inventory_cmds or group_cmds.
+    @param cp: The GIP configuration object
+    @keyword queries: The BatchQueries object for this run, if any.  The
+        output is taken from its inventory snapshot; without it, the command
+        is run on its own.
+    @returns: File-like object of the LSF output; it is empty if the command
+        did not finish within [lsf] command_timeout when the snapshot was
+        taken.
+    """
+    if queries is None:
+        return lsfCommand(command, cp)
+    output = queries.run('inventory', getInventory, cp).get(command)
+    if output is None:
+        # Running the command again would only hang on it once more.
+        log.warning("No output from LSF command %s in the inventory; " \
+            "treating it as empty." % command)
+        return cStringIO.StringIO()
+    return cStringIO.StringIO(output)
+
+def getLrmsInfo(cp, queries=None):
     """
     Get the version information about the LSF version.
 
+    @keyword queries: The BatchQueries object for this run, if any.
     @returns: The LSF version string.
     @throws Excaeption: General exception thrown if version string can't
         be determined.
     """
     version_re = re.compile("Platform LSF")
-    for line in lsfCommand(lsid_cmd, cp):
+    for line in lsfOutput(lsid_cmd, cp, queries):
         m = version_re.search(line)
         if m:
             return line.strip()
     raise Exception("Unable to determine LRMS version info.")
 
-def getUserGroups(cp):
+def getUserGroups(cp, queries=None):
     """
     Get a list of groups and the users in the groups, using bugroup -r.
 
+    @keyword queries: The BatchQueries object for this run, if any.
     @returns: A dictionary of user-groups; the keys are the group name,
         the value is a list of user names
     """
     groups = {}
-    for line in lsfCommand(bugroup_r_cmd, cp):
+    for line in lsfOutput(bugroup_r_cmd, cp, queries):
         line = line.strip()
         info = line.split()
         group = info[0]
@@ -101,13 +240,14 @@ def usersToVos(cp, qInfo, user_groups, vo_map):
         all_vos.add(vo)
     return list(all_vos)
 
-def getJobsInfo(vo_map, cp):
+def getJobsInfo(vo_map, cp, queries=None):
     """
     @param vo_map: A mapping of user name to vo name.
     @param cp: The GIP configuration object
+    @keyword queries: The BatchQueries object for this run, if any.
     """
     queue_jobs = {}
-    for orig_line in lsfCommand(jobs_cmd, cp):
+    for orig_line in lsfOutput(jobs_cmd, cp, queries):
         line = orig_line.strip()
         try:
             info = line.split()
@@ -135,7 +275,7 @@ def getJobsInfo(vo_map, cp):
         queue_jobs[queue] = queue_data
     return queue_jobs
 
-def getQueueInfo(cp):
+def getQueueInfo(cp, queries=None):
     """
     Looks up the queue information from LSF.
     
@@ -153,9 +293,13 @@ def getQueueInfo(cp):
       - B{total}: Total number of jobs in this queue.
 
     @param cp: Configuration of site.
+    @keyword queries: The BatchQueries object for this run, if any.
     @returns: A dictionary of queue data.  The keys are the queue names, and
         the value is the queue data dictionary.
     """
+    output = lsfOutput(queue_info_cmd, cp, queries)
+    if queries is None:
+        queries = BatchQueries(cp)
     queueInfo = {}
     statistics_re = '\s*(.*?)\s+(.*?)\s+(.*?)\s+(.*?)\s+(.*?)\s+(.*?)\s+' \
         '(.*?)\s+(.*?)\s+(.*?)\s+(.*?)\s+(.*?)\s+(.*?)\s+(.*?)\s+'
@@ -169,7 +313,7 @@ def getQueueInfo(cp):
         # for the PARAMETERS/STATISTICS data.
     hasQueueInfo = False # Set to true when we have found the values in the
         # PARAMETERS/STATISTICS data.
-    for orig_line in lsfCommand(queue_info_cmd, cp):
+    for orig_line in output:
         line = orig_line.strip()
         # Skip blank lines
         if len(line) == 0:
@@ -243,13 +387,13 @@ def getQueueInfo(cp):
             pass
         limit_key = None
    
-    vo_map = VoMapper(cp) 
-    user_groups = getUserGroups(cp)
+    vo_map = queries.getVoMapper()
+    user_groups = queries.run('user_groups', getUserGroups, cp, queries)
     for queue, qInfo in queueInfo.items():
         qInfo['vos'] = usersToVos(cp, qInfo, user_groups, vo_map)
     return queueInfo
 
-def parseNodes(queueInfo, cp):
+def parseNodes(queueInfo, cp, queries=None):
     """
     Parse the node information from LSF.  Using the output from bhosts,
     determine:
@@ -262,13 +406,14 @@ def parseNodes(queueInfo, cp):
     @param queueInfo: The information about the queues, as returned by
        getQueueInfo
     @param cp: ConfigParser object holding the GIP configuration.
+    @keyword queries: The BatchQueries object for this run, if any.
     """
     totalCpu = 0
     freeCpu = 0
     queueCpu = {}
     hostInfo = {}
     hostListNoMax = []
-    for line in lsfCommand(lsfnodes_cmd, cp):
+    for line in lsfOutput(lsfnodes_cmd, cp, queries):
         info = [i.strip() for i in line.split()]
         # Skip any malformed lines
         if len(info) != 9:
@@ -312,25 +457,33 @@ def parseNodes(queueInfo, cp):
         totalCpu += max
         freeCpu += max-njobs
 
-    groupInfo = {}
-    for line in lsfCommand(bmgroup_r_cmd, cp):
+    # Sum the CPUs of each host group once, rather than once per queue
+    # using the group.
+    groupCpu = {}
+    for line in lsfOutput(bmgroup_r_cmd, cp, queries):
         info = line.strip().split()
-        groupInfo[info[0]] = info[1:]
+        if not info:
+            continue
+        max, njobs = 0, 0
+        for host in info[1:]:
+            hInfo = hostInfo.get(host, {})
+            max += hInfo.get('max', 0)
+            njobs += hInfo.get('njobs', 0)
+        groupCpu[info[0]] = (max, njobs)
     for queue, qInfo in queueInfo.items():
         max, njobs = 0, 0
         for group in qInfo['HOSTS'].split():
             group = group.split('+')[0] # sometimes +INT gets appended to hosts
             group = group.strip('/') # and some have a slash at the end
-            for host in groupInfo.get(group, []):
-                hInfo = hostInfo.get(host, {})
-                max += hInfo.get('max', 0)
-                njobs += hInfo.get('njobs', 0)
+            group_max, group_njobs = groupCpu.get(group, (0, 0))
+            max += group_max
+            njobs += group_njobs
         queueCpu[queue] = {'max': max, 'njobs': njobs}
     log.debug('totalCpu, freeCpu, queueCpu: (%s, %s, %s)' % (totalCpu, freeCpu, queueCpu))
               
     return totalCpu, freeCpu, queueCpu
 
-def getQueueList(cp):
+def getQueueList(cp, queries=None):
     """
     Returns a list of all the queue names that are supported.
 
@@ -338,8 +491,11 @@ def getQueueList(cp):
         * lsf.queue_exclude
     
     @param cp: Site configuration
+    @keyword queries: The BatchQueries object for this run, if any.
     @returns: List of strings containing the queue names.
     """
+    if queries is None:
+        queries = BatchQueries(cp)
     queues = []
     try:
         queue_exclude = [i.strip() for i in cp.get("lsf", "queue_exclude").\
@@ -352,7 +508,7 @@ def getQueueList(cp):
         rvf_queue_list = rvf_queue_list.split()
         log.info("The RVF lists the following queues: %s." % ', '.join( \
             rvf_queue_list))
-    for queue in getQueueInfo(cp):
+    for queue in queries.run('queues', getQueueInfo, cp, queries):
         if rvf_queue_list and queue not in rvf_queue_list:
             continue
         if queue not in queue_exclude:
@@ -360,7 +516,7 @@ def getQueueList(cp):
 
     return queues
 
-def getVoQueues(queueInfo, cp):
+def getVoQueues(queueInfo, cp, queries=None):
     """
     Determine the (vo, queue) tuples for this site.  This allows for central
     configuration of which VOs are advertised.
@@ -369,10 +525,13 @@ def getVoQueues(queueInfo, cp):
     whitelist certain VOs for a particular queue, and blacklist VOs from queues.
 
     @param cp: Site configuration
+    @keyword queries: The BatchQueries object for this run, if any.
     @returns: A list of (vo, queue) tuples representing the queues each VO
         is allowed to run in.
     """
-    voMap = VoMapper(cp)
+    if queries is None:
+        queries = BatchQueries(cp)
+    voMap = queries.getVoMapper()
     try:
         queue_exclude = [i.strip() for i in cp.get("lsf", "queue_exclude").\
             split(',')]
@@ -12,6 +12,7 @@ import os
 from gip_common import HMSToMin, getLogger, VoMapper, voList, parseRvf
 from gip_common import addToPath, cp_get
 from gip_testing import runCommand
+from gip_batch import BatchQueries
 
 log = getLogger("GIP.PBS")
 
@@ -43,59 +44,24 @@ def pbsOutputFilter(fp):
         for line in pbsOutputFilter(fp):
            ... parse line ...
 
-    This function uses iterators
+    This function is a generator; continuation lines are joined in a single
+    pass over the output.
     """
-    class PBSIter:
-        """
-        An iterator for PBS output; this allows us to easily parse over 
-        PBS-style line continuations.
-        """
-
-        def __init__(self, fp):
-            self.fp = fp
-            self.fp_iter = fp.__iter__()
-            self.prevline = None
-            self.done = False
-
-        def next(self):
-            """
-            Return the next full line of output for the iterator.
-            """
-            if self.prevline == None:
-                line = self.fp_iter.next()
-                if line.startswith('\t'):
-                    # Bad! The output shouldn't start with a 
-                    # partial line
-                    raise ValueError("PBS output contained bad data.")
-                self.prevline = line
-                return self.next()
-            if self.done:
-                raise StopIteration()
-            try:
-                line = self.fp_iter.next()
-                if line.startswith('\t'):
-                    self.prevline = self.prevline[:-1] + line[1:-1]
-                    return self.next()
-                else:
-                    old_line = self.prevline
-                    self.prevline = line
-                    return old_line
-            except StopIteration:
-                self.done = True
-                return self.prevline
-
-    class PBSFilter:
-        """
-        An iterable object based upon the PBSIter iterator.
-        """
-        
-        def __init__(self, myiter):
-            self.iter = myiter
-
-        def __iter__(self):
-            return self.iter
-
-    return PBSFilter(PBSIter(fp))
+    prevline = None
+    for line in fp:
+        if prevline is None:
+            if line.startswith('\t'):
+                # Bad! The output shouldn't start with a 
+                # partial line
+                raise ValueError("PBS output contained bad data.")
+            prevline = line
+        elif line.startswith('\t'):
+            prevline = prevline[:-1] + line[1:-1]
+        else:
+            yield prevline
+            prevline = line
+    if prevline is not None:
+        yield prevline
 
 def pbsCommand(command, cp):
     """
@@ -145,37 +111,50 @@ def getJobsInfo(vo_map, cp):
     a dictionary with the following keys:
        - running: Number of VO running jobs in this queue.
        - wait: Number of VO waiting jobs in this queue.
+       - held: Number of VO held jobs in this queue.
        - total: Number of VO total jobs in this queue.
+
+    The qstat output is read once and folded into counts per (user, queue,
+    state); users are mapped to VOs afterward, once per distinct user, so the
+    cost of the VO lookups does not grow with the number of jobs.
     
     @param vo_map: A VoMapper object which is used to map user names to VOs.
     @param cp: Site configuration object
     @return: A dictionary containing queue job information.
     """
-    queue_jobs = {}
+    counts = {}
     for orig_line in pbsCommand(jobs_cmd, cp):
-        try:
-            job, _, user, _, status, queue = orig_line.split()
-        except (KeyboardInterrupt, SystemExit):
-            raise
-        except:
-            continue
-        if job.startswith("-"):
+        fields = orig_line.split()
+        if len(fields) != 6 or fields[0].startswith("-"):
             continue
-        queue_data = queue_jobs.get(queue, {})
-        try:
-            vo = vo_map[user].lower()
-        except:
-            # Most likely, this means that the user is local and not
-            # associated with a VO, so we skip the job.
+        key = (fields[2], fields[5], fields[4])
+        counts[key] = counts.get(key, 0) + 1
+
+    vos = {}
+    queue_jobs = {}
+    for (user, queue, status), count in counts.items():
+        if user not in vos:
+            try:
+                vos[user] = vo_map[user].lower()
+            except:
+                # Most likely, this means that the user is local and not
+                # associated with a VO, so we skip the user's jobs.
+                vos[user] = None
+        vo = vos[user]
+        if vo is None:
             continue
-        info = queue_data.get(vo, {"running":0, "wait":0, "total":0})
+        queue_data = queue_jobs.setdefault(queue, {})
+        info = queue_data.get(vo)
+        if info is None:
+            info = {"running":0, "wait":0, "held":0, "total":0}
+            queue_data[vo] = info
         if status == "R":
-            info["running"] += 1
-        if status == "Q":
-            info["wait"] += 1
-        info["total"] += 1
-        queue_data[vo] = info
-        queue_jobs[queue] = queue_data
+            info["running"] += count
+        elif status == "Q":
+            info["wait"] += count
+        elif status == "H":
+            info["held"] += count
+        info["total"] += count
     return queue_jobs
 
 def getQueueInfo(cp):
@@ -191,6 +170,8 @@ def getQueueInfo(cp):
       - B{running}: Number of running jobs in this queue.
       - B{wait}: Waiting jobs in this queue.
       - B{total}: Total number of jobs in this queue.
+      - B{neednodes}: The node properties the queue's jobs ask for by
+        default (Torque), if any; see L{parseNeednodes}.
 
     @param cp: Configuration of site.
     @returns: A dictionary of queue data.  The keys are the queue names, and
@@ -253,6 +234,8 @@ def getQueueInfo(cp):
             queue_data["max_running"] = int(val)
         elif attr == "resources_max.nodect":
             queue_data["job_slots"] = int(val)
+        elif attr == "resources_default.neednodes":
+            queue_data["neednodes"] = parseNeednodes(val)
         elif attr == "max_queuable" or attr == 'max_queueable':
             try:
                 queue_data["max_waiting"] = int(val)
@@ -281,7 +264,96 @@ def getQueueInfo(cp):
 
     return queueInfo
 
-def parseNodes(cp, version):
+class PBSNode(object):
+    """
+    The state of one node, as reported by pbsnodes.
+
+    @ivar name: The node name.
+    @ivar state: The node state, such as "free" or "job-busy,offline".
+    @ivar np: The number of CPUs (np in Torque, resources_available.ncpus in
+        PBSPro), or None if not reported.
+    @ivar used: The number of CPUs assigned to jobs (PBSPro only).
+    @ivar jobs: The number of jobs assigned to the node.
+    @ivar properties: The node properties (Torque only).
+    @ivar queue: The queue the node belongs to, if any (PBSPro only).
+    """
+
+    __slots__ = ['name', 'state', 'np', 'used', 'jobs', 'properties', 'queue']
+
+    def __init__(self, name):
+        self.name = name
+        self.state = ''
+        self.np = None
+        self.used = 0
+        self.jobs = 0
+        self.properties = ()
+        self.queue = None
+
+def getNodeTable(cp, version):
+    """
+    Parse the output of pbsnodes into a table of nodes, in a single pass.
+
+    @param cp: The GIP configuration object
+    @param version: The PBS version, from getLrmsInfo.
+    @returns: A list of PBSNode objects, in the order pbsnodes lists them.
+    """
+    if version.find("PBSPro") >= 0:
+        np_attr = "resources_available.ncpus"
+    else:
+        np_attr = "np"
+    nodes = []
+    node = None
+    for line in pbsCommand(pbsnodes_cmd, cp):
+        if not line.strip():
+            continue
+        if not line[0].isspace():
+            node = PBSNode(line.strip())
+            nodes.append(node)
+            continue
+        idx = line.find(" = ")
+        if node is None or idx < 0:
+            continue
+        attr = line[:idx].strip()
+        val = line[idx+3:].strip()
+        if attr == "state":
+            node.state = val
+        elif attr == np_attr:
+            try:
+                node.np = int(val)
+            except:
+                node.np = 1
+        elif attr == "resources_assigned.ncpus":
+            try:
+                node.used = int(val)
+            except:
+                pass
+        elif attr == "jobs":
+            if val:
+                node.jobs = val.count(',') + 1
+        elif attr == "properties":
+            node.properties = tuple([i.strip() for i in val.split(',')])
+        elif attr == "queue":
+            node.queue = val
+    return nodes
+
+def parseNeednodes(val):
+    """
+    Find the node properties in a Torque resources_default.neednodes value,
+    such as "bigmem" or "2:ppn=8:bigmem".  Of a value asking for several
+    kinds of nodes ("1:bigmem+2:ib"), only the first kind is used.
+
+    @returns: A list of the node properties (or names) a node must have to
+        run the queue's jobs.
+    """
+    properties = []
+    for part in val.split('+')[0].split(':'):
+        part = part.strip()
+        if not part or part.isdigit() or part.find('=') >= 0:
+            continue
+        properties.append(part)
+    return properties
+
+def parseNodes(cp, version, queueInfo=None):
     """
     Parse the node information from PBS.  Using the output from pbsnodes, 
     determine:
@@ -290,69 +362,71 @@ def parseNodes(cp, version):
         - The number of free CPUs in the system.
         - A dictionary mapping PBS queue names to a tuple containing the
             (totalCPUs, freeCPUs).
+
+    For PBSPro, nodes belonging to a queue are counted both in the totals
+    and in that queue's entry.  For Torque, a node is counted in the entry
+    of each queue in queueInfo whose neednodes properties it has (all of
+    them, matched against the node's properties or name); queues without
+    neednodes are left out.
+
+    @param cp: The GIP configuration object
+    @param version: The PBS version, from getLrmsInfo.
+    @keyword queueInfo: The queue data from getQueueInfo, for Torque.
     """
     totalCpu = 0
     freeCpu = 0
     queueCpu = {}
-    queue = None
-    avail_cpus = None
-    used_cpus = None
-    if version.find("PBSPro") >= 0:
-        for line in pbsCommand(pbsnodes_cmd, cp):
-            if len(line.strip()) == 0:
-                continue
-            if not line.startswith('    ') and avail_cpus != None:
-                if queue != None:
-                    info = queueCpu.get(queue, [0, 0])
-                    info[0] += avail_cpus
-                    info[1] += avail_cpus - used_cpus
-                    queueCpu[queue] = info
-                else:
-                    totalCpu += avail_cpus
-                    freeCpu += avail_cpus - used_cpus
-                queue = None
-                continue
-            line = line.strip()
-            try:
-                attr, val = line.split(" = ")
-            except:
-                continue
-            if attr == "resources_available.ncpus":
-                avail_cpus = int(val)
-            elif attr == "resources_assigned.ncpus":
-                used_cpus = int(val)
-    else:
-        for line in pbsCommand(pbsnodes_cmd, cp):
-            try:
-                attr, val = line.split(" = ")
-            except:
-                continue
-            val = val.strip()
-            attr = attr.strip()
-            if attr == "state":
-                state = val
-            if attr == "np":
-                try:
-                    np = int(val)
-                except:
-                    np = 1
-                if not (state.find("down") >= 0 or \
-                        state.find("offline") >= 0):
-                    totalCpu += np
-                if state.find("free") >= 0:
-                    freeCpu += np
-            if attr == "jobs" and state == "free":
-                freeCpu -= val.count(',')
+    pbspro = version.find("PBSPro") >= 0
+    queueProperties = []
+    if not pbspro and queueInfo:
+        for queue, info in queueInfo.items():
+            if info.get('neednodes'):
+                queueProperties.append((queue, info['neednodes']))
+    for node in getNodeTable(cp, version):
+        if node.np is None:
+            continue
+        if pbspro:
+            totalCpu += node.np
+            freeCpu += node.np - node.used
+            if node.queue != None:
+                info = queueCpu.setdefault(node.queue, [0, 0])
+                info[0] += node.np
+                info[1] += node.np - node.used
+            continue
+        nodeTotal = 0
+        nodeFree = 0
+        if not (node.state.find("down") >= 0 or \
+                node.state.find("offline") >= 0):
+            nodeTotal = node.np
+        if node.state.find("free") >= 0:
+            nodeFree = node.np
+        # A free node's CPUs have always been reduced by the number of
+        # commas in its job list; keep the published numbers stable.
+        if node.state == "free" and node.jobs:
+            nodeFree -= node.jobs - 1
+        totalCpu += nodeTotal
+        freeCpu += nodeFree
+        for queue, properties in queueProperties:
+            for prop in properties:
+                if prop not in node.properties and prop != node.name:
+                    break
+            else:
+                info = queueCpu.setdefault(queue, [0, 0])
+                info[0] += nodeTotal
+                info[1] += nodeFree
 
     return totalCpu, freeCpu, queueCpu
 
-def getQueueList(cp):
+def getQueueList(cp, queries=None):
     """
     Returns a list of all the queue names that are supported.
 
     @param cp: Site configuration
+    @keyword queries: The BatchQueries object for this run, if any.
     @returns: List of strings containing the queue names.
     """
+    if queries is None:
+        queries = BatchQueries(cp)
     queues = []
     try:            
         queue_exclude = [i.strip() for i in cp.get("pbs", "queue_exclude").\
@@ -365,14 +439,14 @@ def getQueueList(cp):
         rvf_queue_list = rvf_queue_list.split()
         log.info("The RVF lists the following queues: %s." % ', '.join( \
             rvf_queue_list))
-    for queue in getQueueInfo(cp):
+    for queue in queries.run('queues', getQueueInfo, cp):
         if rvf_queue_list and queue not in rvf_queue_list:
             continue
         if queue not in queue_exclude:
             queues.append(queue)
     return queues
 
-def getVoQueues(cp):
+def getVoQueues(cp, queries=None):
     """
     Determine the (vo, queue) tuples for this site.  This allows for central
     configuration of which VOs are advertised.
@@ -381,17 +455,20 @@ def getVoQueues(cp):
     whitelist certain VOs for a particular queue, and blacklist VOs from queues.
 
     @param cp: Site configuration
+    @keyword queries: The BatchQueries object for this run, if any.
     @returns: A list of (vo, queue) tuples representing the queues each VO
         is allowed to run in.
     """
-    voMap = VoMapper(cp)
+    if queries is None:
+        queries = BatchQueries(cp)
+    voMap = queries.getVoMapper()
     try:
         queue_exclude = [i.strip() for i in cp.get("pbs", "queue_exclude").\
             split(',')]
     except:
         queue_exclude = []
     vo_queues = []
-    queueInfo = getQueueInfo(cp)
+    queueInfo = queries.run('queues', getQueueInfo, cp)
     rvf_info = parseRvf('pbs.rvf')
     rvf_queue_list = rvf_info.get('queue', {}).get('Values', None)
     if rvf_queue_list:
@@ -24,6 +24,7 @@ from gip_common import  getLogger, VoMapper, voList, parseRvf
 from xml_common import parseXmlSax
 from sge_sax_handler import QueueInfoParser, JobInfoParser
 from gip_testing import runCommand
+from gip_batch import BatchQueries
 from UserDict import UserDict
 import gip_sets as sets
 
@@ -144,40 +145,41 @@ def convert_time_to_secs(entry, infinity=9999999, error=None):
 
 def getQueueInfo(cp):
     """
-    Looks up the queue and job information from SGE.
+    Looks up the queue information from SGE.
+
+    The queue instances are summed into their cluster queues while the
+    qstat XML is parsed.
 
     @param cp: Configuration of site.
-    @returns: A dictionary of queue data and a dictionary of job data.
+    @returns: A dictionary of queue data, and the dictionary of totals
+        returned by QueueInfoParser.getQueueInfo.  The queue data maps each
+        cluster queue to its slots_used, slots_total, slots_free,
+        max_running, status, arch (if known) and the limits from
+        L{getQueueConfig}; its special "waiting" entry is a dictionary whose
+        "waiting" key holds the number of pending jobs.  The totals map each
+        cluster queue to a dictionary of its summed slots_used and
+        slots_total (as ints) and its arch, and "waiting" to the number of
+        pending jobs (an int), rather than listing each queue instance.
     """
     queue_list = {}
     xml = runCommand(sge_queue_info_cmd)
     handler = QueueInfoParser()
     parseXmlSax(xml, handler)
     queue_info = handler.getQueueInfo()
-    for queue, qinfo in queue_info.items():
+    for name, qinfo in queue_info.items():
 
-        if queue == 'waiting':
+        if name == 'waiting':
             continue
 
-        # get queue name
-        name = queue.split("@")[0]
-        q = queue_list.get(name, {'slots_used': 0, 'slots_total': 0,
-            'slots_free': 0, 'waiting' : 0, 'name' : name})
-        try:
-            q['slots_used'] += int(qinfo['slots_used'])
-        except:
-            pass
-        try:
-            q['slots_total'] += int(qinfo['slots_total'])
-        except:
-            pass
+        q = {'slots_used': qinfo['slots_used'],
+            'slots_total': qinfo['slots_total'], 'waiting' : 0, 'name' : name}
         q['slots_free'] = q['slots_total'] - q['slots_used']
         if 'arch' in qinfo:
             q['arch'] = qinfo['arch']
         q['max_running'] = q['slots_total']
 
         try:
-            state = queue_info[queue]["state"]
+            state = qinfo["state"]
             if state.find("d") >= 0 or state.find("D") >= 0:
                 status = "Draining"
             elif state.find("s") >= 0:
@@ -188,69 +190,85 @@ def getQueueInfo(cp):
             status = "Production"
 
         q['status'] = status
-        q['priority'] = 0  # No such thing that I can find for a queue
+        q.update(getQueueConfig(name, cp))
 
-        # How do you handle queues with no limit?
-        sqc = SGEQueueConfig(sgeCommand(sge_queue_config_cmd % name, cp))
+        queue_list[name] = q
 
-        try:
-            q['priority'] = int(sqc['priority'])
-        except:
-            pass
+    queue_list['waiting'] = {'waiting': queue_info['waiting']}
 
-        max_wall_hard = convert_time_to_secs(sqc.get('h_rt', 'INFINITY'))
-        max_wall_soft = convert_time_to_secs(sqc.get('s_rt', 'INFINITY'))
-        max_wall = min(max_wall_hard, max_wall_soft)
+    return queue_list, queue_info
 
-        try:
-            q['max_wall'] = min(max_wall, q['max_wall'])
-        except:
-            q['max_wall'] = max_wall
+def getQueueConfig(name, cp):
+    """
+    Look up the limits of a cluster queue from its qconf configuration.
 
-        user_list = sqc.get('user_lists', 'NONE')
-        if user_list.lower().find('none') >= 0:
-            user_list = re.split('\s*,?\s*', user_list)
-        if 'all' in user_list:
-            user_list = []
-        q['user_list'] = user_list
+    @param name: The name of the cluster queue.
+    @param cp: Configuration of site.
+    @returns: A dictionary with the priority, max_wall and user_list of the
+        queue; the user_list is a list of the access lists of the queue,
+        empty if the queue is open to all.
+    """
+    sqc = SGEQueueConfig(sgeCommand(sge_queue_config_cmd % name, cp))
 
-        queue_list[name] = q
+    q = {'priority': 0} # No such thing that I can find for a queue
+    try:
+        q['priority'] = int(sqc['priority'])
+    except:
+        pass
 
-    waiting_jobs = 0
-    for job in queue_info['waiting']:
-        waiting_jobs += 1
-    queue_list['waiting'] = {'waiting': waiting_jobs}
+    # How do you handle queues with no limit?
+    max_wall_hard = convert_time_to_secs(sqc.get('h_rt', 'INFINITY'))
+    max_wall_soft = convert_time_to_secs(sqc.get('s_rt', 'INFINITY'))
+    q['max_wall'] = min(max_wall_hard, max_wall_soft)
 
-    return queue_list, queue_info
+    user_list = sqc.get('user_lists', 'NONE').strip()
+    if user_list.lower() == 'none':
+        user_list = []
+    else:
+        user_list = re.split('\s*,?\s*', user_list)
+    if 'all' in user_list:
+        user_list = []
+    q['user_list'] = user_list
+    return q
 
 def getJobsInfo(vo_map, cp):
+    """
+    Return the running, waiting and total number of jobs of each VO in each
+    queue.
+
+    The jobs are counted per (owner, queue, state) as the qstat XML is
+    parsed; each owner is then mapped to a VO once.
+
+    @param vo_map: A VoMapper object which is used to map user names to VOs.
+    @param cp: Site configuration object
+    @return: A dictionary mapping queue names to dictionaries of VO job
+        counts.
+    """
     xml = runCommand(sge_job_info_cmd)
     handler = JobInfoParser()
     parseXmlSax(xml, handler)
-    job_info = handler.getJobInfo()
+    vos = {}
     queue_jobs = {}
     
-    for job in job_info:
-        user = job['JB_owner']
-        state = job['state']
-        queue = job.get('queue_name', '')
-        if queue.strip() == '':
-            queue = 'waiting'
-        queue = queue.split('@')[0]
-        try:
-            vo = vo_map[user].lower()
-        except:
-            # Most likely, this means that the user is local and not
-            # associated with a VO, so we skip the job.
+    for (user, queue, running), count in handler.getJobCounts().items():
+        if user not in vos:
+            try:
+                vos[user] = vo_map[user].lower()
+            except:
+                # Most likely, this means that the user is local and not
+                # associated with a VO, so we skip the user's jobs.
+                vos[user] = None
+        vo = vos[user]
+        if vo is None:
             continue
 
         voinfo = queue_jobs.setdefault(queue, {})
         info = voinfo.setdefault(vo, {"running":0, "wait":0, "total":0})
-        if state == "r":
-            info["running"] += 1
+        if running:
+            info["running"] += count
         else:
-            info["wait"] += 1
-        info["total"] += 1
+            info["wait"] += count
+        info["total"] += count
         info["vo"] = vo
     log.debug("SGE job info: %s" % str(queue_jobs))
     return queue_jobs
@@ -281,21 +299,26 @@ def parseNodes(cp):
     """
     raise NotImplementedError()
 
-def getQueueList(cp):
+def getQueueList(cp, queries=None):
     """
     Returns a list of all the queue names that are supported.
 
     @param cp: Site configuration
+    @keyword queries: The BatchQueries object for this run, if any.
     @returns: List of strings containing the queue names.
     """
-    vo_queues = getVoQueues(cp)
+    if queries is None:
+        queries = BatchQueries(cp)
+    vo_queues = queries.run('vo_queues', getVoQueues, cp, queries)
     queues = sets.Set()
     for vo, queue in vo_queues:
         queues.add(queue)
     return queues
 
-def getVoQueues(cp):
-    voMap = VoMapper(cp)
+def getVoQueues(cp, queries=None):
+    if queries is None:
+        queries = BatchQueries(cp)
+    voMap = queries.getVoMapper()
     try:
         queue_exclude = [i.strip() for i in cp.get("sge",
             "queue_exclude").split(',')]
@@ -306,7 +329,7 @@ def getVoQueues(cp):
     queue_exclude.append('waiting')
     
     vo_queues = []
-    queue_list, q = getQueueInfo(cp)
+    queue_list, q = queries.run('queues', getQueueInfo, cp)
     rvf_info = parseRvf('sge.rvf')
     rvf_queue_list = rvf_info.get('queue', {}).get('Values', None)
     if rvf_queue_list:
@@ -1,79 +1,92 @@
 from xml.sax.handler import ContentHandler
 
 class QueueInfoParser(ContentHandler):
+    """
+    Sum the queue instances of qstat -f -xml into their cluster queues as the
+    XML is parsed.
+
+    Only the totals are kept, so memory is bounded by the number of cluster
+    queues rather than the number of queue instances or jobs.  The result
+    maps each cluster queue name to a dictionary with the summed slots_used
+    and slots_total and the queue's arch; the special "waiting" entry holds
+    the number of pending jobs.
+    """
+
     def __init__(self):
-        self.currentQueueInfoElmList = list(['name', 'qtype', 'slots_used',
-            'slots_total', 'arch'])
-        self.currentJobInfoElmList = list(['JB_job_number', 'JB_job_number',
-            'JAT_prio', 'JB_name', 'JB_owner', 'state', 'JAT_start_time',
-            'JB_submission_time', 'slots'])
-            
+        self.currentQueueInfoElmList = ['name', 'slots_used', 'slots_total',
+            'arch']
 
     def startDocument(self):
         self.elmContents = ''
+        self.recording = False
+        self.inQueue = False
         self.QueueList = {}
+        self.waiting = 0
 
     def startElement(self, name, attrs):
-        self.elmContents = ''
         if name == 'Queue-List':
             self.currentQueueInfo = {}
-            self.currentJobList = {}
-            self.currentJobInfo = {}
-
-        elif name == 'job_info':
-            self.QueueList["waiting"] = {}
-            self.currentJobList = {}
-            self.inJobInfo = True
-
-        elif name == 'queue_info':
-            self.inJobInfo = False
-
-        elif name == 'job_list':
-            self.currentJobInfo = {}
-
-        else:
-            pass
+            self.inQueue = True
+        elif self.inQueue and name in self.currentQueueInfoElmList:
+            self.elmContents = ''
+            self.recording = True
 
     def endElement(self, name):
-        import copy
         if name == 'Queue-List':
-            self.currentQueueInfo['jobs'] = copy.deepcopy(self.currentJobList)
-            self.QueueList[self.currentQueueInfo['name']] = copy.deepcopy(\
-                self.currentQueueInfo)
-
+            self.inQueue = False
+            self.addQueue(self.currentQueueInfo)
         elif name == 'job_list':
-            self.currentJobList[self.currentJobInfo['JB_job_number']] = \
-                copy.deepcopy(self.currentJobInfo)
-
-        elif name == 'job_info':
-            if self.inJobInfo:
-                self.QueueList['waiting'] = copy.deepcopy(self.currentJobList)
-
-        elif name in self.currentQueueInfoElmList:
+            # Running jobs are listed inside their queue instance; the
+            # ones outside of any queue are pending.
+            if not self.inQueue:
+                self.waiting += 1
+        elif self.recording:
             self.currentQueueInfo[name] = str(self.elmContents)
-
-        elif name in self.currentJobInfoElmList:
-            self.currentJobInfo[name] = str(self.elmContents)
-
-        else:
-            pass
+            self.recording = False
 
     def characters(self, ch):
-        self.elmContents += str(ch)
+        if self.recording:
+            self.elmContents += ch
+
+    def addQueue(self, qinfo):
+        """
+        Add the totals of one queue instance to its cluster queue.
+        """
+        name = qinfo.get('name', '').split('@')[0]
+        if not name:
+            return
+        q = self.QueueList.setdefault(name, {'slots_used': 0,
+            'slots_total': 0})
+        for key in ['slots_used', 'slots_total']:
+            try:
+                q[key] += int(qinfo[key])
+            except:
+                pass
+        if 'arch' in qinfo:
+            q['arch'] = qinfo['arch']
 
     def getQueueInfo(self):
-        return self.QueueList
+        queue_info = dict(self.QueueList)
+        queue_info['waiting'] = self.waiting
+        return queue_info
 
 
 class JobInfoParser(ContentHandler):
+    """
+    Count the jobs of qstat -xml per (owner, queue, running) as the XML is
+    parsed, so memory is bounded by the number of distinct owners and queues
+    rather than by the number of jobs.
+
+    Jobs without a queue are counted against the "waiting" queue.
+    """
+
     def __init__(self):
-        self.currentJobInfoElmList = ['JB_job_number', 'JAT_prio',
-            'JB_name', 'JB_owner', 'state', 'JAT_start_time',
-            'JB_submission_time', 'slots', 'queue_name']
+        self.currentJobInfoElmList = ['JB_owner', 'state', 'queue_name']
 
     def startDocument(self):
         self.elmContents = ''
-        self.JobList = []
+        self.recording = False
+        self.JobCounts = {}
         self.currentJobInfo = {}
 
     def startElement(self, name, attrs):
@@ -81,20 +94,27 @@ class JobInfoParser(ContentHandler):
             self.currentJobInfo = {}
         elif name in self.currentJobInfoElmList:
             self.elmContents = ''
+            self.recording = True
 
     def endElement(self, name):
-        import copy
         if name == 'job_list':
-            self.JobList.append(copy.deepcopy(self.currentJobInfo))
-        elif name in self.currentJobInfoElmList:
+            job = self.currentJobInfo
+            queue = job.get('queue_name', '').split('@')[0].strip()
+            if not queue:
+                queue = 'waiting'
+            key = (job.get('JB_owner', ''), queue, job.get('state') == 'r')
+            self.JobCounts[key] = self.JobCounts.get(key, 0) + 1
+        elif self.recording:
             self.currentJobInfo[str(name)] = str(self.elmContents)
-            self.elmContents = ''
-        else:
-            pass
+            self.recording = False
 
     def characters(self, ch):
-        self.elmContents += str(ch)
-
-    def getJobInfo(self):
-        return self.JobList
-
+        if self.recording:
+            self.elmContents += ch
+
+    def getJobCounts(self):
+        """
+        @returns: A dictionary mapping (owner, queue, running) tuples to the
+            number of such jobs.
+        """
+        return self.JobCounts
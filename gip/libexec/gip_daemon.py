@@ -0,0 +1,400 @@
+#!/usr/bin/env python
+
+"""
+gip_daemon: Keep the GIP output up to date from a single long-running process.
+
+The osg-info-wrapper pays for interpreter startup, config parsing, and module
+discovery on every BDII poll.  The daemon does that once; it then refreshes
+each provider and plugin on its own interval, re-merges the output whenever
+something changed, and keeps the resulting LDIF in memory.  The LDIF is handed
+to anyone connecting to the daemon's Unix socket (see osg_info_client) and, if
+configured, written atomically to a file.
+
+The daemon runs in the foreground; SIGTERM or SIGINT shut it down cleanly.
+
+Configuration, in the [gip] section:
+
+   - B{daemon_socket}: Unix socket to serve the LDIF on; set it empty to
+     disable the socket.
+   - B{daemon_output}: File to atomically write the LDIF to (default: none).
+
+and, in the [modules] section:
+
+   - B{<name>_interval}: How often, in seconds, the module is rerun (default:
+     the [gip] freshness).
+"""
+
+import os
+import sys
+import time
+import errno
+import fcntl
+import signal
+import socket
+import tempfile
+import cStringIO
+
+if 'GIP_LOCATION' in os.environ:
+    sys.path.append(os.path.expandvars("$GIP_LOCATION/lib/python"))
+from gip_common import config, getLogger, cp_get, cp_getBoolean, cp_getInt, gipDir
+from gip_ldap import write_ldap
+
+# NOTE:  We do not have to drop privileges here... the following import will
+#        take care of that for us
+from osg_info_wrapper import create_if_not_exist, wrapper_dirs, \
+    attribute_files, merge_entries, read_static, list_modules, check_cache, \
+    cache_age, module_jobs, module_hints, launch_modules, wait_children, \
+    reap_children, ChildWatcher, HashCache
+
+log = getLogger("GIP.Daemon")
+
+def default_socket():
+    """
+    The socket used when [gip] daemon_socket is not set.
+    """
+    return os.path.expandvars(gipDir("$GIP_LOCATION/var/run/gip-daemon.sock",
+        '/var/run/gip/gip-daemon.sock'))
+
+def write_atomically(filename, contents):
+    """
+    Replace the contents of filename so that readers see either the old or
+    the new file, never a partially written one.
+
+    @param filename: The file to write.
+    @param contents: The new contents of the file.
+    """
+    dirname, basename = os.path.split(os.path.abspath(filename))
+    fd, tmp_filename = tempfile.mkstemp(prefix='.%s.' % basename, dir=dirname)
+    try:
+        fp = os.fdopen(fd, 'w')
+        try:
+            fp.write(contents)
+        finally:
+            fp.close()
+        os.chmod(tmp_filename, 0644)
+        os.rename(tmp_filename, filename)
+    except:
+        try:
+            os.unlink(tmp_filename)
+        except OSError:
+            pass
+        raise
+
+class GipDaemon:
+
+    """
+    Refresh the modules on their intervals and serve the merged LDIF.
+
+    @ivar ldif: The most recently merged LDIF, or None before the first merge.
+    @ivar clients: Maps the socket of each client still being sent the LDIF
+        to a list of the connection, the LDIF, how much of it was sent, and
+        when to give up on the client.
+    """
+
+    def __init__(self, cp):
+        self.cp = cp
+        self.temp_dir, self.plugin_dir, self.provider_dir, self.static_dir = \
+            wrapper_dirs(cp)
+        create_if_not_exist(self.temp_dir, self.plugin_dir, self.provider_dir,
+            self.static_dir)
+        self.attributes = attribute_files(cp)
+
+        self.freshness = cp_getInt(cp, "gip", "freshness", 300)
+        self.cache_ttl = cp_getInt(cp, "gip", "cache_ttl", 600)
+        self.response = cp_getInt(cp, "gip", "response", 240)
+        self.timeout = cp_getInt(cp, "gip", "timeout", 240)
+        self.max_parallel = cp_getInt(cp, "gip", "max_parallel_modules", 0)
+        self.passthrough = cp_getBoolean(cp, "gip", "passthrough_ldif", False)
+        self.socket_path = os.path.expandvars(cp_get(cp, "gip",
+            "daemon_socket", default_socket()))
+        self.output_file = os.path.expandvars(cp_get(cp, "gip",
+            "daemon_output", ""))
+        # Shared with the wrapper's stale_while_revalidate refreshes, so the
+        # two never run the modules at the same time.
+        self.lock_file = os.path.join(self.temp_dir, '.refresh.lock')
+        self.hash_cache = HashCache(os.path.join(self.temp_dir,
+            '.module_cksums'), verify=cp_getBoolean(cp, "gip",
+            "verify_module_checksums", False))
+
+        self.ldif = None
+        self.signature = None
+        self.refresh_pids = []
+        self.next_refresh = 0
+        self.lock_retry = 5
+        self.last_run = {}
+        self.listener = None
+        self.clients = {}
+        self.client_timeout = 60
+        self.watcher = None
+        self.running = False
+
+    def module_interval(self, name):
+        return cp_getInt(self.cp, "modules", "%s_interval" % name,
+            self.freshness)
+
+    def due_jobs(self, providers, plugins):
+        """
+        List the jobs for modules which are due: their cached output is
+        missing or older than their interval, and no refresh of them has
+        started within the last interval (so a failing module is not rerun in
+        a loop).  The next refresh is scheduled for when the first of the
+        other modules comes due.
+
+        @param providers: The providers dictionary
+        @param plugins: The plugins dictionary
+        @returns: A list of job dictionaries, with scheduling hints.
+        """
+        now = time.time()
+        next_refresh = now + self.freshness
+        jobs = []
+        for modules, module_dir in [(providers, self.provider_dir),
+                (plugins, self.plugin_dir)]:
+            due = {}
+            for name, info in modules.items():
+                interval = self.module_interval(name)
+                age = cache_age(info, self.temp_dir)
+                if age is None:
+                    due_time = now
+                else:
+                    due_time = now - age + interval
+                if name in self.last_run:
+                    due_time = max(due_time, self.last_run[name] + interval)
+                if due_time <= now:
+                    due[name] = info
+                else:
+                    next_refresh = min(next_refresh, due_time)
+            jobs += module_jobs(due, module_dir, self.temp_dir)
+        module_hints(self.cp, jobs)
+        self.next_refresh = max(next_refresh, now + 1)
+        return jobs
+
+    def refresh(self, wait=False):
+        """
+        Start a refresh of any modules which are due, unless one is already
+        running, then publish the merged output if anything changed.
+
+        @keyword wait: Wait up to the response time for the refresh to
+            finish before publishing.
+        """
+        providers = list_modules(self.provider_dir, self.hash_cache)
+        plugins = list_modules(self.plugin_dir, self.hash_cache)
+        self.hash_cache.save()
+        if not self.refresh_pids and time.time() >= self.next_refresh:
+            jobs = self.due_jobs(providers, plugins)
+            if jobs:
+                log.info("Refreshing modules %s" % ", ".join([job['name'] \
+                    for job in jobs]))
+            self.refresh_pids = launch_modules(jobs, self.timeout,
+                self.max_parallel, lock_file=self.lock_file)
+            if self.refresh_pids:
+                now = time.time()
+                for job in jobs:
+                    self.last_run[job['name']] = now
+            elif jobs:
+                # A wrapper refresh holds the lock; try again shortly rather
+                # than waiting out the modules' intervals with stale data.
+                self.next_refresh = min(self.next_refresh,
+                    time.time() + self.lock_retry)
+            if wait:
+                self.refresh_pids = wait_children(self.refresh_pids,
+                    self.response)
+        self.publish(providers, plugins)
+
+    def input_signature(self, providers, plugins):
+        """
+        Summarize everything the merged output depends on: the module cache
+        files in use and the static and attributes files.
+        """
+        signature = []
+        for modules in [providers, plugins]:
+            for name, info in modules.items():
+                signature.append((name, info.get('cksum'), 'output' in info))
+        filenames = [os.path.join(self.static_dir, i) for i in \
+            os.listdir(self.static_dir) if i.endswith('.ldif')]
+        filenames += list(self.attributes)
+        filenames += [os.path.join(self.temp_dir, "%(name)s.ldif.%(cksum)s" % \
+            info) for modules in [providers, plugins] \
+            for info in modules.values() if 'output' in info]
+        for filename in filenames:
+            try:
+                st = os.stat(filename)
+            except OSError:
+                continue
+            signature.append((filename, st.st_mtime, st.st_size))
+        signature.sort()
+        return signature
+
+    def publish(self, providers, plugins):
+        """
+        Merge the static info with the cached module output and publish the
+        result, if any of the inputs changed since the last merge.
+
+        @returns: True if new output was published.
+        """
+        check_cache(providers, self.temp_dir, self.cache_ttl)
+        check_cache(plugins, self.temp_dir, self.cache_ttl)
+        signature = self.input_signature(providers, plugins)
+        if signature == self.signature:
+            return False
+        entries = merge_entries(read_static(self.static_dir), providers,
+            plugins, self.attributes, keep_ldif=self.passthrough)
+        output = cStringIO.StringIO()
+        write_ldap(entries, output)
+        self.ldif = output.getvalue()
+        self.signature = signature
+        log.info("Published %i entries." % len(entries))
+        if self.output_file:
+            try:
+                write_atomically(self.output_file, self.ldif)
+            except Exception, e:
+                log.error("Unable to write output file %s" % self.output_file)
+                log.exception(e)
+        return True
+
+    def listen(self):
+        """
+        Start listening on the daemon socket, replacing any stale socket file
+        left behind by a previous daemon.
+        """
+        if not self.socket_path:
+            return
+        create_if_not_exist(os.path.dirname(self.socket_path))
+        try:
+            os.unlink(self.socket_path)
+        except OSError, oe:
+            if oe.errno != errno.ENOENT:
+                raise
+        self.listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        fd = self.listener.fileno()
+        fcntl.fcntl(fd, fcntl.F_SETFD, fcntl.fcntl(fd, fcntl.F_GETFD) | \
+            fcntl.FD_CLOEXEC)
+        self.listener.bind(self.socket_path)
+        # The LDIF is published to the world anyway; let the BDII connect
+        # regardless of which user it runs as.
+        os.chmod(self.socket_path, 0666)
+        self.listener.listen(16)
+        log.info("Serving LDIF on %s" % self.socket_path)
+
+    def serve(self):
+        """
+        Accept one client of the socket; the current LDIF is sent to it from
+        the main loop by L{send}, so a slow client holds up neither the
+        refreshes nor the other clients.
+        """
+        try:
+            conn = self.listener.accept()[0]
+        except socket.error, e:
+            if e[0] in [errno.EINTR, errno.EAGAIN]:
+                return
+            raise
+        conn.setblocking(0)
+        self.clients[conn.fileno()] = [conn, self.ldif, 0,
+            time.time() + self.client_timeout]
+
+    def send(self, fd):
+        """
+        Send the next piece of the LDIF to a client whose socket is writable,
+        and hang up once it has all of it.
+        """
+        client = self.clients[fd]
+        conn, ldif, offset, _ = client
+        try:
+            client[2] += conn.send(ldif[offset:offset+65536])
+        except socket.error, e:
+            if e[0] in [errno.EINTR, errno.EAGAIN]:
+                return
+            log.warning("Unable to send LDIF to client: %s" % str(e))
+            client[2] = len(ldif)
+        if client[2] >= len(ldif):
+            del self.clients[fd]
+            conn.close()
+
+    def expire_clients(self):
+        """
+        Hang up on the clients which did not take the LDIF within the client
+        timeout.
+
+        @returns: The time until the next client times out, or None if there
+            are no clients.
+        """
+        now = time.time()
+        for fd, (conn, _, _, deadline) in self.clients.items():
+            if deadline <= now:
+                log.warning("Client did not read the LDIF within %i " \
+                    "seconds; hanging up." % self.client_timeout)
+                del self.clients[fd]
+                conn.close()
+        if not self.clients:
+            return None
+        return min([client[3] for client in self.clients.values()]) - now
+
+    def stop(self, signum=None, frame=None):
+        """
+        Ask the main loop to exit; safe to call from a signal handler.
+        """
+        self.running = False
+        if self.watcher:
+            self.watcher.handler(signum, frame)
+
+    def run(self):
+        """
+        Run until stopped: refresh the modules as they come due and serve
+        the socket in between.
+        """
+        self.running = True
+        self.watcher = ChildWatcher()
+        old_term = signal.signal(signal.SIGTERM, self.stop)
+        old_int = signal.signal(signal.SIGINT, self.stop)
+        try:
+            self.refresh(wait=True)
+            self.listen()
+            fds = []
+            if self.listener:
+                fds.append(self.listener.fileno())
+            while self.running:
+                finished = reap_children(self.refresh_pids)
+                for pid, _ in finished:
+                    self.refresh_pids.remove(pid)
+                if finished or (not self.refresh_pids and \
+                        time.time() >= self.next_refresh):
+                    self.refresh()
+                if not self.running:
+                    break
+                # While a refresh runs, its exit is what wakes us up.
+                if self.refresh_pids:
+                    timeout = self.freshness
+                else:
+                    timeout = self.next_refresh - time.time()
+                client_timeout = self.expire_clients()
+                if client_timeout is not None:
+                    timeout = min(timeout, client_timeout)
+                for fd in self.watcher.wait(timeout, fds, self.clients.keys()):
+                    if fd in self.clients:
+                        self.send(fd)
+                    else:
+                        self.serve()
+        finally:
+            signal.signal(signal.SIGTERM, old_term)
+            signal.signal(signal.SIGINT, old_int)
+            self.watcher.close()
+            self.watcher = None
+            for conn, _, _, _ in self.clients.values():
+                conn.close()
+            self.clients = {}
+            if self.listener:
+                self.listener.close()
+                self.listener = None
+                try:
+                    os.unlink(self.socket_path)
+                except OSError:
+                    pass
+
+def main():
+    """
+    Main method for the gip_daemon script.
+    """
+    cp = config()
+    GipDaemon(cp).run()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+
+"""
+osg_info_client: Print the GIP output held by a running gip_daemon.
+
+This is deliberately tiny and does not load the GIP configuration.  The
+daemon's socket is the first argument, $GIP_DAEMON_SOCKET, or the daemon's
+default socket.  If the daemon cannot be reached, nothing is printed and the
+exit code is non-zero, so the caller can fall back to osg_info_wrapper.
+"""
+
+import os
+import sys
+import socket
+
+def default_socket():
+    # Keep in sync with gip_daemon.default_socket
+    if 'GIP_LOCATION' in os.environ:
+        return os.path.expandvars("$GIP_LOCATION/var/run/gip-daemon.sock")
+    return '/var/run/gip/gip-daemon.sock'
+
+def fetch(socket_path, timeout=60):
+    """
+    Read the full LDIF from the daemon listening on socket_path.
+
+    @param socket_path: The daemon's Unix socket.
+    @keyword timeout: Seconds to wait on each socket operation.
+    @returns: The LDIF string.
+    """
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.settimeout(timeout)
+        sock.connect(socket_path)
+        chunks = []
+        while True:
+            chunk = sock.recv(65536)
+            if not chunk:
+                break
+            chunks.append(chunk)
+    finally:
+        sock.close()
+    return ''.join(chunks)
+
+def main():
+    if len(sys.argv) > 1:
+        socket_path = sys.argv[1]
+    else:
+        socket_path = os.environ.get('GIP_DAEMON_SOCKET', default_socket())
+    try:
+        ldif = fetch(socket_path)
+    except socket.error, e:
+        print >> sys.stderr, "Unable to contact gip_daemon at %s: %s" % \
+            (socket_path, str(e))
+        return 1
+    if not ldif:
+        print >> sys.stderr, "gip_daemon at %s returned no output" % \
+            socket_path
+        return 1
+    # Only write once the whole response is in, so a failure above never
+    # leaves partial output behind.
+    sys.stdout.write(ldif)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -12,7 +12,10 @@ import sys
 import pwd
 import glob
 import time
+import errno
+import fcntl
 import signal
+import select
 import cStringIO
 
 py23 = sys.version_info[0] == 2 and sys.version_info[1] >= 3
@@ -36,16 +39,16 @@ if not py23:
 
 try:
     #python 2.5 and above  
-    import hashlib as md5
+    from hashlib import md5
 except ImportError:
     # pylint: disable-msg=F0401
-    import md5
+    from md5 import new as md5
 
 if 'GIP_LOCATION' in os.environ:
     sys.path.append(os.path.expandvars("$GIP_LOCATION/lib/python"))
 from gip_common import config, getLogger, cp_get, cp_getBoolean, cp_getInt, gipDir
-from gip_ldap import read_ldap, compareDN, LdapData
-import gip_sets as sets
+from gip_common import cp_getList
+from gip_ldap import iter_ldap, write_ldap, DNIndex, LdapData
 
 # check if we are root.  If we are, drop privileges to daemon to avoid
 # permissions problems when CEMon tries to run the GIP
@@ -100,28 +103,13 @@ def main(cp = None, return_entries=False):
     if cp == None:
         cp = config()
 
-    temp_dir = os.path.expandvars(cp_get(cp, "gip", "temp_dir", \
-        gipDir("$GIP_LOCATION/var/tmp", '/var/cache/gip'))) 
-    plugin_dir = os.path.expandvars(cp_get(cp, "gip", "plugin_dir", \
-        gipDir("$GIP_LOCATION/plugins", '/usr/libexec/gip/plugins')))
-    provider_dir = os.path.expandvars(cp_get(cp, "gip", "provider_dir", \
-        gipDir("$GIP_LOCATION/providers", '/usr/libexec/gip/providers')))
-    static_dir = os.path.expandvars(cp_get(cp, "gip", "static_dir", \
-        gipDir("$GIP_LOCATION/var/ldif", '/etc/gip/ldif.d')))
+    temp_dir, plugin_dir, provider_dir, static_dir = wrapper_dirs(cp)
 
     # Make sure that our directories exist.
     create_if_not_exist(temp_dir, plugin_dir, provider_dir, static_dir)
 
     # Load up our add, alter, and delete attributes
-    add_attributes = os.path.expandvars(cp_get(cp, "gip", \
-        "add_attributes", gipDir("$GIP_LOCATION/etc/add-attributes.conf",
-                                 '/etc/gip/add-attributes.conf')))
-    alter_attributes = os.path.expandvars(cp_get(cp, "gip", \
-        "alter_attributes", gipDir("$GIP_LOCATION/etc/alter-attributes.conf",
-                                   '/etc/gip/alter-attributes.conf')))
-    remove_attributes = os.path.expandvars(cp_get(cp, "gip", \
-        "remove_attributes", gipDir("$GIP_LOCATION/etc/remove-attributes.conf",
-                                    '/etc/gip/remove-attributes.conf')))
+    attributes = attribute_files(cp)
 
     # Flush the cache if appropriate
     do_flush_cache = cp_getBoolean(cp, "gip", "flush_cache", False)
@@ -134,6 +122,20 @@ def main(cp = None, return_entries=False):
     cache_ttl = cp_getInt(cp, "gip", "cache_ttl", 600)
     response  = cp_getInt(cp, "gip", "response",  240)
     timeout = cp_getInt(cp, "gip",   "timeout",   240)
+    max_parallel = cp_getInt(cp, "gip", "max_parallel_modules", 0)
+    stale_while_revalidate = cp_getBoolean(cp, "gip", \
+        "stale_while_revalidate", False)
+
+    # If passthrough_ldif is set, entries which are not altered by a plugin
+    # are output exactly as the static file or provider wrote them.  If
+    # bulk_output is set, the whole result is emitted in a single write.
+    passthrough = cp_getBoolean(cp, "gip", "passthrough_ldif", False)
+    bulk_output = cp_getBoolean(cp, "gip", "bulk_output", False)
+
+    # Module checksums are normally reused while a module's inode, size, and
+    # mtime are unchanged; verify_module_checksums re-reads every module.
+    verify_checksums = cp_getBoolean(cp, "gip", "verify_module_checksums",
+        False)
 
     try:
         os.setpgrp()
@@ -146,16 +148,30 @@ def main(cp = None, return_entries=False):
     static_info = read_static(static_dir)
 
     # Discover the providers and plugins
-    providers = list_modules(provider_dir)
-    plugins = list_modules(plugin_dir)
+    hash_cache = HashCache(os.path.join(temp_dir, '.module_cksums'),
+        verify=verify_checksums)
+    providers = list_modules(provider_dir, hash_cache)
+    plugins = list_modules(plugin_dir, hash_cache)
+    hash_cache.save()
 
     # Load up anything in the cache
     check_cache(providers, temp_dir, freshness)
     check_cache(plugins, temp_dir, freshness)
 
     # Launch the providers and plugins
-    pids = launch_modules(providers, provider_dir, temp_dir, timeout)
-    pids += launch_modules(plugins, plugin_dir, temp_dir, timeout)
+    jobs = module_jobs(providers, provider_dir, temp_dir)
+    jobs += module_jobs(plugins, plugin_dir, temp_dir)
+    module_hints(cp, jobs)
+    if stale_while_revalidate:
+        # Serve anything younger than cache_ttl right away; only the modules
+        # with no usable output at all are waited on.  The rest are
+        # refreshed in the background, at most one refresh at a time.
+        check_cache(providers, temp_dir, cache_ttl)
+        check_cache(plugins, temp_dir, cache_ttl)
+        jobs, stale_jobs = split_stale_jobs(jobs, providers, plugins)
+        launch_modules(stale_jobs, timeout, max_parallel,
+            lock_file=os.path.join(temp_dir, '.refresh.lock'))
+    pids = launch_modules(jobs, timeout, max_parallel)
 
     # Wait for the results
     wait_children(pids, response)
@@ -164,26 +180,86 @@ def main(cp = None, return_entries=False):
     check_cache(providers, temp_dir, cache_ttl)
     check_cache(plugins, temp_dir, cache_ttl)
 
+    entries = merge_entries(static_info, providers, plugins, attributes,
+        keep_ldif=passthrough)
+
+    # Return the LDAP or print it out.
+    if return_entries:
+        return entries
+    if bulk_output:
+        output = cStringIO.StringIO()
+        write_ldap(entries, output)
+        sys.stdout.write(output.getvalue())
+    else:
+        write_ldap(entries, sys.stdout)
+
+def wrapper_dirs(cp):
+    """
+    Look up the directories the wrapper works with.
+
+    @param cp: Site configuration
+    @returns: A tuple of the temp, plugin, provider, and static directories.
+    """
+    temp_dir = os.path.expandvars(cp_get(cp, "gip", "temp_dir", \
+        gipDir("$GIP_LOCATION/var/tmp", '/var/cache/gip'))) 
+    plugin_dir = os.path.expandvars(cp_get(cp, "gip", "plugin_dir", \
+        gipDir("$GIP_LOCATION/plugins", '/usr/libexec/gip/plugins')))
+    provider_dir = os.path.expandvars(cp_get(cp, "gip", "provider_dir", \
+        gipDir("$GIP_LOCATION/providers", '/usr/libexec/gip/providers')))
+    static_dir = os.path.expandvars(cp_get(cp, "gip", "static_dir", \
+        gipDir("$GIP_LOCATION/var/ldif", '/etc/gip/ldif.d')))
+    return temp_dir, plugin_dir, provider_dir, static_dir
+
+def attribute_files(cp):
+    """
+    Look up the add, alter, and remove attributes files.
+
+    @param cp: Site configuration
+    @returns: A tuple of the three filenames.
+    """
+    add_attributes = os.path.expandvars(cp_get(cp, "gip", \
+        "add_attributes", gipDir("$GIP_LOCATION/etc/add-attributes.conf",
+                                 '/etc/gip/add-attributes.conf')))
+    alter_attributes = os.path.expandvars(cp_get(cp, "gip", \
+        "alter_attributes", gipDir("$GIP_LOCATION/etc/alter-attributes.conf",
+                                   '/etc/gip/alter-attributes.conf')))
+    remove_attributes = os.path.expandvars(cp_get(cp, "gip", \
+        "remove_attributes", gipDir("$GIP_LOCATION/etc/remove-attributes.conf",
+                                    '/etc/gip/remove-attributes.conf')))
+    return add_attributes, alter_attributes, remove_attributes
+
+def merge_entries(static_info, providers, plugins, attributes,
+        keep_ldif=False):
+    """
+    Combine the static info with the loaded provider and plugin output, then
+    apply the add, alter, and remove attributes files.
+
+    @param static_info: The static LDIF, as returned by L{read_static}.
+    @param providers: The providers dictionary
+    @param plugins: The plugins dictionary
+    @param attributes: The tuple returned by L{attribute_files}.
+    @keyword keep_ldif: Keep the original LDIF of entries no plugin alters.
+    @returns: A list of the final LdapData entries.
+    """
+    add_attributes, alter_attributes, remove_attributes = attributes
+
     # Create LDAP entries out of the static info
+    # The entries are indexed by DN once; all the merging steps below
+    # share the same index.
     static_fp = cStringIO.StringIO(static_info)
-    entries = read_ldap(static_fp, multi=True)
+    index = DNIndex(iter_ldap(static_fp, multi=True, keep_ldif=keep_ldif))
 
     # Apply output from the providers
-    entries = handle_providers(entries, providers)
+    index = handle_providers(index, providers, keep_ldif=keep_ldif)
 
     # Apply output from the plugins
-    entries = handle_plugins(entries, plugins)
+    index = handle_plugins(index, plugins)
 
     # Finally, apply our special cases
-    entries = handle_add_attributes(entries, add_attributes)
-    entries = handle_alter_attributes(entries, alter_attributes)
-    entries = handle_remove_attributes(entries, remove_attributes)
-
-    # Return the LDAP or print it out.
-    if return_entries:
-        return entries
-    for entry in entries:
-        print entry.to_ldif()
+    index = handle_add_attributes(index, add_attributes, keep_ldif=keep_ldif)
+    index = handle_alter_attributes(index, alter_attributes)
+    index = handle_remove_attributes(index, remove_attributes)
+    return index.entries()
 
 def flush_cache(temp_dir):
     """
@@ -201,90 +277,85 @@ def flush_cache(temp_dir):
         except:
             log.warn("Unable to flush cache file %s" % filename)
 
-def handle_providers(entries, providers):
+def handle_providers(index, providers, keep_ldif=False):
     """
     Add the output from the providers to the list of the GIP entries.
 
     This will match the DNs; if two DNs are repeated, then one will be thrown
     out
 
-    @param entries: A list of LdapData objects
+    @param index: A DNIndex of LdapData objects
     @param providers: A list of provider information dictionaries.
-    @returns: The altered entries list.
+    @keyword keep_ldif: If True, the new entries retain their LDIF so it can
+        be output unchanged.
+    @returns: The altered DNIndex.
     """
     provider_entries = []
     for _, p_info in providers.items():
         if 'output' in p_info:
             fp = cStringIO.StringIO(p_info['output'])
-            provider_entries += read_ldap(fp, multi=True)
-    remove_entries = []
-    # Calculate all the duplicate entries, build a list of the ones
-    # to remove.
-    for entry in entries:
-        for p_entry in provider_entries:
-            if compareDN(entry, p_entry):
-                remove_entries.append(entry)
-
-    for entry in sets.Set(remove_entries):
-        log.debug("Removing entry %s" % entry)  
-        try:
-            entries.remove(entry)
-        except ValueError:
-            pass
+            provider_entries.extend(iter_ldap(fp, multi=True,
+                keep_ldif=keep_ldif))
+    # Remove all the entries duplicated by the providers first, so providers
+    # which output the same DN more than once don't remove each other.
+    for p_entry in provider_entries:
+        for entry in index.remove(p_entry):
+            log.debug("Removing entry %s" % entry)
     # Now add all the new entries from the providers
     for p_entry in provider_entries:
-        entries.append(p_entry)
-    return entries
+        index.append(p_entry)
+    return index
 
-def handle_add_attributes(entries, add_attributes):
+def handle_add_attributes(index, add_attributes, keep_ldif=False):
     """
     Handle the add_attributes file, a special case of a provider.
 
     The contents of the add attributes file are treated as the output of a
     provider.  The add attributes file is applied after all other providers.
 
-    @param entries: A list of LdapData objects
+    @param index: A DNIndex of LdapData objects
     @param add_attributes: The name of the desired add_attributes file.
-    @returns: The entries list with the new attributes
+    @keyword keep_ldif: If True, the new entries retain their LDIF.
+    @returns: The DNIndex with the new attributes
     """
     if not os.path.exists(add_attributes):
         log.warning("The add-attributes.conf file does not exist.")
-        return entries
+        return index
     try:
         output = open(add_attributes).read()
     except Exception, e:
         log.error("An exception occurred when trying to read the " \
             "add-attributes file %s" % add_attributes)
         log.exception(e)
-        return entries
+        return index
     info = {'add_attributes': {'output': output}}
-    return handle_providers(entries, info)
+    return handle_providers(index, info, keep_ldif=keep_ldif)
 
-def handle_alter_attributes(entries, alter_attributes):
+def handle_alter_attributes(index, alter_attributes):
     """
     Handle the alter_attributes file, a special case of a plugin.
 
     The contents of the alter attributes file are treated as the output of a
     plugin.  The alter attributes file is applied after all other plugins.
 
-    @param entries: A list of LdapData objects
+    @param index: A DNIndex of LdapData objects
     @param alter_attributes: The name of the desired alter_attributes file.
-    @returns: The entries list with the altered attributes
+    @returns: The DNIndex with the altered attributes
     """
     if not os.path.exists(alter_attributes):
         log.warning("The alter-attributes.conf file does not exist.")
-        return entries
+        return index
     try:
         output = open(alter_attributes).read()
     except Exception, e:
         log.error("An exception occurred when trying to read the " \
             "alter-attributes file %s" % alter_attributes)
         log.exception(e)
-        return entries
+        return index
     info = {'alter_attributes': {'output': output}}
-    return handle_plugins(entries, info)
+    return handle_plugins(index, info)
 
-def handle_remove_attributes(entries, remove_attributes):
+def handle_remove_attributes(index, remove_attributes):
     """
     Handle the remove_attributes file, which can remove entities from the
     GIP entries
@@ -293,21 +364,21 @@ def handle_remove_attributes(entries, remove_attributes):
     DN.  Then, we go through the entries and remove any entries with a matching
     DN.
 
-    @param entries: A list of LdapData objects
+    @param index: A DNIndex of LdapData objects
     @param remove_attribtues: The name of the desired remove_attributes file.
-    @returns: The entries list with the removed attributes
+    @returns: The DNIndex with the removed attributes
     """
     if not os.path.exists(remove_attributes):
         log.warning("The remove-attributes file %s does not exist." % \
             remove_attributes)
-        return entries
+        return index
     try:
         output = open(remove_attributes).read()
     except Exception, e:
         log.error("An exception occurred when trying to read the " \
             "remove-attributes file %s" % remove_attributes)
         log.exception(e)
-        return entries
+        return index
     log.debug("Successfully opened the remove_attributes file.")
 
     # Collect all the DNs to be removed
@@ -319,92 +390,309 @@ def handle_remove_attributes(entries, remove_attributes):
         remove_dns.append(LdapData(dn))
     log.debug("There are %i entries to remove." % len(remove_dns))
 
-    # Match all the entries:
-    remove_entries = []
-    for entry in entries:
-        for dn in remove_dns:
-            if compareDN(entry, dn):
-                remove_entries.append(entry)
-
     # Remove all the unwanted entries
-    for entry in remove_entries:
-        entries.remove(entry)
-    
-    return entries
+    for dn in remove_dns:
+        index.remove(dn)
+
+    return index
 
-def handle_plugins(entries, plugins):
+def handle_plugins(index, plugins):
+    """
+    Overlay the output from the plugins onto the matching GIP entries.
+
+    Plugin entries do not create new entries; each attribute in a plugin
+    entry replaces the attribute of the same name in every entry with a
+    matching DN.
+
+    @param index: A DNIndex of LdapData objects
+    @param plugins: A list of plugin information dictionaries.
+    @returns: The altered DNIndex.
+    """
     # Make a list of all the plugin GLUE entries
     plugin_entries = []
     for _, plugin_info in plugins.items():
         if 'output' in plugin_info:
             fp = cStringIO.StringIO(plugin_info['output'])
-            plugin_entries += read_ldap(fp, multi=True)
+            plugin_entries.extend(iter_ldap(fp, multi=True))
     # Merge all the plugin entries into the main stream.
     for p_entry in plugin_entries:
         log.debug("Plugin contents:\n%s" % p_entry)
-    for entry in entries:
-        for p_entry in plugin_entries:
-            if compareDN(entry, p_entry):
-                for glue, value in p_entry.glue.items():
-                    entry.glue[glue] = value
-                for key, value in p_entry.nonglue.items():
-                    entry.nonglue[key] = value
-    return entries
+        for entry in index.find(p_entry):
+            for glue, value in p_entry.glue.items():
+                entry.glue[glue] = value
+            for key, value in p_entry.nonglue.items():
+                entry.nonglue[key] = value
+            # The kept LDIF (if any) no longer matches the entry.
+            entry.ldif = None
+    return index
+
+class ChildWatcher:
+
+    """
+    Wake up a waiting process as soon as one of its children exits.
+
+    A SIGCHLD handler writes to a pipe (the "self-pipe" trick), so L{wait} can
+    block in select until either a child exits or the timeout passes; there
+    is no polling interval.  The pipe is marked close-on-exec so modules do
+    not inherit it.
+    """
+
+    def __init__(self):
+        self.read_fd, self.write_fd = os.pipe()
+        for fd in [self.read_fd, self.write_fd]:
+            flags = fcntl.fcntl(fd, fcntl.F_GETFL)
+            fcntl.fcntl(fd, fcntl.F_SETFL, flags | os.O_NONBLOCK)
+            flags = fcntl.fcntl(fd, fcntl.F_GETFD)
+            fcntl.fcntl(fd, fcntl.F_SETFD, flags | fcntl.FD_CLOEXEC)
+        self.old_handler = signal.signal(signal.SIGCHLD, self.handler)
+        # Restart interrupted system calls (other than select) where possible.
+        if hasattr(signal, 'siginterrupt'):
+            signal.siginterrupt(signal.SIGCHLD, False)
+
+    def handler(self, signum, frame):
+        try:
+            os.write(self.write_fd, '.')
+        except OSError:
+            pass
+
+    def wait(self, timeout, fds=(), write_fds=()):
+        """
+        Block until a child exits, one of $fds is readable, one of
+        $write_fds is writable, or $timeout seconds have passed.
+
+        @returns: The list of $fds which are readable and $write_fds which
+            are writable.
+        """
+        try:
+            ready, writable, _ = select.select([self.read_fd] + list(fds),
+                list(write_fds), [], max(timeout, 0))
+        except select.error, e:
+            if e[0] != errno.EINTR:
+                raise
+            return []
+        ready += writable
+        if self.read_fd in ready:
+            ready.remove(self.read_fd)
+            try:
+                os.read(self.read_fd, 4096)
+            except OSError:
+                pass
+        return ready
+
+    def close(self):
+        if self.old_handler is None:
+            self.old_handler = signal.SIG_DFL
+        signal.signal(signal.SIGCHLD, self.old_handler)
+        os.close(self.read_fd)
+        os.close(self.write_fd)
+
+def reap_children(pids):
+    """
+    Reap any of the given child processes which have exited, without
+    blocking.
+
+    @param pids: A list of process IDs.
+    @returns: A list of (pid, status) tuples for the reaped children.
+    """
+    reaped = []
+    for pid in pids:
+        try:
+            wpid, status = os.waitpid(pid, os.WNOHANG)
+        except OSError, oe:
+            if oe.errno != errno.ECHILD:
+                raise
+            # Someone else reaped it; treat it as gone.
+            reaped.append((pid, 0))
+            continue
+        if wpid == pid:
+            reaped.append((pid, status))
+    return reaped
 
 def wait_children(pids, response):
     """
     Wait for any children of this process.
 
-    Blocks until all children are dead or $response seconds have passed.
+    Blocks until all children are dead or $response seconds have passed.  The
+    children are reaped as soon as they exit, in whatever order they exit.
 
     @param pids: A list of process IDs to wait on.
     @param response: The maximum number of seconds to wait on child processes.
     @returns: A list of child PIDs which have not been reaped (you should call
         os.wait on these PIDs some time in the future).
     """
-    def handler(signum, frame):
-        raise Exception("Response timed out")
-    signal.signal(signal.SIGALRM, handler)
     log.debug("Setting response time to %.2f" % float(response))
-    signal.alarm(int(response))
-    for pid in pids:
-        try:
-            os.waitpid(pid, 0)
-        except:
-            # Important note: we just quit waiting for children, we don't
-            # necessarily kill them off.
-            break
-    signal.alarm(0)
-
-def launch_modules(modules, module_dir, temp_dir, timeout):
+    deadline = time.time() + float(response)
+    remaining = list(pids)
+    if not remaining:
+        return remaining
+    watcher = ChildWatcher()
+    try:
+        while remaining:
+            for pid, _ in reap_children(remaining):
+                remaining.remove(pid)
+            if not remaining or time.time() >= deadline:
+                break
+            watcher.wait(deadline - time.time())
+    finally:
+        watcher.close()
+    # Important note: we just quit waiting for children, we don't
+    # necessarily kill them off.
+    if remaining:
+        log.info("Response time passed; not waiting on pids %s" % \
+            ", ".join([str(pid) for pid in remaining]))
+    return remaining
+
+def module_jobs(modules, module_dir, temp_dir):
     """
-    Launch any module which does not have cached output available.
+    List the modules which do not have cached output available.
 
-    This process forks off one child per module, sets a distinct process group
-    for that module.  If the child process lasts more than $timeout seconds,
-    it will kill itself.  The child process writes its output into::
-        
-        $temp_dir/$name.ldif.$cksum.$process_group
+    Each job is a dictionary with the module's B{name}, B{executable}, and
+    the cache B{filename} its output is saved into::
+
+        $temp_dir/$name.ldif.$cksum
 
     @param modules: The modules dictionary
+    @param module_dir: The directory containing the modules.
     @param temp_dir: The temporary directory.
-    @param timeout: The timeout value for the child process before it kills
-       itself
-    @returns: A list of child PIDs.
+    @returns: A list of job dictionaries.
     """
-    pids = []
+    jobs = []
     for module, info in modules.items():
         if 'output' in info:
             continue
-        filename = os.path.join(temp_dir, '%(name)s.ldif.%(cksum)s' % info)
-        executable = os.path.join(module_dir, module)
-        pid = os.fork()
-        if pid == 0:
-            run_child(executable, filename, timeout)
+        jobs.append({'name': module,
+            'executable': os.path.join(module_dir, module),
+            'filename': os.path.join(temp_dir, '%(name)s.ldif.%(cksum)s' % \
+                info),
+        })
+    return jobs
+
+def module_hints(cp, jobs):
+    """
+    Load the scheduling hints for each module job from the [modules] section
+    of the config:
+
+       - B{<name>_priority}: Modules with a higher priority start first
+         (default 0).
+       - B{<name>_cost}: The number of max_parallel_modules slots the module
+         takes up while it runs; use this for modules which run expensive
+         batch system or storage queries (default 1).
+       - B{<name>_after}: Comma-separated list of modules which must finish
+         before this one starts.
+
+    @param cp: Site configuration
+    @param jobs: A list of job dictionaries from L{module_jobs}; they are
+        updated in place.
+    """
+    for job in jobs:
+        name = job['name']
+        job['priority'] = cp_getInt(cp, "modules", "%s_priority" % name, 0)
+        job['cost'] = max(cp_getInt(cp, "modules", "%s_cost" % name, 1), 0)
+        job['after'] = [i for i in cp_getList(cp, "modules", "%s_after" % \
+            name, []) if i]
+
+def split_stale_jobs(jobs, providers, plugins):
+    """
+    Split the module jobs into those which have no output loaded and those
+    which have (stale) output loaded from the cache.
+
+    @returns: A tuple of the two lists of jobs.
+    """
+    loaded = {}
+    for modules in [providers, plugins]:
+        for module, info in modules.items():
+            if 'output' in info:
+                loaded[module] = True
+    missing_jobs = []
+    stale_jobs = []
+    for job in jobs:
+        if job['name'] in loaded:
+            stale_jobs.append(job)
         else:
-            log.debug("Child %s is running in pid %i" % (module, pid))
-            pids.append(pid)
-    return pids
+            missing_jobs.append(job)
+    return missing_jobs, stale_jobs
+
+def acquire_lock(filename):
+    """
+    Take an exclusive lock on filename without blocking.
+
+    The lock is held until the returned file descriptor, and any copies of
+    it made by fork, are closed or their processes exit; it is not inherited
+    by executed modules.
+
+    @returns: The locked file descriptor, or None if someone else holds the
+        lock.
+    """
+    fd = os.open(filename, os.O_WRONLY | os.O_CREAT, 0644)
+    flags = fcntl.fcntl(fd, fcntl.F_GETFD)
+    fcntl.fcntl(fd, fcntl.F_SETFD, flags | fcntl.FD_CLOEXEC)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except IOError, ie:
+        os.close(fd)
+        if ie.errno in [errno.EAGAIN, errno.EACCES]:
+            return None
+        raise
+    return fd
+
+def detach_stdio():
+    """
+    Point stdin, stdout, and stderr at /dev/null.
+    """
+    fd = os.open(os.devnull, os.O_RDWR)
+    for std_fd in [0, 1, 2]:
+        os.dup2(fd, std_fd)
+    if fd > 2:
+        os.close(fd)
+
+def launch_modules(jobs, timeout, max_parallel=0, lock_file=None):
+    """
+    Launch the module jobs under a single supervisor process.
+
+    The supervisor (see L{supervise_modules}) runs in its own process group so
+    it can finish populating the cache after the wrapper has stopped waiting
+    on it.  It lets go of the wrapper's stdin, stdout, and stderr, so whoever
+    reads the wrapper's output sees it end when the wrapper exits, not when
+    the last module does; the supervisor only reports through the log.
+
+    @param jobs: A list of job dictionaries from L{module_jobs}.
+    @param timeout: The timeout value for each module before it is killed.
+    @keyword max_parallel: The maximum number of modules to run at once; 0
+        means no limit.
+    @keyword lock_file: If set, the supervisor is only started if this file
+        can be locked; the supervisor holds the lock until it exits.  This
+        prevents overlapping background refreshes.
+    @returns: A list of child PIDs; it is empty if there was nothing to run
+        or someone else holds the lock.
+    """
+    if not jobs:
+        return []
+    lock_fd = None
+    if lock_file:
+        lock_fd = acquire_lock(lock_file)
+        if lock_fd is None:
+            log.info("Another refresh holds %s; not running the modules." % \
+                lock_file)
+            return []
+    pid = os.fork()
+    if pid == 0:
+        try:
+            try:
+                os.setpgrp()
+                detach_stdio()
+                supervise_modules(jobs, timeout, max_parallel)
+            except Exception, e:
+                log.error("Fatal exception while supervising modules")
+                log.exception(e)
+                os._exit(os.EX_SOFTWARE)
+        finally:
+            os._exit(os.EX_OK)
+    # The lock now belongs to the supervisor; it is released when the
+    # supervisor closes its copy of the descriptor, on exit.
+    if lock_fd is not None:
+        os.close(lock_fd)
+    log.debug("Module supervisor is running in pid %i" % pid)
+    return [pid]
 
 def check_cache(modules, temp_dir, freshness):
     """
@@ -451,7 +739,22 @@ def check_cache(modules, temp_dir, freshness):
             log.debug("  Loading file contents.")
             mod_info['output'] = fp.read()
 
-def list_modules(dirname):
+def cache_age(mod_info, temp_dir):
+    """
+    Find how old the cached output of a module is.
+
+    @param mod_info: The module's info dictionary, from L{list_modules}.
+    @param temp_dir: Directory where module output is saved
+    @returns: The age of the cache file in seconds, or None if there is no
+        cache file.
+    """
+    filename = os.path.join(temp_dir, "%(name)s.ldif.%(cksum)s" % mod_info)
+    try:
+        return time.time() - os.stat(filename).st_mtime
+    except OSError:
+        return None
+
+def list_modules(dirname, hash_cache=None):
     """
     List all of the modules in a directory.
 
@@ -460,6 +763,8 @@ def list_modules(dirname):
         - B{cksum}: The module's checksum.
 
     @param dirname: Directory to check
+    @keyword hash_cache: A L{HashCache} to look up the checksums in; if not
+        given, every module is hashed.
     @returns: A dictionary of module data; one key per file in the directory.
     """
     info = {}
@@ -477,89 +782,235 @@ def list_modules(dirname):
         mod_info = {}
         mod_info['name'] = filename
         try:
-            mod_info['cksum'] = calculate_hash(os.path.join(dirname, filename))
+            if hash_cache is None:
+                mod_info['cksum'] = calculate_hash(os.path.join(dirname,
+                    filename))
+            else:
+                mod_info['cksum'] = hash_cache.hash(os.path.join(dirname,
+                    filename))
         except Exception, e:
             log.exception(e)
         info[filename] = mod_info
         log.debug("Found module %s in directory %s" % (filename, dirname))
     return info
 
-def run_child(executable, orig_filename, timeout):
+def supervise_modules(jobs, timeout, max_parallel=0):
     """
-    Wrap the actual run_child method (in _run_child) with this method that is
-    designed to catch any exceptions and make sure the child never returns
-    control to the parent function (hence creating a fork bomb).
+    Run each module job and wait for all of them to finish.
+
+    Each module is executed directly in its own process group, with its
+    output sent to::
+
+        $filename.$pid
+
+    which is renamed to $filename if the module exits successfully.  A module
+    which runs for more than $timeout seconds has its process group killed
+    and its output removed.
+
+    Jobs are started in order of their B{priority}, once all the modules
+    listed in B{after} have finished, and as long as the B{cost} of the
+    running modules stays within $max_parallel (see L{module_hints}).
+
+    @param jobs: A list of job dictionaries from L{module_jobs}.
+    @param timeout: The timeout value for each module before it is killed.
+    @keyword max_parallel: The maximum total cost of the modules running at
+        once; 0 means no limit.
     """
+    pending = list(jobs)
+    pending.sort(lambda x, y: cmp(y.get('priority', 0), x.get('priority', 0)))
+    unfinished = {}
+    for job in pending:
+        unfinished[job['name']] = True
+    running = {}
+    watcher = ChildWatcher()
     try:
-        try:
-            _run_child(executable, orig_filename, timeout)
-        except Exception, e:
-            log.error("Fatal exception while running child")
-            log.exception(e)
+        while pending or running:
+            start_modules(pending, running, unfinished, timeout, max_parallel)
+            if not running:
+                # The modules we tried to start could not be forked.
+                continue
+            reaped = reap_children(running.keys())
+            for pid, status in reaped:
+                job = running.pop(pid)
+                finish_module(job, pid, status)
+                del unfinished[job['name']]
+            if reaped:
+                # Start any modules which were waiting on these.
+                continue
+            now = time.time()
+            next_deadline = None
+            for pid, job in running.items():
+                if job['deadline'] <= now:
+                    if not job.get('killed', False):
+                        kill_module(job, pid)
+                    # Check on the killed module again shortly.
+                    job['deadline'] = now + 1
+                if next_deadline is None or job['deadline'] < next_deadline:
+                    next_deadline = job['deadline']
+            watcher.wait(next_deadline - now)
     finally:
-        os._exit(os.EX_SOFTWARE)
+        watcher.close()
 
-def _run_child(executable, orig_filename, timeout):
+def start_modules(pending, running, unfinished, timeout, max_parallel):
+    """
+    Start as many of the pending jobs as the scheduling constraints allow.
+
+    @param pending: List of jobs not yet started, in priority order.
+    @param running: Dictionary mapping PIDs to the running jobs.
+    @param unfinished: Dictionary whose keys are the names of all the jobs
+        which have not finished yet.
+    @param timeout: The timeout value for each module before it is killed.
+    @param max_parallel: The maximum total cost of the running modules.
+    """
+    used = 0
+    for job in running.values():
+        used += job.get('cost', 1)
+    for job in list(pending):
+        cost = job.get('cost', 1)
+        # An expensive module may run on its own even if its cost is above
+        # the limit.
+        if max_parallel and running and used + cost > max_parallel:
+            continue
+        blocked = False
+        for name in job.get('after', []):
+            if name in unfinished:
+                blocked = True
+                break
+        if blocked:
+            continue
+        pending.remove(job)
+        if start_module(job, running, unfinished, timeout):
+            used += cost
+    if pending and not running:
+        # Nothing is running, yet nothing can be started: the dependencies
+        # form a cycle.  Break it by starting the top priority module.
+        job = pending.pop(0)
+        log.warning("Module %s has circular dependencies; starting it " \
+            "anyway." % job['name'])
+        start_module(job, running, unfinished, timeout)
+
+def start_module(job, running, unfinished, timeout):
+    """
+    Spawn a single job; see L{start_modules}.
+
+    @returns: True if the module was started.
+    """
+    pid = spawn_module(job['executable'], job['filename'])
+    if pid is None:
+        del unfinished[job['name']]
+        return False
+    job['deadline'] = time.time() + timeout
+    running[pid] = job
+    return True
+
+def spawn_module(executable, orig_filename):
+    """
+    Fork and execute a module in its own process group.
+
+    @returns: The PID of the module, or None if the fork failed.
+    """
     log.info("Running module %s" % executable)
-    os.setpgrp()
-    pgrp = os.getpgrp()
-    filename = '%s.%s' % (orig_filename, pgrp)
-    def cleanup_handler(pid):
-        try:
-            os.unlink(filename)
-        except:
-            pass
-        try:
-            os.unlink(orig_filename)
-        except:
-            pass
-        log.warning("The module %s timed out!" % executable)
-        log.warning("Attempting to kill pgrp %i" % pgrp)
+    try:
+        pid = os.fork()
+    except OSError, oe:
+        log.error("Unable to fork for module %s: %s" % (executable, oe))
+        return None
+    if pid == 0:
         try:
-            os.kill(pid, signal.SIGKILL)
-            os.killpg(pgrp, signal.SIGKILL)
+            try:
+                _exec_module(executable, orig_filename)
+            except Exception, e:
+                log.error("Fatal exception while running module %s" % \
+                    executable)
+                log.exception(e)
         finally:
-            log.warning("Exiting with status %i" % os.EX_SOFTWARE)
             os._exit(os.EX_SOFTWARE)
-    log.debug("Set a %.2f second timeout." % timeout)
-    t1 = -time.time()
+    # Set the process group from the parent side too, so that it is in place
+    # before we might need to kill it.
+    try:
+        os.setpgid(pid, pid)
+    except OSError:
+        pass
+    log.debug("Module %s is running in pid %i" % (executable, pid))
+    return pid
+
+def _exec_module(executable, orig_filename):
+    os.setpgrp()
+    filename = '%s.%i' % (orig_filename, os.getpid())
+    fd = os.open(filename, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0644)
+    os.dup2(fd, 1)
+    os.close(fd)
     module_log_loc = os.path.expandvars(gipDir("$GIP_LOCATION/var/logs/module.log",
                                                '/var/log/gip/module.log'))
     try:
-        sys.stderr = open(module_log_loc, 'a')
-    except:
+        fd = os.open(module_log_loc, os.O_WRONLY | os.O_CREAT | os.O_APPEND,
+            0644)
+    except OSError:
         log.warning("Unable to open %s; this might be a permissions error in" \
             " your GIP install if you are running as daemon." % module_log_loc)
         log.warning("Sending stderr to /dev/null")
-        sys.stderr = open("/dev/null", "a")
-    exec_name = executable.split('/')[-1]
-    pid = os.spawnl(os.P_NOWAIT, "/bin/sh", exec_name, "-c", "%s > %s" % \
-        (executable, filename))
-    exit_code = None
-    while t1+time.time() < timeout:
-        time.sleep(.1)
-        status = os.waitpid(pid, os.WNOHANG)
-        if status[0] == pid: # If subprocess not done, status==(0, 0)
-            exit_code = os.WEXITSTATUS(status[1])
-            break
-    if exit_code == None:
-        log.debug("Pid %i, cleaning up" % os.getpid())
-        cleanup_handler(pid)
-    if exit_code == 0:
-        log.debug("Pid %i, finishing successfully" % os.getpid())
+        fd = os.open("/dev/null", os.O_WRONLY)
+    os.dup2(fd, 2)
+    os.close(fd)
+    try:
+        os.execv(executable, [executable])
+    except OSError, oe:
+        if oe.errno != errno.ENOEXEC:
+            raise
+    # Like the shell modules used to be run through, run a script without a
+    # "#!" line with /bin/sh.
+    os.execv('/bin/sh', ['sh', executable])
+
+def finish_module(job, pid, status):
+    """
+    Move the output of a reaped module into the cache, or clean it up.
+    """
+    executable = job['executable']
+    orig_filename = job['filename']
+    filename = '%s.%i' % (orig_filename, pid)
+    if job.get('killed', False):
+        for name in [filename, orig_filename]:
+            try:
+                os.unlink(name)
+            except:
+                pass
+        return
+    if os.WIFEXITED(status) and os.WEXITSTATUS(status) == 0:
+        log.debug("Pid %i, finishing successfully" % pid)
         log.info("Executable %s ran successfully." % executable)
         if not os.path.exists(filename):
             log.error("Output file %s does not exist." % filename)
-            os._exit(os.EX_DATAERR)
+            return
         try:
             os.rename(filename, orig_filename)
-        except:
-            os._exit(os.EX_CANTCREAT)
+        except OSError, oe:
+            log.error("Unable to move %s to %s: %s" % (filename,
+                orig_filename, oe))
+        return
+    if os.WIFEXITED(status):
+        exit_code = str(os.WEXITSTATUS(status))
     else:
-        log.info("Executable %s died with exit code %s" % (executable, \
-            str(exit_code)))
-        os._exit(exit_code)
-    os._exit(os.EX_OK)
+        exit_code = "signal %i" % os.WTERMSIG(status)
+    log.info("Executable %s died with exit code %s" % (executable, exit_code))
+    try:
+        os.unlink(filename)
+    except:
+        pass
+
+def kill_module(job, pid):
+    """
+    Kill the process group of a module which has run past its timeout.
+    """
+    log.warning("The module %s timed out!" % job['executable'])
+    log.warning("Attempting to kill pgrp %i" % pid)
+    job['killed'] = True
+    try:
+        os.killpg(pid, signal.SIGKILL)
+    except OSError:
+        try:
+            os.kill(pid, signal.SIGKILL)
+        except OSError:
+            pass
 
 def calculate_hash(filename):
     """
@@ -568,10 +1019,120 @@ def calculate_hash(filename):
     @param filename: Filename of file to hash.
     @returns: Digest string of the file's contents.
     """
-    m = md5.md5()
-    m.update(open(filename, 'r').read())
+    m = md5()
+    fp = open(filename, 'rb')
+    try:
+        while True:
+            data = fp.read(65536)
+            if not data:
+                break
+            m.update(data)
+    finally:
+        fp.close()
     return m.hexdigest()
 
+class HashCache:
+
+    """
+    Remember module checksums between runs, so a module is only re-read when
+    it changes.
+
+    A checksum is reused as long as the module's path, inode, size, and mtime
+    are unchanged.  The cache is kept in a small text file, one module per
+    line::
+
+        path<TAB>inode<TAB>size<TAB>mtime<TAB>cksum
+
+    In verify mode every module is hashed anyway, and any cached checksum
+    which does not match is logged.
+    """
+
+    def __init__(self, filename=None, verify=False):
+        """
+        @keyword filename: The file the cache is loaded from and saved to; if
+            None, the cache only lives in memory.
+        @keyword verify: Hash every module's full contents regardless.
+        """
+        self.filename = filename
+        self.verify = verify
+        self.entries = {}
+        self.seen = {}
+        self.dirty = False
+        if filename:
+            self.load()
+
+    def load(self):
+        try:
+            fp = open(self.filename, 'r')
+        except IOError:
+            return
+        try:
+            for line in fp:
+                info = line.rstrip('\n').split('\t')
+                if len(info) != 5:
+                    continue
+                try:
+                    key = (int(info[1]), int(info[2]), float(info[3]))
+                except ValueError:
+                    continue
+                self.entries[info[0]] = (key, info[4])
+        finally:
+            fp.close()
+
+    def hash(self, filename):
+        """
+        Look up the checksum of filename, hashing it only if it changed.
+
+        @param filename: The file to hash.
+        @returns: Digest string of the file's contents.
+        """
+        st = os.stat(filename)
+        key = (st.st_ino, st.st_size, st.st_mtime)
+        self.seen[filename] = True
+        cached = self.entries.get(filename)
+        if cached and cached[0] == key and not self.verify:
+            return cached[1]
+        cksum = calculate_hash(filename)
+        if cached and cached[0] == key and cached[1] != cksum:
+            log.warning("Cached checksum of %s is out of date even though the "
+                "file looks unchanged." % filename)
+        if cached != (key, cksum):
+            self.entries[filename] = (key, cksum)
+            self.dirty = True
+        return cksum
+
+    def save(self):
+        """
+        Write the cache back to its file, dropping any module which was not
+        looked up since the last save.
+        """
+        for filename in self.entries.keys():
+            if filename not in self.seen:
+                del self.entries[filename]
+                self.dirty = True
+        self.seen = {}
+        if not self.filename or not self.dirty:
+            return
+        tmp_filename = "%s.%i" % (self.filename, os.getpid())
+        try:
+            fp = open(tmp_filename, 'w')
+            try:
+                for filename, (key, cksum) in self.entries.items():
+                    fp.write("%s\t%i\t%i\t%r\t%s\n" % ((filename,) + key + \
+                        (cksum,)))
+            finally:
+                fp.close()
+            os.rename(tmp_filename, self.filename)
+        except (IOError, OSError), e:
+            log.warning("Unable to save module checksums to %s: %s" % \
+                (self.filename, str(e)))
+            try:
+                os.unlink(tmp_filename)
+            except OSError:
+                pass
+            return
+        self.dirty = False
+
 def read_static(static_dir):
     """
     Read all the files in static_dir, collating the response into a single
@@ -581,7 +1142,7 @@ def read_static(static_dir):
 
     @param static_dir: Directory to look in for static files.
     """
-    streams = ''
+    streams = []
     for filename in glob.glob("%s/*.ldif" % static_dir):
         log.debug("Reading static file %s" % filename)
         try:
@@ -594,8 +1155,8 @@ def read_static(static_dir):
             info += '\n'
         if info[-2] != "\n":
             info += '\n'
-        streams += info
-    return streams
+        streams.append(info)
+    return ''.join(streams)
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+
+"""
+Compare the speed of counting jobs from condor_q -xml and from
+condor_q -autoformat.
+
+The recorded glow outputs in test/command_output are repeated until they hold
+the requested number of jobs (5000 by default), then parsed both ways:
+
+    ./condor_benchmark.py [jobs]
+"""
+
+import os
+import sys
+import time
+import cStringIO
+
+sys.path.insert(0, os.path.expandvars("$GIP_LOCATION/lib/python"))
+import condor_common
+
+def fixture(name):
+    return open(os.path.expandvars("$GIP_LOCATION/../test/command_output/%s" \
+        % name)).read()
+
+def xmlOutput(jobs):
+    """
+    Repeat the classads of the recorded condor_q -xml output to make an
+    output with the given number of jobs.
+    """
+    output = fixture("condor_q_xml_glow")
+    start = output.index('<c>')
+    end = output.rindex('</c>') + len('</c>')
+    classads = output[start:end].split('</c>')[:-1]
+    body = [classads[i % len(classads)] + '</c>' for i in range(jobs)]
+    return output[:start] + '\n'.join(body) + output[end:]
+
+def autoformatOutput(jobs):
+    """
+    Repeat the lines of the recorded condor_q -autoformat output to make an
+    output with the given number of jobs.
+    """
+    lines = fixture("condor_q_autoformat_glow").splitlines(True)
+    return ''.join([lines[i % len(lines)] for i in range(jobs)])
+
+def timeParser(parse, output):
+    """
+    Count the jobs in output with the given parse function.
+
+    @returns: The elapsed time and the job counts.
+    """
+    handler = condor_common.JobAggregator()
+    start = time.time()
+    parse(cStringIO.StringIO(output), handler)
+    return time.time() - start, handler.getClassAds()
+
+def parseXml(fp, handler):
+    condor_common.parseCondorXml(condor_common.CondorXmlFile(fp), handler)
+
+def main():
+    jobs = 5000
+    if len(sys.argv) > 1:
+        jobs = int(sys.argv[1])
+    xml_time, xml_info = timeParser(parseXml, xmlOutput(jobs))
+    af_time, af_info = timeParser(condor_common.parseCondorAutoformat,
+        autoformatOutput(jobs))
+    if xml_info != af_info:
+        print >> sys.stderr, "Job counts differ: %s != %s" % (xml_info,
+            af_info)
+        sys.exit(1)
+    print "condor_q -xml:        %i jobs in %.3f seconds" % (jobs, xml_time)
+    print "condor_q -autoformat: %i jobs in %.3f seconds" % (jobs, af_time)
+    print "Speedup: %.1fx" % (xml_time / (af_time + 1e-10))
+
+if __name__ == '__main__':
+    main()
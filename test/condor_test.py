@@ -2,16 +2,21 @@
 
 import os
 import sys
+import time
 import socket
 import unittest
+import cStringIO
 
 sys.path.insert(0, os.path.expandvars("$GIP_LOCATION/lib/python"))
 from gip_sets import Set
-from gip_common import config, cp_get
+from gip_common import config, cp_get, VoMapper
 from pbs_common import getVoQueues
 from gip_ldap import read_ldap
 from gip_testing import runTest, streamHandler
 import gip_testing
+import condor_common
+from gip_batch import BatchQueries
+from gip.providers.condor import print_CE, print_VOViewLocal
 
 class TestCondorProvider(unittest.TestCase):
 
@@ -172,6 +177,58 @@ class TestCondorProvider(unittest.TestCase):
                 self.failUnless(vo_free <= assigned - running, msg="Failed " \
                     "invariant: VO_FREE_SLOTS <= CE_ASSIGNED - VO_RUNNING")
 
+    def test_group_config(self):
+        """
+        Make sure the group quotas and priorities are read from a single
+        condor_config_val dump rather than queried group by group.
+        """
+        os.environ['GIP_TESTING'] = 'suffix=fnal'
+        gip_testing.commands.clear()
+        cp = config("test_configs/red.conf")
+        commands = []
+        condorCommand = condor_common.condorCommand
+        def countingCommand(command, cp, info=None):
+            commands.append(command)
+            return condorCommand(command, cp, info)
+        condor_common.condorCommand = countingCommand
+        try:
+            groupInfo = condor_common.getGroupInfo(VoMapper(cp), cp)
+        finally:
+            condor_common.condorCommand = condorCommand
+            gip_testing.commands.clear()
+        self.assertEquals(commands, [condor_common.condor_group,
+            condor_common.condor_group_dump])
+        self.assertEquals(groupInfo['group_atlas']['quota'], 50)
+        self.assertEquals(groupInfo['group_atlas']['prio'], 1000)
+        self.assertEquals(groupInfo['group_e875']['quota'], 0)
+        self.assertEquals(groupInfo['group_nanohub']['vos'], ['nanohub'])
+
+    def test_batch_queries(self):
+        """
+        Make sure the Condor provider runs each batch system query once per
+        run, even though both the CE and VOView entries need the results,
+        and that the providers leave the shared results alone.
+        """
+        os.environ['GIP_TESTING'] = 'suffix=fnal'
+        gip_testing.commands.clear()
+        cp = config("test_configs/fnal_condor.conf")
+        queries = BatchQueries(cp)
+        stdout = sys.stdout
+        sys.stdout = cStringIO.StringIO()
+        try:
+            print_CE(cp, queries)
+            print_VOViewLocal(cp, queries)
+            condor_common.getQueueList(cp, queries)
+            groups = condor_common.getGroupInfo(queries.getVoMapper(), cp)
+        finally:
+            sys.stdout = stdout
+            gip_testing.commands.clear()
+        names = [name for name, _ in queries.timings]
+        names.sort()
+        self.assertEquals(names, ['groups', 'jobs', 'nodes', 'submitters',
+            'version'])
+        self.assertEquals(queries.results['groups'], groups)
+
     def test_condorq_parsing(self):
         """
         Test the condor_q -xml parsing for Condor format changes
@@ -193,6 +250,107 @@ class TestCondorProvider(unittest.TestCase):
         entries = read_ldap(fd, multi=True)
         self.assertEquals(fd.close(), None)
 
+    def test_job_aggregator(self):
+        """
+        Make sure condor_q -xml output is folded into per-owner counts, and
+        that the junk lines printed by old Condors are skipped.
+        """
+        job = '<c><a n="Owner"><s>%s</s></a><a n="Cmd"><s>/bin/sleep</s></a>' \
+            '<a n="JobStatus"><i>%i</i></a>%s</c>\n'
+        jobs = []
+        for i in range(1000):
+            jobs.append(job % ('cmsprod', 1, ''))
+            jobs.append(job % ('cmsprod', 2, ''))
+            jobs.append(job % ('uscms01', 2, '<a n="FlockFrom"><s>a.edu</s>' \
+                '</a>'))
+        jobs.append(job % ('uscms01', 5, ''))
+        jobs.append(job % ('uscms01', 4, ''))
+        jobs.append('<c><a n="AccountingGroup"><s>group_cms</s></a>' \
+            '<a n="Owner"><s>cmsprod</s></a><a n="JobStatus"><i>1</i></a>' \
+            '</c>\n')
+        xml = '-- Submitter: junk\n<?xml version="1.0"?>\n<classads>\n' + \
+            ''.join(jobs) + '</classads>\n'
+        handler = condor_common.JobAggregator({'cmsprod': {'MaxJobsRunning':
+            '10'}})
+        condor_common.parseCondorXml(condor_common.CondorXmlFile( \
+            cStringIO.StringIO(xml)), handler)
+        self.assertEquals(handler.caCount, 3003)
+        self.assertEquals(handler.getClassAds(), {
+            'cmsprod': {'MaxJobsRunning': '10', 'IdleJobs': 1000,
+                'RunningJobs': 1000},
+            'uscms01': {'FlockedJobs': 1000, 'HeldJobs': 1},
+            'group_cms.cmsprod': {'IdleJobs': 1}})
+
+    def test_autoformat(self):
+        """
+        Make sure condor_q -autoformat is picked for new enough Condors, and
+        that it counts the jobs the same way as condor_q -xml.
+        """
+        os.environ['GIP_TESTING'] = 'suffix=glow'
+        gip_testing.commands.clear()
+        try:
+            cp = config("test_configs/glow_condor.conf")
+            self.failIf(condor_common.useAutoformat(cp, "7.4.0 Oct 19 2009"))
+            self.failUnless(condor_common.useAutoformat(cp, "7.6.0 Apr 15"))
+            self.failIf(condor_common.useAutoformat(cp, "garbage"))
+            xml_info = condor_common._getJobsInfoInternal(cp, "7.4.0")
+            cp.set("condor", "jobs_format", "autoformat")
+            self.assertEquals(condor_common._getJobsInfoInternal(cp, "7.4.0"),
+                xml_info)
+            cp.set("condor", "jobs_format", "xml")
+            self.failIf(condor_common.useAutoformat(cp, "7.6.0 Apr 15"))
+        finally:
+            gip_testing.commands.clear()
+
+        output = "1 cmsprod false undefined\n2 cmsprod false undefined\n" \
+            "2 uscms01 true undefined\n5 uscms01 false undefined\n" \
+            "1 cmsprod false group_cms\n2 cmsprod false group_cms.cmsprod\n" \
+            "2 cmsprod false\n\n"
+        handler = condor_common.JobAggregator()
+        condor_common.parseCondorAutoformat(cStringIO.StringIO(output),
+            handler)
+        self.assertEquals(handler.caCount, 7)
+        self.assertEquals(handler.getClassAds(), {
+            'cmsprod': {'IdleJobs': 1, 'RunningJobs': 2},
+            'uscms01': {'FlockedJobs': 1, 'HeldJobs': 1},
+            'group_cms.cmsprod': {'IdleJobs': 1, 'RunningJobs': 1}})
+
+    def test_all_schedds(self):
+        """
+        Make sure the jobs of every schedd in the pool are counted when
+        query_all_schedds is set.
+        """
+        os.environ['GIP_TESTING'] = 'suffix=glow'
+        gip_testing.commands.clear()
+        try:
+            cp = config("test_configs/glow_condor.conf")
+            cp.set("condor", "query_all_schedds", "True")
+            self.assertEquals(condor_common.getScheddList(cp),
+                ['cmsgrid02.hep.wisc.edu', 'cmsgrid03.hep.wisc.edu'])
+            for jobs_format in ['xml', 'autoformat']:
+                cp.set("condor", "jobs_format", jobs_format)
+                info = condor_common._getJobsInfoInternal(cp, "7.4.0")
+                self.assertEquals(info['osg_uscms01'], {'HeldJobs': 18})
+        finally:
+            gip_testing.commands.clear()
+
+    def test_run_commands(self):
+        """
+        Make sure commands run concurrently, and that a slow command is
+        killed without holding up the others, even if it closed its output.
+        """
+        cmds = ['sleep 30; echo slow', 'echo a', 'sleep 1; echo b',
+            'sleep 1; echo c', 'echo d; exec >&- 2>&-; sleep 30']
+        start = time.time()
+        outputs = gip_testing.runCommands(cmds, timeout=2, max_parallel=3,
+            force_command=True)
+        elapsed = time.time() - start
+        self.assertEquals(outputs[0], None)
+        self.assertEquals(outputs[4], None)
+        self.assertEquals([fp.read() for fp in outputs[1:4]], ['a\n', 'b\n',
+            'c\n'])
+        self.failUnless(elapsed < 10, msg="Commands took %.1f seconds" % \
+            elapsed)
 
     def test_collector_host(self):
         """
@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+
+"""
+A fake dCache admin interface, for testing gip.dcache.admin without a dCache.
+
+It is run in place of ssh (see gip.dcache.admin.ssh_command), ignores its
+arguments, and talks the admin shell protocol on its terminal: each line
+typed is echoed back, followed by the command output and the prompt of the
+current cell.  It knows these commands:
+
+   - B{..} and B{cd <cell>}: Change the current cell.
+   - B{cm ls} in the PoolManager: List the pools.
+   - B{info} and B{info -l} in a pool: Show the pool information.
+   - B{logoff}: Exit.
+
+The pools are named pool1, pool2, ...; $FAKE_DCACHE_POOLS sets how many
+(default 3).  The pool named pool_down has no route, like a pool which is
+offline.  If $FAKE_DCACHE_HANG is set, there is also a pool named pool_hang,
+and the admin interface stops answering once a command is sent to it.
+"""
+
+import os
+import sys
+import tty
+import time
+
+pool_info = """Base directory    : /dcache/%(name)s
+Revision          : [$Revision: 1.73 $]
+Version           : production-1-9-5-23(1.73) (Sub=4)
+Gap               : 4294967296
+LargeFileStore    : None
+Total             : %(total)iG
+Used              : %(used)i    [0.1]
+Free              : %(free)i    [0.9]
+Precious          : 0    [0.0]
+Removable         : 1024    [0.0]
+Reserved          : 0    [0.0]
+"""
+
+def pools():
+    names = ['pool%i' % (i+1) for i in range(int(os.environ.get(
+        'FAKE_DCACHE_POOLS', 3)))]
+    names.append('pool_down')
+    if os.environ.get('FAKE_DCACHE_HANG'):
+        names.append('pool_hang')
+    return names
+
+def reply(cell, command):
+    """
+    The output of command in cell.
+    """
+    if cell == 'pool_hang':
+        while True:
+            time.sleep(3600)
+    if cell == 'pool_down':
+        return "(3) No Route to cell for packet {uoid=<1.1>;path=[>%s@local];" \
+            "msg=Tunnel cell >pool_down< not found at >dCacheDomain<}\n" % cell
+    if cell == 'PoolManager' and command == 'cm ls':
+        return ''.join(['%s={R={a=0;m=10;q=0};S={a=0;m=10;q=0};M={cnt=0;' \
+            'q=0}}\n' % name for name in pools()])
+    if cell in pools() and command in ['info', 'info -l']:
+        total = 1024**3 * (pools().index(cell) + 1)
+        return pool_info % {'name': cell, 'total': total / 1024**3,
+            'used': total / 10, 'free': total - total / 10}
+    return "java.lang.Exception: Command not found : %s\n" % command
+
+def main():
+    if os.isatty(0):
+        tty.setraw(0)
+    cell = 'local'
+    out = sys.stdout
+    out.write("\r\n    dCache Admin (VII) (user=admin)\r\n\r\n\r\n")
+    out.write("(%s) admin > " % cell)
+    out.flush()
+    data = ''
+    while True:
+        chunk = os.read(0, 4096)
+        if not chunk:
+            return
+        data += chunk.replace('\r', '\n')
+        while data.find('\n') >= 0:
+            line, data = data.split('\n', 1)
+            line = line.strip()
+            if not line:
+                continue
+            out.write(line + "\r\n")
+            if line == 'logoff':
+                out.flush()
+                return
+            elif line == '..':
+                cell = 'local'
+            elif line.startswith('cd '):
+                cell = line[3:].strip()
+            else:
+                out.write(reply(cell, line).replace('\n', '\r\n'))
+            out.write("(%s) admin > " % cell)
+            out.flush()
+
+if __name__ == '__main__':
+    main()
@@ -1,12 +1,19 @@
 
 import os
 import sys
+import time
+import shutil
+import tempfile
 import unittest
 
 sys.path.append(os.path.expandvars("$GIP_LOCATION/lib/python"))
-from gip_common import config
+from gip_common import config, VoMapper
 from gip_ldap import read_ldap
+import gip_testing
 from gip_testing import runTest, streamHandler
+from gip_batch import BatchQueries
+from lsf_common import getInventory, getQueueInfo, parseNodes, \
+    getJobsInfo, loadGroupCache, saveGroupCache, bmgroup_r_cmd, bugroup_r_cmd
 
 class TestLsfDynamic(unittest.TestCase):
 
@@ -40,6 +47,80 @@ class TestLsfDynamic(unittest.TestCase):
                 self.failIf(contact_string.endswith("jobmanager-lsf"), \
                     "Contact string must include the queue.")
 
+    def test_inventory(self):
+        """
+        Make sure the inventory snapshot gives the same node counts as
+        running each command on its own, and that the group membership is
+        cached.
+        """
+        os.environ['GIP_TESTING'] = '1'
+        cp = config("test_configs/red.conf")
+        temp_dir = tempfile.mkdtemp()
+        try:
+            cache = os.path.join(temp_dir, "lsf-groups.cache")
+            if not cp.has_section("lsf"):
+                cp.add_section("lsf")
+            cp.set("lsf", "group_cache", cache)
+            queries = BatchQueries(cp)
+            queue_info = getQueueInfo(cp, queries)
+            self.assertEquals(parseNodes(queue_info, cp, queries),
+                parseNodes(queue_info, cp))
+            self.failUnless(os.path.exists(cache))
+
+            key = ['localhost', bmgroup_r_cmd, bugroup_r_cmd]
+            groups = loadGroupCache(cache, key, 3600)
+            self.assertEquals(groups, dict([(cmd, inventory) for cmd, \
+                inventory in getInventory(cp).items() if cmd in key]))
+            self.assertEquals(loadGroupCache(cache, key[1:], 3600), None)
+
+            saveGroupCache(cache, key, {bmgroup_r_cmd: "g1 host1\n",
+                bugroup_r_cmd: "u1 user1\n"})
+            self.assertEquals(getInventory(cp)[bugroup_r_cmd], "u1 user1\n")
+            cp.set("lsf", "group_cache_ttl", "0")
+            self.assertNotEquals(getInventory(cp)[bugroup_r_cmd],
+                "u1 user1\n")
+        finally:
+            shutil.rmtree(temp_dir)
+
+    def test_inventory_timeout(self):
+        """
+        Make sure a command which times out in the inventory snapshot is
+        treated as having no output, rather than being run again without a
+        timeout.
+        """
+        os.environ['GIP_TESTING'] = '1'
+        cp = config("test_configs/red.conf")
+        if not cp.has_section("lsf"):
+            cp.add_section("lsf")
+        cp.set("lsf", "command_timeout", "1")
+        cp.set("lsf", "group_cache_ttl", "0")
+        bin_dir = tempfile.mkdtemp()
+        old_path = os.environ['PATH']
+        old_replace = gip_testing.replace_command
+        try:
+            for name in ['lsid', 'bqueues', 'bhosts', 'bmgroup', 'bugroup',
+                    'bjobs']:
+                script = os.path.join(bin_dir, name)
+                fp = open(script, 'w')
+                if name == 'bjobs':
+                    fp.write("#!/bin/sh\nsleep 30\n")
+                else:
+                    fp.write("#!/bin/sh\nexit 0\n")
+                fp.close()
+                os.chmod(script, 0755)
+            os.environ['PATH'] = bin_dir + os.pathsep + old_path
+            gip_testing.replace_command = False
+            queries = BatchQueries(cp)
+            start = time.time()
+            self.assertEquals(getJobsInfo(VoMapper(cp), cp, queries), {})
+            elapsed = time.time() - start
+            self.failUnless(elapsed < 10, msg="Getting the jobs took %.1f " \
+                "seconds" % elapsed)
+        finally:
+            gip_testing.replace_command = old_replace
+            os.environ['PATH'] = old_path
+            shutil.rmtree(bin_dir)
+
 def main():
     """
     The main entry point for when lsf_test is run in standalone mode.
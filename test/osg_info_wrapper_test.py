@@ -2,21 +2,49 @@
 import os
 import sys
 import time
+import shutil
+import signal
+import socket
 import unittest
+import cStringIO
+import tempfile23 as tempfile
 
 #Standard testing imports:
 sys.path.append(os.path.expandvars("$GIP_LOCATION/lib/python"))
 from gip_common import config, getLogger, cp_get
+from gip_ldap import read_ldap, DNIndex
 from gip_testing import runTest, streamHandler
 
 log = getLogger("GIP.Test.Wrapper")
 
+def synthetic_ldif(start, count, free_slots=0):
+    """
+    Generate LDIF for C{count} GlueVOView entries, numbered from C{start}.
+    """
+    entry = "dn: GlueVOViewLocalID=vo%(num)i,GlueCEUniqueID=red.unl.edu:2119/" \
+        "jobmanager-pbs-workq,mds-vo-name=local,o=grid\n" \
+        "objectClass: GlueCETop\nobjectClass: GlueVOView\n" \
+        "GlueVOViewLocalID: vo%(num)i\nGlueCEStateFreeJobSlots: %(free)i\n" \
+        "GlueCEAccessControlBaseRule: VO:vo%(num)i\n\n"
+    output = []
+    for num in range(start, start+count):
+        output.append(entry % {'num': num, 'free': free_slots})
+    return ''.join(output)
+
 #Add the path with the osg_info_wrapper script:
 sys.path.append(os.path.expandvars("$GIP_LOCATION/libexec"))
 import osg_info_wrapper
+import osg_info_client
+import gip_daemon
 
 class TestOsgInfoWrapper(unittest.TestCase):
 
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
     def test_simple(self):
         """
         Simple test of the OSG Info Wrapper.  Make sure that both the provider
@@ -189,11 +217,83 @@ class TestOsgInfoWrapper(unittest.TestCase):
                 has_ce = True
         self.assertEquals(has_ce, True, msg="Static info was not included.")
 
+    def test_passthrough_ldif(self):
+        """
+        Make sure entries which no plugin touched keep their original LDIF
+        when passthrough_ldif is set, and altered entries do not.
+        """
+        cp = config("test_modules/simple/config")
+        cp.set("gip", "passthrough_ldif", "True")
+        entries = osg_info_wrapper.main(cp, return_entries=True)
+        has_ce = False
+        for entry in entries:
+            if entry.dn[0] == 'GlueCEUniqueID=red.unl.edu:2119/jobmanager' \
+                    '-pbs-workq':
+                has_ce = True
+                self.assertEquals(entry.ldif, None, msg="Altered entry " \
+                    "kept its original LDIF.")
+                self.failUnless(entry.to_ldif().find( \
+                    'GlueCEPolicyAssignedJobSlots: 1234\n') >= 0)
+            elif entry.dn[0] == 'GlueVOInfoLocalID=pragma':
+                self.failUnless(entry.ldif is not None, msg="Provider " \
+                    "entry was not passed through.")
+        self.assertEquals(has_ce, True, msg="Static info was not included.")
+
+    def test_module_scheduling(self):
+        """
+        Make sure the module supervisor respects max_parallel_modules,
+        module priorities, and dependencies.
+        """
+        tmpdir = tempfile.mkdtemp()
+        order = os.path.join(tmpdir, 'order')
+        jobs = []
+        for name, priority, after in [('first', 0, []), ('second', 5, []),
+                ('third', 10, ['first'])]:
+            executable = os.path.join(tmpdir, name)
+            fp = open(executable, 'w')
+            fp.write("#!/bin/sh\nsleep 0.2\necho %s >> %s\n" % (name, order))
+            fp.close()
+            os.chmod(executable, 0755)
+            jobs.append({'name': name, 'executable': executable,
+                'filename': executable + '.ldif', 'priority': priority,
+                'cost': 1, 'after': after})
+        try:
+            t1 = time.time()
+            osg_info_wrapper.supervise_modules(jobs, 10, max_parallel=1)
+            t1 = time.time() - t1
+            self.assertEquals(open(order).read().split(), ['second', 'first',
+                'third'])
+            self.failUnless(t1 >= 0.6, msg="Modules ran in parallel.")
+            for job in jobs:
+                self.failUnless(os.path.exists(job['filename']))
+        finally:
+            for filename in os.listdir(tmpdir):
+                os.unlink(os.path.join(tmpdir, filename))
+            os.rmdir(tmpdir)
+
+    def test_module_without_interpreter(self):
+        """
+        Make sure a module script without a "#!" line is run with /bin/sh,
+        with its full path as argv[0].
+        """
+        executable = os.path.join(self.temp_dir, 'module')
+        fp = open(executable, 'w')
+        fp.write("echo \"dn: $0\"\n")
+        fp.close()
+        os.chmod(executable, 0755)
+        job = {'name': 'module', 'executable': executable,
+            'filename': executable + '.ldif', 'priority': 0, 'cost': 1,
+            'after': []}
+        osg_info_wrapper.supervise_modules([job], 10)
+        self.assertEquals(open(job['filename']).read(), "dn: %s\n" % \
+            executable)
+
     def test_cache_flush(self):
         """
         Make sure that osg-info-wrapper flushes the cache properly.
         """
         cp = config("test_modules/cache_flush/config")
+        cp.set("gip", "temp_dir", self.temp_dir)
         cp.set("gip", "flush_cache", "False")
         entries = osg_info_wrapper.main(cp, return_entries=True)
         timestamp_entry = entries[0]
@@ -204,6 +304,273 @@ class TestOsgInfoWrapper(unittest.TestCase):
         t2 = float(timestamp_entry.glue['LocationVersion'][0])
         self.failUnless(t1 < t2)
 
+    def test_stale_while_revalidate(self):
+        """
+        Make sure stale output is served immediately and refreshed in the
+        background when stale_while_revalidate is set.
+        """
+        cp = config("test_modules/cache_flush/config")
+        cp.set("gip", "temp_dir", self.temp_dir)
+        cp.set("gip", "flush_cache", "True")
+        entries = osg_info_wrapper.main(cp, return_entries=True)
+        t1 = float(entries[0].glue['LocationVersion'][0])
+        cp.set("gip", "flush_cache", "False")
+        cp.set("gip", "stale_while_revalidate", "True")
+        cp.set("gip", "freshness", "0")
+        cp.set("gip", "cache_ttl", "600")
+        t2 = time.time()
+        entries = osg_info_wrapper.main(cp, return_entries=True)
+        t2 = time.time() - t2
+        self.assertEquals(float(entries[0].glue['LocationVersion'][0]), t1,
+            msg="Stale output was not served.")
+        self.failUnless(t2 < 1, msg="Wrapper waited on the refresh.")
+        # Wait for the background refresh to update the cache.
+        cp.set("gip", "freshness", "600")
+        cp.set("gip", "stale_while_revalidate", "False")
+        for i in range(50):
+            time.sleep(.2)
+            entries = osg_info_wrapper.main(cp, return_entries=True)
+            t3 = float(entries[0].glue['LocationVersion'][0])
+            if t3 > t1:
+                break
+        self.failUnless(t3 > t1, msg="Stale output was not refreshed.")
+
+    def test_refresh_detached(self):
+        """
+        Make sure a background refresh does not keep the wrapper's output
+        open: whoever reads the wrapper's output to the end gets the stale
+        output long before the slow provider finishes.
+        """
+        dirs = {}
+        for name in ['temp', 'plugin', 'provider', 'static']:
+            dirs[name] = os.path.join(self.temp_dir, name)
+            os.mkdir(dirs[name])
+        entry = "dn: GlueLocationLocalID=slow,mds-vo-name=local,o=grid\n" \
+            "objectClass: GlueLocation\nGlueLocationLocalID: slow\n" \
+            "GlueLocationVersion: %s\n"
+        provider = os.path.join(dirs['provider'], 'slow')
+        open(provider, 'w').write("#!/bin/sh\nsleep 5\ncat <<EOF\n%sEOF\n" % \
+            (entry % 'new'))
+        os.chmod(provider, 0755)
+        cache_file = os.path.join(dirs['temp'], 'slow.ldif.%s' % \
+            osg_info_wrapper.calculate_hash(provider))
+        open(cache_file, 'w').write(entry % 'old')
+        mtime = time.time() - 10
+        os.utime(cache_file, (mtime, mtime))
+        config_file = os.path.join(self.temp_dir, 'config')
+        fp = open(config_file, 'w')
+        fp.write("[gip]\n")
+        for name, dirname in dirs.items():
+            fp.write("%s_dir = %s\n" % (name, dirname))
+        fp.write("freshness = 1\ncache_ttl = 600\n" \
+            "stale_while_revalidate = True\n")
+        fp.close()
+
+        wrapper = os.path.expandvars("$GIP_LOCATION/libexec/osg_info_wrapper.py")
+        t1 = time.time()
+        fd = os.popen("%s %s --config=%s" % (sys.executable, wrapper,
+            config_file))
+        output = fd.read()
+        fd.close()
+        t1 = time.time() - t1
+        self.failUnless(output.find("GlueLocationVersion: old") >= 0,
+            msg="Stale output was not served.")
+        self.failUnless(t1 < 3, msg="Reading the wrapper output took %.1fs; " \
+            "it waited on the refresh." % t1)
+        # Let the refresh finish before its directory is removed.
+        for i in range(50):
+            if open(cache_file).read().find('new') >= 0:
+                break
+            time.sleep(.2)
+        self.failUnless(open(cache_file).read().find('new') >= 0,
+            msg="Stale output was not refreshed.")
+
+    def test_daemon(self):
+        """
+        Make sure gip_daemon serves the merged output over its socket and
+        writes it to its output file, and cleans up when stopped.
+        """
+        cp = config("test_modules/simple/config")
+        cp.set("gip", "temp_dir", self.temp_dir)
+        socket_path = os.path.join(self.temp_dir, "gip-daemon.sock")
+        output_file = os.path.join(self.temp_dir, "gip.ldif")
+        cp.set("gip", "daemon_socket", socket_path)
+        cp.set("gip", "daemon_output", output_file)
+        pid = os.fork()
+        if pid == 0:
+            try:
+                gip_daemon.GipDaemon(cp).run()
+            finally:
+                os._exit(0)
+        try:
+            ldif = None
+            for i in range(100):
+                try:
+                    ldif = osg_info_client.fetch(socket_path)
+                    break
+                except Exception:
+                    time.sleep(.1)
+        finally:
+            os.kill(pid, signal.SIGTERM)
+            os.waitpid(pid, 0)
+        self.failUnless(ldif, msg="Daemon did not serve any output.")
+        self.assertEquals(open(output_file).read(), ldif)
+        self.failIf(os.path.exists(socket_path), msg="Socket was not removed.")
+        entries = read_ldap(cStringIO.StringIO(ldif), multi=True)
+        dns = [entry.dn[0] for entry in entries]
+        self.failUnless('GlueCEUniqueID=red.unl.edu:2119/jobmanager-pbs-workq' \
+            in dns, msg="Static info was not included.")
+        self.failUnless([entry for entry in entries if entry.glue.get( \
+            'LocationName', (0,))[0] == 'TIMESTAMP'], msg="Provider did not " \
+            "run.")
+
+    def test_daemon_slow_client(self):
+        """
+        Make sure a client which stops reading does not hold up the daemon's
+        other clients.
+        """
+        static_dir = os.path.join(self.temp_dir, "static")
+        os.mkdir(static_dir)
+        open(os.path.join(static_dir, "big.ldif"), 'w').write( \
+            synthetic_ldif(0, 20000))
+        cp = config("test_modules/simple/config")
+        cp.set("gip", "temp_dir", self.temp_dir)
+        cp.set("gip", "static_dir", static_dir)
+        socket_path = os.path.join(self.temp_dir, "gip-daemon.sock")
+        cp.set("gip", "daemon_socket", socket_path)
+        pid = os.fork()
+        if pid == 0:
+            try:
+                gip_daemon.GipDaemon(cp).run()
+            finally:
+                os._exit(0)
+        stalled = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            ldif = None
+            for i in range(100):
+                try:
+                    ldif = osg_info_client.fetch(socket_path)
+                    break
+                except Exception:
+                    time.sleep(.1)
+            self.failUnless(len(ldif) > 1024**2, msg="Daemon did not serve " \
+                "the large output.")
+            stalled.connect(socket_path)
+            t1 = time.time()
+            self.assertEquals(osg_info_client.fetch(socket_path, timeout=10),
+                ldif)
+            t1 = time.time() - t1
+            self.failUnless(t1 < 5, msg="Fetching the LDIF took %.1fs behind " \
+                "a stalled client." % t1)
+        finally:
+            stalled.close()
+            os.kill(pid, signal.SIGTERM)
+            os.waitpid(pid, 0)
+
+    def test_daemon_lock(self):
+        """
+        Make sure the daemon does not count a refresh as run while a wrapper
+        refresh holds the lock, and retries it soon after.
+        """
+        cp = config("test_modules/simple/config")
+        cp.set("gip", "temp_dir", self.temp_dir)
+        cp.set("gip", "daemon_socket", "")
+        daemon = gip_daemon.GipDaemon(cp)
+        lock_fd = osg_info_wrapper.acquire_lock(daemon.lock_file)
+        try:
+            daemon.refresh()
+        finally:
+            os.close(lock_fd)
+        self.assertEquals(daemon.refresh_pids, [])
+        self.assertEquals(daemon.last_run, {})
+        self.failUnless(daemon.next_refresh <= time.time() + \
+            daemon.lock_retry, msg="Refresh was not retried soon.")
+        daemon.next_refresh = 0
+        daemon.refresh(wait=True)
+        self.assertEquals(daemon.refresh_pids, [])
+        self.assertEquals(sorted(daemon.last_run.keys()),
+            ['alter_simple_entry', 'osg-info-timestamp', 'random_entry'])
+
+    def test_hash_cache(self):
+        """
+        Make sure module checksums are reused while the module looks
+        unchanged, and recomputed in verify mode or after a change.
+        """
+        module = os.path.join(self.temp_dir, "module")
+        cache_file = os.path.join(self.temp_dir, ".module_cksums")
+        open(module, 'w').write("#!/bin/sh\necho one\n")
+        mtime = int(time.time()) - 100
+        os.utime(module, (mtime, mtime))
+        old_cksum = osg_info_wrapper.calculate_hash(module)
+        hash_cache = osg_info_wrapper.HashCache(cache_file)
+        self.assertEquals(hash_cache.hash(module), old_cksum)
+        hash_cache.save()
+
+        # Same size and mtime; only a full hash can tell the difference.
+        open(module, 'w').write("#!/bin/sh\necho two\n")
+        os.utime(module, (mtime, mtime))
+        new_cksum = osg_info_wrapper.calculate_hash(module)
+        self.assertNotEquals(old_cksum, new_cksum)
+        hash_cache = osg_info_wrapper.HashCache(cache_file)
+        self.assertEquals(hash_cache.hash(module), old_cksum,
+            msg="Unchanged module was re-hashed.")
+        hash_cache = osg_info_wrapper.HashCache(cache_file, verify=True)
+        self.assertEquals(hash_cache.hash(module), new_cksum)
+        hash_cache.save()
+        os.utime(module, (mtime+10, mtime+10))
+        hash_cache = osg_info_wrapper.HashCache(cache_file)
+        self.assertEquals(hash_cache.hash(module), new_cksum)
+
+    def run_merge(self, count):
+        """
+        Merge synthetic provider, plugin, and remove-attributes output into
+        C{count} static entries; return the elapsed time.
+        """
+        static = read_ldap(cStringIO.StringIO(synthetic_ldif(0, count)),
+            multi=True)
+        providers = {'provider': {'output': synthetic_ldif(0, count/2, 1)}}
+        plugins = {'plugin': {'output': synthetic_ldif(count/2, count/4, 2)}}
+        remove_fd, remove_name = tempfile.mkstemp()
+        remove_lines = []
+        for num in range(count - count/10, count):
+            remove_lines.append("dn: GlueVOViewLocalID=vo%i,GlueCEUniqueID=" \
+                "red.unl.edu:2119/jobmanager-pbs-workq,mds-vo-name=local," \
+                "o=grid" % num)
+        os.write(remove_fd, '\n'.join(remove_lines))
+        os.close(remove_fd)
+        try:
+            t1 = time.time()
+            index = DNIndex(static)
+            index = osg_info_wrapper.handle_providers(index, providers)
+            index = osg_info_wrapper.handle_plugins(index, plugins)
+            index = osg_info_wrapper.handle_remove_attributes(index,
+                remove_name)
+            entries = index.entries()
+            t1 = time.time() - t1
+        finally:
+            os.unlink(remove_name)
+        self.assertEquals(len(entries), count - count/10)
+        free_slots = {}
+        for entry in entries:
+            free = entry.glue['CEStateFreeJobSlots'][0]
+            free_slots[free] = free_slots.get(free, 0) + 1
+        self.assertEquals(free_slots, {'1': count/2, '2': count/4,
+            '0': count - count/2 - count/4 - count/10})
+        return t1
+
+    def test_merge_scaling(self):
+        """
+        Benchmark the entry merging with a synthetic 50k-entry LDIF.  The
+        merge must scale linearly; a 10x larger input is allowed to take at
+        most 30x longer, which catches any return of quadratic behavior.
+        """
+        t_small = self.run_merge(5000)
+        t_large = self.run_merge(50000)
+        log.info("Merged 5k entries in %.3fs, 50k entries in %.3fs" % \
+            (t_small, t_large))
+        self.failUnless(t_large < 30*max(t_small, 0.01), msg="Merging 50k " \
+            "entries took %.2fs; 5k entries took %.2fs." % (t_large, t_small))
+
 def main():
     """
     The main entry point for testing the osg-info-wrapper implementation.
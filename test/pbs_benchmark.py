@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+
+"""
+Compare the speed of counting PBS jobs one VO lookup per job against the
+single-pass aggregation in pbs_common.getJobsInfo.
+
+The job lines of the recorded red qstat output in test/command_output are
+repeated until they hold the requested number of jobs (100000 by default).  A
+qstat script printing them is put on the PBS path, so both counts read the
+output through pbsCommand, as the provider does:
+
+    ./pbs_benchmark.py [jobs]
+"""
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+
+sys.path.insert(0, os.path.expandvars("$GIP_LOCATION/lib/python"))
+from gip_common import config, VoMapper
+import pbs_common
+
+def fixture(name):
+    return open(os.path.expandvars("$GIP_LOCATION/../test/command_output/%s" \
+        % name)).read()
+
+def qstatOutput(jobs):
+    """
+    Repeat the job lines of the recorded qstat output to make an output with
+    the given number of jobs.
+    """
+    lines = fixture("qstat").splitlines(True)
+    header, body = lines[:2], lines[2:]
+    return ''.join(header + [body[i % len(body)] for i in range(jobs)])
+
+def perJobInfo(vo_map, cp):
+    """
+    Count the jobs the way getJobsInfo used to: one VO lookup per job line.
+    """
+    queue_jobs = {}
+    for orig_line in pbs_common.pbsCommand(pbs_common.jobs_cmd, cp):
+        try:
+            job, _, user, _, status, queue = orig_line.split()
+        except:
+            continue
+        if job.startswith("-"):
+            continue
+        queue_data = queue_jobs.get(queue, {})
+        try:
+            vo = vo_map[user].lower()
+        except:
+            continue
+        info = queue_data.get(vo, {"running":0, "wait":0, "total":0})
+        if status == "R":
+            info["running"] += 1
+        if status == "Q":
+            info["wait"] += 1
+        info["total"] += 1
+        queue_data[vo] = info
+        queue_jobs[queue] = queue_data
+    return queue_jobs
+
+def timeCount(count, vo_map, cp):
+    """
+    Count the jobs with the given function.
+
+    @returns: The elapsed time and the job counts.
+    """
+    start = time.time()
+    info = count(vo_map, cp)
+    return time.time() - start, info
+
+def main():
+    jobs = 100000
+    if len(sys.argv) > 1:
+        jobs = int(sys.argv[1])
+    cp = config(os.path.expandvars("$GIP_LOCATION/../test/test_configs/" \
+        "red.conf"))
+    vo_map = VoMapper(cp)
+    bin_dir = tempfile.mkdtemp()
+    try:
+        output = os.path.join(bin_dir, "qstat.out")
+        open(output, 'w').write(qstatOutput(jobs))
+        script = os.path.join(bin_dir, "qstat")
+        open(script, 'w').write("#!/bin/sh\ncat %s\n" % output)
+        os.chmod(script, 0755)
+        cp.set("pbs", "pbs_path", bin_dir)
+        old_time, old_info = timeCount(perJobInfo, vo_map, cp)
+        new_time, new_info = timeCount(pbs_common.getJobsInfo, vo_map, cp)
+    finally:
+        shutil.rmtree(bin_dir)
+    for queue_data in new_info.values():
+        for info in queue_data.values():
+            del info["held"]
+    if old_info != new_info:
+        print >> sys.stderr, "Job counts differ: %s != %s" % (old_info,
+            new_info)
+        sys.exit(1)
+    print "Per-job lookups:  %i jobs in %.3f seconds" % (jobs, old_time)
+    print "Single pass:      %i jobs in %.3f seconds" % (jobs, new_time)
+    print "Speedup: %.1fx" % (old_time / (new_time + 1e-10))
+
+if __name__ == '__main__':
+    main()
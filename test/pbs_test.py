@@ -3,12 +3,14 @@
 import os
 import sys
 import unittest
+import cStringIO
 
 os.environ['GIP_TESTING'] = '1'
 sys.path.insert(0, os.path.expandvars("$GIP_LOCATION/lib/python"))
 from gip_sets import Set
 from gip_common import config, cp_get
-from pbs_common import getVoQueues
+from pbs_common import getVoQueues, getNodeTable, parseNodes, \
+    parseNeednodes, pbsOutputFilter
 from gip_ldap import read_ldap
 from gip_testing import runTest, streamHandler
 import gip_testing
@@ -213,7 +215,63 @@ class TestPbsDynamic(unittest.TestCase):
                 self.failIf(contact_string == "", "Contact string is missing")
                 self.failIf(contact_string.endswith("jobmanager-pbs"), \
                     "Contact string must include the queue.")
-                
+
+    def test_output_filter(self):
+        """
+        Make sure continuation lines are joined onto the line they continue.
+        """
+        fp = cStringIO.StringIO("Server: red\n    state_count = Running:428 " \
+            "Exiting\n\t:0 Begun:0\n    acl_roots = t3\n")
+        self.assertEquals(list(pbsOutputFilter(fp)), ["Server: red\n",
+            "    state_count = Running:428 Exiting:0 Begun:0",
+            "    acl_roots = t3\n"])
+        self.assertRaises(ValueError, list,
+            pbsOutputFilter(cStringIO.StringIO("\t:0 Begun:0\n")))
+
+    def test_neednodes(self):
+        """
+        Check that the node properties are picked out of neednodes values.
+        """
+        self.assertEquals(parseNeednodes('uct2'), ['uct2'])
+        self.assertEquals(parseNeednodes('2:ppn=8:bigmem:ib'), ['bigmem',
+            'ib'])
+        self.assertEquals(parseNeednodes('node1:ppn=2+2:ib'), ['node1'])
+        self.assertEquals(parseNeednodes('1'), [])
+
+    def test_node_table(self):
+        """
+        Check the per-node table and the totals computed from it, for both
+        PBSPro (red) and Torque (lbl).
+        """
+        old_commands = dict(gip_testing.commands)
+        try:
+            os.environ['GIP_TESTING'] = '1'
+            gip_testing.commands.clear()
+            cp = config("test_configs/red.conf")
+            nodes = getNodeTable(cp, "PBSPro_9.1")
+            self.assertEquals(len(nodes), 113)
+            self.assertEquals(nodes[-1].name, "node113")
+            self.assertEquals(parseNodes(cp, "PBSPro_9.1"), (452, 193,
+                {'pushpa': [20, 20], 'lcgadmin': [4, 4]}))
+
+            os.environ['GIP_TESTING'] = 'suffix=lbl'
+            gip_testing.commands.clear()
+            self.assertEquals(parseNodes(cp, "2.1.8")[:2], (60, 51))
+
+            # Torque nodes are mapped to the queues by their properties.
+            os.environ['GIP_TESTING'] = 'suffix=mwt2'
+            gip_testing.commands.clear()
+            queueInfo = {'uct2': {'neednodes': parseNeednodes('uct2')},
+                'bigmem': {'neednodes': parseNeednodes('1:ppn=8:uct2:bigmem')},
+                'prod': {}}
+            totalCpu, freeCpu, queueCpu = parseNodes(cp, "2.3.6", queueInfo)
+            self.assertEquals(queueCpu, {'uct2': [totalCpu, freeCpu]})
+            self.failUnless(totalCpu > 0)
+        finally:
+            os.environ['GIP_TESTING'] = '1'
+            gip_testing.commands.clear()
+            gip_testing.commands.update(old_commands)
+
     def make_site_tester(site):
         def test_site_entries(self):
             """
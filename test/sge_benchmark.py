@@ -0,0 +1,144 @@
+#!/usr/bin/env python
+
+"""
+Replay the recorded SGE qstat XML through the streaming SAX handlers, and
+compare counting the jobs as they stream in against building the full job
+list first.
+
+The job of the recorded qstat -xml output in test/command_output is repeated
+until the output holds the requested number of jobs (100000 by default),
+spread over the cluster queues and a few owners; the queue instances of the
+recorded qstat -f -xml output are repeated 10 times:
+
+    ./sge_benchmark.py [jobs]
+"""
+
+import os
+import sys
+import time
+import resource
+import cStringIO
+from xml.sax.handler import ContentHandler
+
+sys.path.insert(0, os.path.expandvars("$GIP_LOCATION/lib/python"))
+from xml_common import parseXmlSax
+from sge_sax_handler import QueueInfoParser, JobInfoParser
+
+owners = ['bbockelm', 'cmsprod', 'uscms01', 'osg', 'localuser']
+
+def fixture(name):
+    return open(os.path.expandvars("$GIP_LOCATION/../test/command_output/%s" \
+        % name)).read()
+
+def queueOutput(copies):
+    """
+    Repeat the queue instances of the recorded qstat -f -xml output.
+    """
+    output = fixture("qstat_f_xml")
+    start = output.index('<Queue-List>')
+    end = output.rindex('</Queue-List>') + len('</Queue-List>')
+    return output[:start] + output[start:end] * copies + output[end:]
+
+def jobOutput(jobs, queues):
+    """
+    Repeat the job of the recorded qstat -xml output, running in each of the
+    queues in turn or pending.
+    """
+    output = fixture("qstat_xml")
+    start = output.index('<job_list')
+    end = output.rindex('</job_list>') + len('</job_list>')
+    job = output[start:end]
+    body = []
+    for i in range(jobs):
+        queue = (queues + [''])[i % (len(queues) + 1)]
+        if queue:
+            state = 'r'
+            queue = '%s@node%i' % (queue, i % 100)
+        else:
+            state = 'qw'
+        body.append(job.replace('bbockelm', owners[i % len(owners)]). \
+            replace('<state>qw', '<state>%s' % state). \
+            replace('<queue_name>', '<queue_name>%s' % queue))
+    return output[:start] + '\n'.join(body) + output[end:]
+
+class JobListParser(ContentHandler):
+    """
+    Build the full list of jobs, one dictionary per job.
+    """
+
+    def startDocument(self):
+        self.jobs = []
+        self.job = {}
+
+    def startElement(self, name, attrs):
+        self.contents = ''
+        if name == 'job_list':
+            self.job = {}
+
+    def endElement(self, name):
+        if name == 'job_list':
+            self.jobs.append(self.job)
+        else:
+            self.job[str(name)] = str(self.contents)
+
+    def characters(self, ch):
+        self.contents += ch
+
+def countJobList(output):
+    handler = JobListParser()
+    parseXmlSax(cStringIO.StringIO(output), handler)
+    counts = {}
+    for job in handler.jobs:
+        queue = job.get('queue_name', '').split('@')[0].strip() or 'waiting'
+        key = (job.get('JB_owner', ''), queue, job.get('state') == 'r')
+        counts[key] = counts.get(key, 0) + 1
+    return counts
+
+def countStreaming(output):
+    handler = JobInfoParser()
+    parseXmlSax(cStringIO.StringIO(output), handler)
+    return handler.getJobCounts()
+
+def timeCount(count, output):
+    """
+    Count the jobs in output with the given function.
+
+    @returns: The elapsed time, the growth of the peak memory in kB, and the
+        job counts.
+    """
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.time()
+    counts = count(output)
+    return time.time() - start, \
+        resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - rss, counts
+
+def main():
+    jobs = 100000
+    if len(sys.argv) > 1:
+        jobs = int(sys.argv[1])
+
+    handler = QueueInfoParser()
+    output = queueOutput(10)
+    start = time.time()
+    parseXmlSax(cStringIO.StringIO(output), handler)
+    queue_time = time.time() - start
+    queues = [i for i in handler.getQueueInfo() if i != 'waiting']
+    print "qstat -f -xml: %i bytes in %.3f seconds" % (len(output),
+        queue_time)
+
+    output = jobOutput(jobs, queues)
+    # The streaming count goes first, so the job list cannot hide its
+    # memory use in the peak of an earlier run.
+    stream_time, stream_mem, stream_counts = timeCount(countStreaming, output)
+    list_time, list_mem, list_counts = timeCount(countJobList, output)
+    if stream_counts != list_counts:
+        print >> sys.stderr, "Job counts differ: %s != %s" % (stream_counts,
+            list_counts)
+        sys.exit(1)
+    print "Job list:  %i jobs in %.3f seconds, %i kB more memory" % (jobs,
+        list_time, list_mem)
+    print "Streaming: %i jobs in %.3f seconds, %i kB more memory" % (jobs,
+        stream_time, stream_mem)
+
+if __name__ == '__main__':
+    main()
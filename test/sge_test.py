@@ -8,7 +8,7 @@ os.environ['GIP_TESTING'] = '1'
 sys.path.append(os.path.expandvars("$GIP_LOCATION/lib/python"))
 from gip_sets import Set
 from gip_common import config, cp_get
-from sge_common import getVoQueues
+from sge_common import getVoQueues, getQueueInfo, getJobsInfo
 from gip_ldap import read_ldap
 from gip_testing import runTest, streamHandler
 import gip_testing
@@ -44,6 +44,35 @@ class TestSGEDynamic(unittest.TestCase):
                 self.failIf(contact_string.endswith("jobmanager-sge"), \
                     "Contact string must include the queue.")
 
+    def test_queue_info(self):
+        """
+        Make sure the queue instances are summed per cluster queue, and each
+        cluster queue gets the limits from its qconf configuration.
+        """
+        os.environ['GIP_TESTING'] = '1'
+        cp = config("test_configs/pf-sge.conf")
+        queue_list, _ = getQueueInfo(cp)
+        self.assertEquals(len(queue_list), 8)
+        pf24h = queue_list['pf24h']
+        self.assertEquals(pf24h['slots_total'], 312)
+        self.assertEquals(pf24h['slots_free'], 216)
+        self.assertEquals(pf24h['max_wall'], 86400)
+        self.assertEquals(queue_list['chandra']['user_list'], ['chandra'])
+        self.assertEquals(queue_list['myrinet']['user_list'], [])
+        self.assertEquals(queue_list['waiting'], {'waiting': 0})
+
+    def test_jobs_info(self):
+        """
+        Make sure pending jobs are counted against the waiting queue, under
+        their owner's VO.
+        """
+        os.environ['GIP_TESTING'] = '1'
+        cp = config("test_configs/pf-sge.conf")
+        queue_jobs = getJobsInfo({'bbockelm': 'CMS'}, cp)
+        self.assertEquals(queue_jobs, {'waiting': {'cms': {'running': 0,
+            'wait': 1, 'total': 1, 'vo': 'cms'}}})
+        self.assertEquals(getJobsInfo({}, cp), {})
+
 def main():
     """
     The main entry point for when sge_test is run in standalone mode.
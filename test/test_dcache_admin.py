@@ -0,0 +1,174 @@
+#!/usr/bin/env python
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+import unittest
+
+if 'GIP_LOCATION' in os.environ:
+    sys.path.insert(0, os.path.expandvars("$GIP_LOCATION/lib/python"))
+from gip_common import config, getLogger
+from gip_testing import runTest, streamHandler
+import gip.dcache.admin as admin
+import gip.dcache.pools as pools
+from gip.dcache.pools import Pool
+
+fake_admin = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+    "fake_dcache_admin.py")
+
+class TestDCacheAdmin(unittest.TestCase):
+
+    def setUp(self):
+        self.old_command = admin.ssh_command
+        admin.ssh_command = fake_admin
+        self.connection = None
+        self.connect(3)
+        self.tmpdir = tempfile.mkdtemp()
+        self.cp = config("test_configs/red.conf")
+        if not self.cp.has_section("dcache_admin"):
+            self.cp.add_section("dcache_admin")
+        self.cp.set("dcache_admin", "pool_cache", os.path.join(self.tmpdir,
+            "pools.cache"))
+        self.log = getLogger("GIP.dCache.Pools")
+        pools._pools_cache = []
+
+    def tearDown(self):
+        admin.ssh_command = self.old_command
+        if 'FAKE_DCACHE_HANG' in os.environ:
+            del os.environ['FAKE_DCACHE_HANG']
+        self.connection.logoff()
+        os.waitpid(self.connection.pid, 0)
+        shutil.rmtree(self.tmpdir)
+        pools._pools_cache = []
+
+    def connect(self, pool_count):
+        """
+        Replace the connection with one to a fake dCache with pool_count
+        pools.
+        """
+        if self.connection is not None:
+            self.connection.logoff()
+            os.waitpid(self.connection.pid, 0)
+        os.environ['FAKE_DCACHE_POOLS'] = str(pool_count)
+        self.connection = admin.Admin({'Interface': 'dCache',
+            'AdminHost': 'localhost'})
+
+    def lookup(self):
+        pools._pools_cache = []
+        return dict([(pool.poolName, pool) for pool in \
+            pools.lookupPoolStorageInfo(self.connection, self.log, self.cp)])
+
+    def test_execute(self):
+        """
+        Check that execute returns just the output of the command, and raises
+        for errors.
+        """
+        pools = self.connection.execute('PoolManager', 'cm ls')
+        self.assertEquals([i.split('=')[0] for i in pools.splitlines()],
+            ['pool1', 'pool2', 'pool3', 'pool_down'])
+        pool = Pool('pool2', self.connection.execute('pool2', 'info', ['-l']))
+        self.assertEquals(pool.totalSpaceKB, 2*1024**2)
+        self.assertEquals(pool.pnfsRoot, '/dcache/pool2')
+        self.assertRaises(Exception, self.connection.execute, 'pool_down',
+            'info')
+        self.assertRaises(Exception, self.connection.execute, 'pool1',
+            'no such command')
+        # The connection is still usable after errors.
+        self.assertEquals(self.connection.execute('PoolManager', 'cm ls'),
+            pools)
+        # Arguments must be single words, so they cannot smuggle in another
+        # command.
+        self.assertEquals(self.connection.command_line('info', ['-l']),
+            'info -l')
+        self.assertRaises(Exception, self.connection.command_line, 'info',
+            ['-l; rep ls'])
+        self.assertRaises(Exception, self.connection.command_line, 'info',
+            ['-l\n..'])
+
+    def test_execute_many(self):
+        """
+        Check that pipelined commands give the same output as running them
+        one at a time, and that a failed command does not stop the others.
+        """
+        requests = [(pool, 'info -l', []) for pool in ['pool1', 'pool_down',
+            'pool3']] + [('PoolManager', 'cm ls', []), ('pool3', 'info', [])]
+        results = self.connection.execute_many(requests, window=4)
+        self.assertEquals(results[1], None)
+        for (cell, command, args), result in zip(requests, results):
+            if cell != 'pool_down':
+                self.assertEquals(result, self.connection.execute(cell,
+                    command, args))
+
+    def test_parallel(self):
+        """
+        Check that the pools fetched over parallel connections match the ones
+        fetched one at a time, leaving out the pool which does not answer.
+        """
+        self.connect(20)
+        found = self.lookup()
+        self.assertEquals(len(found), 20)
+        self.failIf('pool_down' in found)
+        for name in ['pool1', 'pool7', 'pool20']:
+            expected = Pool(name, self.connection.execute(name, 'info', ['-l']))
+            self.assertEquals(repr(found[name]), repr(expected))
+        self.cp.set("dcache_admin", "pool_cache_ttl", "0")
+        self.cp.set("dcache_admin", "pool_connections", "1")
+        serial = self.lookup()
+        self.assertEquals(sorted(serial.keys()), sorted(found.keys()))
+
+    def test_cache(self):
+        """
+        Check that a pool is only fetched again once its line in cm ls
+        changes.
+        """
+        self.connect(20)
+        self.lookup()
+        filename = pools.poolCacheFile(self.cp)
+        cached = pools.loadPoolCache(filename)
+        self.assertEquals(len(cached), 20)
+        summary, timestamp, info = cached['pool3']
+        cached['pool3'] = (summary, timestamp, info.replace('Total' \
+            '             : 3G', 'Total             : 5G'))
+        summary, timestamp, info = cached['pool4']
+        cached['pool4'] = ('pool4={}', timestamp, info.replace('Total' \
+            '             : 4G', 'Total             : 5G'))
+        pools.savePoolCache(filename, cached, self.log)
+        found = self.lookup()
+        # pool3 is unchanged in cm ls, so its cached information is used.
+        self.assertEquals(found['pool3'].totalSpaceKB, 5*1024**2)
+        self.assertEquals(found['pool4'].totalSpaceKB, 4*1024**2)
+        self.cp.set("dcache_admin", "pool_cache_ttl", "0")
+        self.assertEquals(self.lookup()['pool3'].totalSpaceKB, 3*1024**2)
+
+    def test_hanging_pool(self):
+        """
+        Check that a pool which stops the admin interface from answering is
+        skipped after the pool timeout, without losing the other pools or
+        the caller's connection, with and without parallel connections.
+        """
+        os.environ['FAKE_DCACHE_HANG'] = '1'
+        self.connect(20)
+        self.cp.set("dcache_admin", "pool_timeout", "1")
+        self.cp.set("dcache_admin", "pool_cache_ttl", "0")
+        for connections in ['1', '3']:
+            self.cp.set("dcache_admin", "pool_connections", connections)
+            start = time.time()
+            found = self.lookup()
+            elapsed = time.time() - start
+            self.assertEquals(len(found), 20)
+            self.failIf('pool_hang' in found)
+            self.failUnless(elapsed < 15, msg="Looking up the pools took " \
+                "%.1f seconds" % elapsed)
+            self.assertEquals(repr(found['pool20']), repr(Pool('pool20',
+                self.connection.execute('pool20', 'info', ['-l']))))
+
+def main():
+    os.environ['GIP_TESTING'] = '1'
+    cp = config("test_configs/red.conf")
+    stream = streamHandler(cp)
+    runTest(cp, TestDCacheAdmin, stream, per_site=False)
+
+if __name__ == '__main__':
+    main()
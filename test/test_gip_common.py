@@ -1,7 +1,10 @@
 #!/usr/bin/env python
 
 import os
+import re
 import sys
+import time
+import cStringIO
 import unittest
 import shutil
 import traceback
@@ -12,11 +15,13 @@ import ConfigParser
 
 from gip_sets import Set
 import gip_sets as sets
-from gip_common import config, cp_get, cp_getBoolean, voList, configContents
+from gip_common import config, cp_get, cp_getBoolean, voList, configContents, \
+    getTemplate, printTemplate, VoMapper
 from gip_cluster import getOSGVersion, getApplications
 from gip_testing import runTest, streamHandler
 import gip_testing
 import gip_osg
+import gip_common
 
 fermigrid_vos = sets.Set(['osg', 'cdms', 'lqcd', 'auger', 'i2u2', 'cdf', 'des',
     'dzero', 'nanohub', 'grase', 'cms', 'fermilab', 'astro', 'accelerator',
@@ -82,6 +87,108 @@ class TestGipCommon(unittest.TestCase):
             shutil.rmtree(tmpdir)
             os.environ['GIP_LOCATION'] = old_gip_location
 
+    def test_config_cache(self):
+        """
+        Make sure the config is built once, and that the config cache skips
+        the OSG config translation until a source file changes.
+        """
+        cp = config()
+        cp.set("gip", "test_config_cache", "True")
+        self.failIf(config().has_option("gip", "test_config_cache"))
+
+        old_gip_location = os.environ['GIP_LOCATION']
+        old_configOsg = gip_osg.configOsg
+        tmpdir = tempfile.mkdtemp()
+        calls = []
+        def configOsg(cp):
+            calls.append(cp)
+            old_configOsg(cp)
+        try:
+            os.environ['GIP_LOCATION'] = tmpdir
+            gip_osg.configOsg = configOsg
+            etc_dir = os.path.join(tmpdir, 'etc')
+            os.mkdir(etc_dir)
+            config_ini = os.path.join(tmpdir, 'config.ini')
+            fp = open(os.path.join(etc_dir, 'gip.conf'), 'w')
+            fp.write("[gip]\nosg_config = %s\nconfig_cache = %s\n" % \
+                (config_ini, os.path.join(tmpdir, 'config.cache')))
+            fp.close()
+            fp = open(config_ini, 'w')
+            fp.write("[Condor]\nvalue = 1\n")
+            fp.close()
+
+            self.assertEquals(config().get("condor", "value"), "1")
+            self.assertEquals(len(calls), 1)
+            # A new process starts with no configs in memory.
+            gip_common._configs.clear()
+            self.assertEquals(config().get("condor", "value"), "1")
+            self.assertEquals(len(calls), 1)
+
+            fp = open(config_ini, 'w')
+            fp.write("[Condor]\nvalue = 22\n")
+            fp.close()
+            self.assertEquals(config().get("condor", "value"), "22")
+            self.assertEquals(len(calls), 2)
+        finally:
+            gip_osg.configOsg = old_configOsg
+            gip_common._configs.clear()
+            shutil.rmtree(tmpdir)
+            os.environ['GIP_LOCATION'] = old_gip_location
+
+    def test_vo_map_index(self):
+        """
+        Make sure the indexed user-to-VO map agrees with the map file, and
+        that the index is rebuilt when the map changes.
+        """
+        tmpdir = tempfile.mkdtemp()
+        try:
+            map_file = os.path.join(tmpdir, 'user-vo-map')
+            index_file = os.path.join(tmpdir, 'user-vo-map.idx')
+            users = {}
+            fp = open(map_file, 'w')
+            fp.write("#voi cms atlas\n#VOc CMS ATLAS\n# comment\n")
+            for i in range(1000):
+                user, vo = "user%03i" % ((i * 7) % 1000), "vo%i" % (i % 13)
+                users[user] = vo
+                fp.write("%s %s\n" % (user, vo))
+            fp.write("cmsprod uscms\nbadline\n")
+            fp.close()
+            users['cmsprod'] = 'cms'
+            cp = ConfigParser.ConfigParser()
+            cp.add_section("vo")
+            cp.set("vo", "user_vo_map", map_file)
+            cp.set("vo", "user_vo_map_index", index_file)
+
+            vo_map = VoMapper(cp)
+            self.failUnless(os.path.exists(index_file))
+            self.failIf(vo_map.index is None)
+            for user, vo in users.items():
+                self.assertEquals(vo_map[user], vo)
+            self.assertRaises(ValueError, vo_map.__getitem__, "user1000")
+            self.assertRaises(ValueError, vo_map.__getitem__, "a")
+            self.assertRaises(ValueError, vo_map.__getitem__, "zzz")
+            self.assertEquals(vo_map.voi, ['cms', 'atlas'])
+            self.assertEquals(vo_map.userMap, users)
+            vos = Set(vo_map.vos)
+            self.assertEquals(len(vos), len(vo_map.vos))
+            self.assertEquals(vos, Set(users.values()))
+
+            # Changing the map rebuilds the index.
+            fp = open(map_file, 'a')
+            fp.write("user999 newvo\n")
+            fp.close()
+            self.assertEquals(VoMapper(cp)["user999"], "newvo")
+
+            # Without a writable index, the map is parsed into memory.
+            cp.set("vo", "user_vo_map_index", os.path.join(tmpdir, 'missing',
+                'user-vo-map.idx'))
+            vo_map = VoMapper(cp)
+            self.assertEquals(vo_map.index, None)
+            self.assertEquals(vo_map["user999"], "newvo")
+            self.assertEquals(vo_map["cmsprod"], "cms")
+        finally:
+            shutil.rmtree(tmpdir)
+
     def test_gip_conf(self):
         """
         Make sure that the $GIP_LOCATION/etc/gip.conf file is read.
@@ -183,6 +290,69 @@ class TestGipCommon(unittest.TestCase):
         if found_osg == False:
             self.fail(msg="OSG version not in software list!")
         
+    def test_templates(self):
+        """
+        Make sure the cached templates match the entries in the template
+        files, and that rendering them is fast.
+        """
+        template_dir = os.path.expandvars("$GIP_LOCATION/templates")
+        for template in os.listdir(template_dir):
+            if not template.startswith("Glue"):
+                continue
+            text = open(os.path.join(template_dir, template)).read()
+            for line in text.splitlines():
+                if not line.startswith("dn: "):
+                    continue
+                name = line[4:].split('=')[0]
+                start = text.index("dn: " + name)
+                end = text.find("\n\n", start)
+                if end < 0:
+                    expected = text[start:-1]
+                else:
+                    expected = text[start:end+1]
+                self.assertEquals(getTemplate(template, name), expected)
+        self.assertRaises(ValueError, getTemplate, "GlueCE", "NoSuchDN")
+
+        # A local template directory takes precedence over the defaults, even
+        # once the default template has been read.
+        tmpdir = tempfile.mkdtemp()
+        try:
+            fp = open(os.path.join(tmpdir, "GlueCE"), "w")
+            fp.write("dn: GlueCEUniqueID=%(ceUniqueID)s\nlocal: yes\n\n")
+            fp.close()
+            cp = ConfigParser.ConfigParser()
+            cp.add_section("gip")
+            cp.set("gip", "local_template_dirs", tmpdir)
+            self.assertEquals(getTemplate("GlueCE", "GlueCEUniqueID", cp),
+                "dn: GlueCEUniqueID=%(ceUniqueID)s\nlocal: yes\n")
+        finally:
+            shutil.rmtree(tmpdir)
+        self.failIf("local: yes" in getTemplate("GlueCE", "GlueCEUniqueID"))
+
+        stdout = sys.stdout
+        sys.stdout = cStringIO.StringIO()
+        try:
+            printTemplate("dn: a=%(a)s\nb: %(b)s\nc: %(c)s\n", {'a': 1,
+                'b': '__GIP_DELETEME', 'c': 3})
+            output = sys.stdout.getvalue()
+        finally:
+            sys.stdout = stdout
+        self.assertEquals(output, "dn: a=1\nc: 3\n\n")
+
+        template = getTemplate("GlueCE", "GlueVOViewLocalID")
+        info = dict([(key, key) for key in re.findall(r'%\((\w+)\)s',
+            template)])
+        sys.stdout = cStringIO.StringIO()
+        try:
+            start = time.time()
+            for i in range(10000):
+                info['voLocalID'] = str(i)
+                printTemplate(template, info)
+            elapsed = time.time() - start
+        finally:
+            sys.stdout = stdout
+        self.failUnless(elapsed < 1, msg="Rendering 10000 VOViews took " \
+            "%.2f seconds" % elapsed)
 
 def main():
     os.environ['GIP_TESTING'] = '1'
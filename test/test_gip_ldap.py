@@ -8,7 +8,8 @@ import unittest
 sys.path.append(os.path.expandvars("$GIP_LOCATION/lib/python"))
 from gip_testing import runTest, streamHandler
 from gip_common import config
-from gip_ldap import read_ldap, compareDN, prettyDN 
+from gip_ldap import read_ldap, iter_ldap, write_ldap, compareDN, dnKey, \
+    prettyDN
 
 class TestGipLdap(unittest.TestCase):
     def __init__(self, methodName):
@@ -68,6 +69,76 @@ GlueSiteSecurityContact: mailto: computer-security@fnal.gov
         # test 2 dns neither starting with mds-vo-name but are different
         self.run_compareDN(self.alterStanza1, self.alterStanza2)
 
+    def test_dn_key(self):
+        """
+        Make sure dnKey agrees with compareDN for every pair of stanzas.
+        """
+        stanzas = [self.originalStanza1, self.originalStanza2,
+            self.originalStanza3, self.alterStanza1, self.alterStanza2,
+            self.alterStanza1.replace("mds-vo-name=local", "mds-vo-name=FNAL")]
+        entries = []
+        for stanza in stanzas:
+            entries += read_ldap(cStringIO.StringIO(stanza), multi=True)
+        for entry1 in entries:
+            for entry2 in entries:
+                self.assertEquals(compareDN(entry1, entry2),
+                    dnKey(entry1) == dnKey(entry2), msg="dnKey and compareDN"\
+                    " disagree.\n\nDN1: %s \nDN2: %s" % (prettyDN(entry1.dn),
+                    prettyDN(entry2.dn)))
+
+    def test_iter_ldap(self):
+        """
+        Make sure the streaming parser handles missing blank lines between
+        entries and folded (continuation) lines.
+        """
+        ldif = "dn: GlueSiteUniqueID=A,mds-vo-name=local,o=grid\n" \
+            "GlueSiteName: A\n" \
+            "dn: GlueSiteUniqueID=B,mds-vo-name=local,o=grid\n" \
+            "GlueSiteDescription: folded\n" \
+            "  description\n\n\n" \
+            "dn: GlueSiteUniqueID=C,\n" \
+            " mds-vo-name=local,o=grid\n" \
+            "GlueSiteName: C"
+        entries = iter_ldap(cStringIO.StringIO(ldif), multi=True)
+        self.failIf(isinstance(entries, list), msg="iter_ldap is not lazy.")
+        entries = list(entries)
+        self.assertEquals(len(entries), 3)
+        self.assertEquals(entries[0].glue['SiteName'], ('A',))
+        self.assertEquals(entries[1].glue['SiteDescription'],
+            ('folded description',))
+        self.assertEquals(entries[2].dn, ('GlueSiteUniqueID=C',
+            'mds-vo-name=local', 'o=grid'))
+        self.assertEquals(entries[2].glue['SiteName'], ('C',))
+
+    def test_compact_entry(self):
+        """
+        Make sure LdapData entries only keep their LDIF on request, and that
+        the cached hash is consistent with equality.
+        """
+        entry1 = read_ldap(cStringIO.StringIO(self.alterStanza1), multi=True)[0]
+        entry2 = read_ldap(cStringIO.StringIO(self.alterStanza1), multi=True,
+            keep_ldif=True)[0]
+        self.failIf(hasattr(entry1, '__dict__'), msg="LdapData has a __dict__")
+        self.assertEquals(entry1.ldif, None)
+        self.assertEquals(entry2.ldif, self.alterStanza1.strip())
+        self.assertEquals(entry1, entry2)
+        self.assertEquals(hash(entry1), hash(entry2))
+        entry2.glue['SiteSecurityContact'] = ('mailto: root@fnal.gov', )
+        self.assertEquals(hash(entry1), hash(entry2))
+        self.assertNotEquals(entry1, entry2)
+
+    def test_write_ldap(self):
+        """
+        Make sure LDIF written by write_ldap reads back into the same entries.
+        """
+        ldif = self.originalStanza1 + "\n" + self.alterStanza1 + "\n" + \
+            self.alterStanza2
+        entries = read_ldap(cStringIO.StringIO(ldif), multi=True)
+        output = cStringIO.StringIO()
+        write_ldap(entries, output)
+        self.assertEquals(read_ldap(cStringIO.StringIO(output.getvalue()),
+            multi=True), entries)
+
 def main():
     os.environ['GIP_TESTING'] = '1'
     cp = config()